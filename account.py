@@ -1,32 +1,23 @@
 #!/usr/bin/env python3
-import os
-import json
+import csv
+import argparse
 from datetime import datetime
-import firebase_admin
-from firebase_admin import credentials, firestore
+from init_firebase import FirebaseManager
+from stats_service import StatsService
+from metrics import operation
+
+# Tên cột được chấp nhận trong file CSV / sheet tài khoản
+EMAIL_COLUMNS = ('email', 'mail')
+PHONE_COLUMNS = ('phone', 'sdt', 'so_dien_thoai', 'password')
+ROLE_COLUMNS = ('role', 'vai_tro')
 
 class AccountCreator:
-    def __init__(self):
-        self.db = None
-        self._init_firebase()
+    # Số tài khoản mỗi lần đọc + batch ghi (chừa chỗ cho thao tác stats)
+    CHUNK_SIZE = 400
     
-    def _init_firebase(self):
-        try:
-            if firebase_admin._apps:
-                self.db = firestore.client()
-                return
-            
-            firebase_config = os.getenv('FIREBASE_CONFIG')
-            if not firebase_config:
-                raise ValueError("Biến môi trường FIREBASE_CONFIG không tồn tại")
-            
-            config_dict = json.loads(firebase_config)
-            cred = credentials.Certificate(config_dict)
-            firebase_admin.initialize_app(cred)
-            self.db = firestore.client()
-            
-        except Exception as e:
-            raise Exception(f"Lỗi khởi tạo Firebase: {e}")
+    def __init__(self, firebase=None):
+        self.firebase = firebase or FirebaseManager()
+        self.stats = StatsService(self.firebase)
     
     def create_accounts_from_data(self):
         # Data từ bạn cung cấp
@@ -49,51 +40,203 @@ class AccountCreator:
         
         roles = ["admin"] + ["user"] * (len(emails) - 1)
         
-        # Clean phone numbers (remove spaces)
-        phones = [phone.replace(" ", "") for phone in phones]
+        if len(emails) != len(phones):
+            raise ValueError(f"Số email ({len(emails)}) khác số điện thoại ({len(phones)})")
         
-        created_count = 0
-        failed_count = 0
+        accounts = (
+            {'email': email, 'phone': phone, 'role': role}
+            for email, phone, role in zip(emails, phones, roles)
+        )
+        return self.provision_accounts(accounts)
+    
+    @operation('provision_accounts')
+    def provision_accounts(self, accounts, dry_run=False):
+        """
+        Tạo mới hoặc cập nhật tài khoản từ iterable các dict {'email', 'phone', 'role'}.
+        Mỗi chunk kiểm tra tài khoản đã tồn tại bằng một lần đọc rồi ghi bằng một batch:
+        - tài khoản mới: tạo đầy đủ
+        - tài khoản đã có: merge password/role, không đụng tới feedbacks và profile
+        - không thay đổi gì: bỏ qua, không ghi
+        Returns: dict {'created', 'updated', 'unchanged', 'failed'}
+        """
+        result = {'created': 0, 'updated': 0, 'unchanged': 0, 'failed': 0}
+        seen = set()
+        chunk = []
         
-        for i, (email, phone, role) in enumerate(zip(emails, phones, roles)):
+        for index, account in enumerate(accounts, 1):
             try:
-                self._create_single_account(email, phone, role)
-                created_count += 1
-                print(f"✅ [{i+1}/{len(emails)}] {email} ({role})")
-                
-            except Exception as e:
-                failed_count += 1
-                print(f"❌ [{i+1}/{len(emails)}] {email}: {e}")
-        
-        print(f"\n📊 Kết quả: {created_count} thành công, {failed_count} thất bại")
+                account = self._normalize_account(account)
+            except ValueError as e:
+                result['failed'] += 1
+                print(f"❌ [{index}] {e}")
+                continue
+            
+            user_id = self._make_user_id(account['email'])
+            if user_id in seen:
+                result['failed'] += 1
+                print(f"❌ [{index}] {account['email']}: trùng với dòng trước")
+                continue
+            seen.add(user_id)
+            
+            chunk.append((index, user_id, account))
+            if len(chunk) >= self.CHUNK_SIZE:
+                self._provision_chunk(chunk, result, dry_run)
+                chunk = []
+        
+        if chunk:
+            self._provision_chunk(chunk, result, dry_run)
+        
+        prefix = "[DRY RUN] " if dry_run else ""
+        print(
+            f"\n📊 {prefix}Kết quả: {result['created']} tạo mới, {result['updated']} cập nhật, "
+            f"{result['unchanged']} không đổi, {result['failed']} thất bại"
+        )
+        return result
     
-    def _create_single_account(self, email, phone, role):
-        # Tạo user_id từ email
-        user_id = email.replace('@', '_').replace('.', '_').replace(' ', '_')
+    def _provision_chunk(self, chunk, result, dry_run):
+        storage = self.firebase.storage
+        existing = storage.get_users([user_id for _, user_id, _ in chunk])
+        
+        write_batch = storage.batch()
+        op_count = 0
+        new_students = 0
+        outcomes = []
+        
+        for index, user_id, account in chunk:
+            current = existing.get(user_id)
+            if current is None:
+                write_batch.set_user(user_id, self._new_account_data(account))
+                op_count += 1
+                if account['role'] == 'user':
+                    new_students += 1
+                outcomes.append((index, account, 'created'))
+                continue
+            
+            changes = self._account_changes(current, account)
+            if not changes:
+                outcomes.append((index, account, 'unchanged'))
+                continue
+            
+            # merge=True chỉ ghi đè các field được truyền vào, giữ nguyên feedbacks
+            write_batch.set_user(user_id, changes, merge=True)
+            op_count += 1
+            if account['role'] == 'user' and current.get('role') != 'user':
+                new_students += 1
+            elif account['role'] != 'user' and current.get('role') == 'user':
+                new_students -= 1
+            outcomes.append((index, account, 'updated'))
         
+        try:
+            if op_count and not dry_run:
+                self.stats.add_increments(write_batch, students=new_students)
+                write_batch.commit()
+            
+            for index, account, outcome in outcomes:
+                result[outcome] += 1
+                if outcome != 'unchanged':
+                    print(f"✅ [{index}] {account['email']} ({account['role']}) - {outcome}")
+            
+        except Exception as e:
+            for index, account, _ in outcomes:
+                result['failed'] += 1
+                print(f"❌ [{index}] {account['email']}: {e}")
+    
+    def _normalize_account(self, account):
+        email = (account.get('email') or '').replace(' ', '')
+        phone = (account.get('phone') or '').replace(' ', '')
+        role = (account.get('role') or 'user').strip().lower()
+        
+        if '@' not in email:
+            raise ValueError(f"Email không hợp lệ: '{email}'")
+        if not phone:
+            raise ValueError(f"{email}: thiếu số điện thoại")
+        if role not in ('user', 'admin'):
+            raise ValueError(f"{email}: role không hợp lệ '{role}'")
+        
+        return {'email': email, 'phone': phone, 'role': role}
+    
+    def _make_user_id(self, email):
+        # Tạo user_id từ email (same rule với import sheet)
+        return email.replace('@', '_').replace('.', '_').replace(' ', '_')
+    
+    def _new_account_data(self, account):
         account_data = {
-            'email': email,
-            'password': phone,
-            'role': role,
+            'email': account['email'],
+            'password': account['phone'],
+            'role': account['role'],
             'created_at': datetime.now().isoformat(),
             'active': True,
             'profile': {
                 'ho_ten': '',
                 'lop': '',
-                'phone': phone
+                'phone': account['phone']
             }
         }
         
-        if role == 'user':
+        if account['role'] == 'user' and self.firebase.storage.embeds_feedbacks:
             account_data['feedbacks'] = []
         
-        # Lưu vào Firestore
-        doc_ref = self.db.collection('users').document(user_id)
-        doc_ref.set(account_data)
+        return account_data
+    
+    def _account_changes(self, current, account):
+        """Các field cần merge vào tài khoản đã tồn tại, {} nếu không có gì thay đổi"""
+        changes = {}
+        if current.get('password') != account['phone']:
+            changes['password'] = account['phone']
+        if current.get('role') != account['role']:
+            changes['role'] = account['role']
+        # profile.phone chỉ được đặt khi tạo tài khoản, sau đó do import đồng bộ từ cột SĐT của sheet
+        if not current.get('active', False):
+            changes['active'] = True
+        return changes
+    
+    def read_accounts_csv(self, path):
+        """Đọc tài khoản từ file CSV (có header), trả về generator"""
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            for row in csv.DictReader(f):
+                yield self._account_from_row(row)
+    
+    def read_accounts_sheet(self, sheet_id, tab=None):
+        """Đọc tài khoản từ một tab Google Sheets (dòng đầu là header), trả về generator"""
+        from ggsheet_extract import GoogleSheetsExtractor
+        
+        extractor = GoogleSheetsExtractor(firebase=self.firebase)
+        values = extractor.read_tab_values(sheet_id, tab)
+        if not values:
+            return
+        
+        headers = values[0]
+        for row in values[1:]:
+            yield self._account_from_row(dict(zip(headers, row)))
+    
+    def _account_from_row(self, row):
+        columns = {key.strip().lower(): (value or '').strip() for key, value in row.items() if key}
+        
+        def pick(names):
+            for name in names:
+                if columns.get(name):
+                    return columns[name]
+            return ''
+        
+        return {'email': pick(EMAIL_COLUMNS), 'phone': pick(PHONE_COLUMNS), 'role': pick(ROLE_COLUMNS)}
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tạo/cập nhật tài khoản hàng loạt")
+    parser.add_argument('--csv', help="File CSV có các cột email, phone (hoặc sdt), role")
+    parser.add_argument('--sheet', help="URL hoặc ID Google Sheets chứa danh sách tài khoản")
+    parser.add_argument('--tab', help="Tên tab trong sheet (mặc định tab đầu tiên)")
+    parser.add_argument('--dry-run', action='store_true', help="Chỉ kiểm tra, không ghi dữ liệu")
+    args = parser.parse_args()
+    
     try:
         creator = AccountCreator()
-        creator.create_accounts_from_data()
+        if args.csv:
+            creator.provision_accounts(creator.read_accounts_csv(args.csv), dry_run=args.dry_run)
+        elif args.sheet:
+            from ggsheet_extract import parse_sheet_id
+            accounts = creator.read_accounts_sheet(parse_sheet_id(args.sheet), args.tab)
+            creator.provision_accounts(accounts, dry_run=args.dry_run)
+        else:
+            creator.create_accounts_from_data()
     except Exception as e:
         print(f"❌ Lỗi: {e}")
\ No newline at end of file
@@ -1,17 +1,29 @@
 #!/usr/bin/env python3
+import os
+import json
+import time
+import tempfile
+from datetime import date, timedelta
 import streamlit as st
-from feedback_service import UserFeedbackService
-from ggsheet_extract import GoogleSheetsExtractor
+from resources import (
+    get_feedback_service, get_sheets_extractor, get_import_jobs, get_stats_service, get_search_index,
+    get_feedback_index, get_feedback_exporter, start_warm_up
+)
+from ggsheet_extract import parse_sheet_id
+from import_jobs import JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED
+from metrics import MEASURE_PAYLOAD, io_metrics, startup_timings
+from storage import FEEDBACK_SUMMARY_FIELDS
+
+# Số feedback mỗi lần tải trên dashboard học sinh
+FEEDBACK_PAGE_SIZE = 10
+# Số feedback mỗi trang ở mục duyệt feedback của admin
+BROWSER_PAGE_SIZE = 25
 
 def main():
     st.set_page_config(page_title="TCE Feedback System", layout="wide")
     
-    # Initialize services
-    if 'feedback_service' not in st.session_state:
-        st.session_state.feedback_service = UserFeedbackService()
-    
-    if 'ggsheet_extractor' not in st.session_state:
-        st.session_state.ggsheet_extractor = GoogleSheetsExtractor()
+    # Khởi tạo Firebase trên thread nền trong lúc trang login hiển thị (chỉ lần đầu của process)
+    start_warm_up()
     
     # Check login status
     if 'logged_in' not in st.session_state:
@@ -38,9 +50,10 @@ def show_login_page():
         
         if submit:
             if email and password:
-                user_data = st.session_state.feedback_service.authenticate_user(email, password)
+                user_data = get_feedback_service().authenticate_user(email, password)
                 
                 if user_data:
+                    reset_feedback_state()
                     st.session_state.logged_in = True
                     st.session_state.user_data = user_data
                     st.success(f"Đăng nhập thành công! Chào {user_data.get('profile', {}).get('ho_ten', email)}")
@@ -56,45 +69,105 @@ def show_user_dashboard():
     profile = st.session_state.user_data.get('profile', {})
     st.title(f"Hi {profile.get('ho_ten', 'bạn')}! - Class: {profile.get('lop', 'N/A')}")
 
-    if st.button("Đăng xuất"):
-        st.session_state.logged_in = False
-        st.session_state.user_data = None
-        st.rerun()
+    col1, col2 = st.columns([1, 1])
+    
+    with col1:
+        if st.button("Đăng xuất"):
+            st.session_state.logged_in = False
+            st.session_state.user_data = None
+            reset_feedback_state()
+            st.rerun()
+    
+    with col2:
+        if st.button("Làm mới"):
+            reset_feedback_state()
+            st.rerun()
     
     st.divider()
     
-    # Get and display feedbacks
+    # Get and display feedbacks (tải trang đầu, các trang sau tải khi bấm "Xem thêm")
     email = st.session_state.user_data['email']
-    feedbacks = st.session_state.feedback_service.get_user_feedbacks(email)
+    # Danh sách chỉ đọc các field tóm tắt, nội dung đầy đủ tải khi mở từng feedback
+    if 'feedbacks' not in st.session_state:
+        feedbacks, cursor = get_feedback_service().get_user_feedbacks_page(
+            email, FEEDBACK_PAGE_SIZE, fields=FEEDBACK_SUMMARY_FIELDS
+        )
+        st.session_state.feedbacks = feedbacks
+        st.session_state.feedback_cursor = cursor
+        st.session_state.feedback_bodies = {}
+        st.session_state.open_feedbacks = set()
+    
+    feedbacks = st.session_state.feedbacks
+    has_more = st.session_state.feedback_cursor is not None
     
     if feedbacks:
-        st.subheader(f"Feedback của bạn ({len(feedbacks)} bài)")
+        if has_more:
+            st.subheader(f"Feedback của bạn ({len(feedbacks)} bài gần nhất)")
+        else:
+            st.subheader(f"Feedback của bạn ({len(feedbacks)} bài)")
         
         for i, feedback in enumerate(feedbacks):
             with st.container():
-                st.markdown(f"### Bài {i+1}")
+                # Tóm tắt: thời gian, trạng thái, trích đoạn
+                title = f"**Bài {i+1}** · {feedback.get('thoi_gian', 'N/A')}"
+                if feedback.get('trang_thai'):
+                    title += f" · {feedback['trang_thai']}"
+                st.markdown(title)
+                if feedback.get('preview'):
+                    st.caption(feedback['preview'])
                 
-                # Thời gian
-                st.write(f"**Thời gian:** {feedback.get('thoi_gian', 'N/A')}")
-                
-                # Feedback content
-                feedback_content = feedback.get('noi_dung', '')
-                if feedback_content:
-                    st.markdown("**Feedback từ giáo viên:**")
-                    st.info(feedback_content)
-                else:
-                    st.warning("Chưa có feedback")
+                feedback_id = feedback.get('id')
+                is_open = feedback_id is not None and feedback_id in st.session_state.open_feedbacks
+                if feedback_id is not None and st.button("Thu gọn" if is_open else "Xem chi tiết", key=f"feedback_toggle_{i}"):
+                    st.session_state.open_feedbacks ^= {feedback_id}
+                    st.rerun()
                 
-                # Xem bài làm section
-                link = feedback.get('link_bai_lam', '')
-                if link:
-                    st.markdown("**Xem bài làm:**")
-                    st.text(link)
+                if is_open:
+                    show_feedback_body(email, feedback_id)
                 
                 st.divider()
+        
+        if has_more and st.button("Xem thêm"):
+            more, cursor = get_feedback_service().get_user_feedbacks_page(
+                email, FEEDBACK_PAGE_SIZE, st.session_state.feedback_cursor, fields=FEEDBACK_SUMMARY_FIELDS
+            )
+            st.session_state.feedbacks = feedbacks + more
+            st.session_state.feedback_cursor = cursor
+            st.rerun()
     else:
         st.info("Bạn chưa có feedback nào. Hãy nộp bài để nhận feedback từ giáo viên!")
 
+def show_feedback_body(email, feedback_id):
+    """Nội dung đầy đủ và link bài làm của một feedback, tải lần đầu khi mở rồi giữ trong session"""
+    bodies = st.session_state.feedback_bodies
+    if feedback_id not in bodies:
+        bodies[feedback_id] = get_feedback_service().get_feedback(email, feedback_id)
+    feedback = bodies[feedback_id]
+    if feedback is None:
+        st.warning("Không tải được feedback, hãy bấm Làm mới")
+        return
+    
+    # Feedback content
+    feedback_content = feedback.get('noi_dung', '')
+    if feedback_content:
+        st.markdown("**Feedback từ giáo viên:**")
+        st.info(feedback_content)
+    else:
+        st.warning("Chưa có feedback")
+    
+    # Xem bài làm section
+    link = feedback.get('link_bai_lam', '')
+    if link:
+        st.markdown("**Xem bài làm:**")
+        st.text(link)
+
+def reset_feedback_state():
+    """Xóa feedback đã tải trong session (khi đăng nhập/đăng xuất)"""
+    st.session_state.pop('feedbacks', None)
+    st.session_state.pop('feedback_cursor', None)
+    st.session_state.pop('feedback_bodies', None)
+    st.session_state.pop('open_feedbacks', None)
+
 def show_admin_dashboard():
     # Header
     col1, col2 = st.columns([3, 1])
@@ -115,52 +188,347 @@ def show_admin_dashboard():
     st.subheader("Import dữ liệu từ Google Sheets")
     
     with st.form("import_form"):
-        sheet_url = st.text_input(
-            "URL Google Sheets", 
-            placeholder="https://docs.google.com/spreadsheets/d/SHEET_ID/edit"
+        sheet_urls = st.text_area(
+            "URL Google Sheets (mỗi dòng một sheet)",
+            placeholder="https://docs.google.com/spreadsheets/d/SHEET_ID/edit\n"
+                        "https://docs.google.com/spreadsheets/d/SHEET_ID_2/edit | 10A1, 10A2"
+        )
+        tabs_input = st.text_input(
+            "Tabs mặc định",
+            placeholder="Để trống = tab đầu tiên, * = tất cả các tab, hoặc tên tab cách nhau bởi dấu phẩy",
+            help="Có thể chọn tab riêng cho từng sheet bằng cách thêm '| tab1, tab2' sau URL"
+        )
+        
+        full_reimport = st.checkbox(
+            "Import lại toàn bộ",
+            help="Bỏ qua watermark và đọc lại tất cả các dòng (dòng không thay đổi sẽ không bị ghi lại)"
         )
         
         submit = st.form_submit_button("Import dữ liệu")
         
-        if submit and sheet_url:
+        if submit and sheet_urls.strip():
             try:
-                # Extract sheet ID from URL
-                if '/d/' in sheet_url:
-                    sheet_id = sheet_url.split('/d/')[1].split('/')[0]
-                else:
-                    st.error("URL không hợp lệ!")
-                    return
+                # Mỗi dòng: URL [| tab1, tab2]
+                default_tabs = parse_tabs(tabs_input)
+                sources = []
+                for line in sheet_urls.splitlines():
+                    if not line.strip():
+                        continue
+                    url, _, tabs = line.partition('|')
+                    try:
+                        sheet_id = parse_sheet_id(url)
+                    except ValueError:
+                        st.error(f"URL không hợp lệ: {url.strip()}")
+                        return
+                    sources.append({'sheet_id': sheet_id, 'tabs': parse_tabs(tabs) or default_tabs})
                 
                 with st.spinner("Đang kiểm tra kết nối..."):
                     # Test connection
-                    if st.session_state.ggsheet_extractor.test_connection(sheet_id):
-                        st.success("Kết nối thành công!")
-                        
-                        with st.spinner("Đang import dữ liệu..."):
-                            # Extract and update
-                            st.session_state.ggsheet_extractor.extract_and_update_firebase(sheet_id)
-                            st.success("Import thành công!")
-                    else:
-                        st.error("Không thể kết nối đến Google Sheets!")
+                    for source in sources:
+                        if not get_sheets_extractor().test_connection(source['sheet_id']):
+                            st.error(f"Không thể kết nối đến Google Sheets {source['sheet_id']}!")
+                            return
+                
+                # Import chạy nền, không bị mất khi đóng tab
+                job_id = get_import_jobs().submit(
+                    sources,
+                    incremental=not full_reimport,
+                    created_by=st.session_state.user_data['email']
+                )
+                st.success(f"Kết nối thành công! Đã tạo import job {job_id}")
                         
             except Exception as e:
                 st.error(f"Lỗi: {e}")
     
+    show_import_jobs()
+    
+    show_feedback_browser()
+    
+    show_feedback_search()
+    
     # Stats section
     st.divider()
     st.subheader("Thống kê hệ thống")
     
-    # Simple stats (you can expand this)
+    # Counter được duy trì khi import/tạo tài khoản, chỉ đọc một document
+    # (đối soát định kỳ chạy ở thread nền, xem resources.start_stats_reconcile)
+    stats_service = get_stats_service()
+    stats = stats_service.get_stats()
+    
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        st.metric("Tổng số học sinh", "16")  # You can make this dynamic
+        st.metric("Tổng số học sinh", stats['students'])
     
     with col2:
-        st.metric("Số bài đã chấm", "45")  # You can make this dynamic
+        st.metric("Số bài đã chấm", stats['graded_submissions'])
     
     with col3:
-        st.metric("Hoạt động hôm nay", "12")  # You can make this dynamic
+        st.metric("Hoạt động hôm nay", stats['activity_today'])
+    
+    if st.button("Đối soát thống kê"):
+        stats_service.reconcile()
+        st.rerun()
+    
+    cache_stats = get_feedback_service().cache_stats()
+    st.caption(
+        f"User cache: {cache_stats['size']}/{cache_stats['max_size']} users, "
+        f"{cache_stats['hits']} hits, {cache_stats['misses']} misses"
+    )
+    
+    mirror_stats = get_feedback_service().mirror_stats()
+    if mirror_stats is not None:
+        if mirror_stats['disabled_reason']:
+            status = f"tắt ({mirror_stats['disabled_reason']})"
+        else:
+            status = "sẵn sàng" if mirror_stats['ready'] else "đang warm up"
+        st.caption(
+            f"User mirror: {status}, {mirror_stats['users']} users, {mirror_stats['feedbacks']} feedbacks, "
+            f"{mirror_stats['bytes'] / 1024 / 1024:.1f}/{mirror_stats['max_bytes'] / 1024 / 1024:.0f} MB"
+        )
+    
+    show_io_metrics()
+
+def show_feedback_browser():
+    """Duyệt feedback của mọi học sinh theo lớp và khoảng ngày, mỗi trang một query"""
+    st.divider()
+    st.subheader("Duyệt feedback")
+    
+    col1, col2 = st.columns([1, 2])
+    with col1:
+        lop = st.text_input("Lớp", placeholder="vd: 10A1 (để trống: tất cả)", key="browser_lop").strip()
+    with col2:
+        today = date.today()
+        date_range = st.date_input("Khoảng ngày", value=(today - timedelta(days=7), today), key="browser_dates")
+    
+    # Chọn dở một đầu khoảng ngày thì chỉ lọc theo ngày bắt đầu
+    start_date = date_range[0] if len(date_range) > 0 else None
+    end_date = date_range[1] if len(date_range) > 1 else None
+    
+    # Đổi bộ lọc thì quay về trang đầu; browser_cursors[i] là cursor để tải trang i
+    filters = (lop, start_date, end_date)
+    if st.session_state.get('browser_filters') != filters:
+        st.session_state.browser_filters = filters
+        st.session_state.browser_cursors = [None]
+    cursors = st.session_state.browser_cursors
+    
+    entries, next_cursor = get_feedback_index().browse(
+        lop=lop, start_date=start_date, end_date=end_date, limit=BROWSER_PAGE_SIZE, cursor=cursors[-1]
+    )
+    
+    if not entries:
+        st.caption("Không có feedback nào khớp bộ lọc")
+    else:
+        st.caption(f"Trang {len(cursors)}, {len(entries)} feedback")
+        st.dataframe(
+            [
+                {
+                    'Thời gian': entry.get('thoi_gian', ''),
+                    'Lớp': entry.get('lop', ''),
+                    'Họ tên': entry.get('ho_ten', ''),
+                    'Email': entry.get('email', ''),
+                    'Trạng thái': entry.get('trang_thai', ''),
+                    'Feedback': entry.get('noi_dung', ''),
+                    'Bài làm': entry.get('link_bai_lam', '')
+                }
+                for entry in entries
+            ],
+            hide_index=True
+        )
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        if len(cursors) > 1 and st.button("Trang trước"):
+            cursors.pop()
+            st.rerun()
+    with col2:
+        if next_cursor is not None and st.button("Trang sau"):
+            cursors.append(next_cursor)
+            st.rerun()
+    
+    show_feedback_export(lop, start_date, end_date)
+
+def show_feedback_export(lop, start_date, end_date):
+    """Export feedback theo bộ lọc hiện tại ra file tạm trên đĩa rồi cho tải về"""
+    col1, col2 = st.columns([1, 2])
+    with col1:
+        file_format = st.selectbox("Định dạng", ["csv", "parquet"], key="export_format")
+    with col2:
+        st.write("")
+        if st.button("Tạo file export"):
+            # Ghi ra đĩa theo từng trang thay vì dựng cả file trong bộ nhớ;
+            # session chỉ giữ đường dẫn, file bị xóa sau khi tải về
+            clear_export_file()
+            fd, path = tempfile.mkstemp(suffix=f".{file_format}")
+            os.close(fd)
+            try:
+                with st.spinner("Đang export..."):
+                    count = get_feedback_exporter().export(path, lop, start_date, end_date)
+                st.session_state.export_file = (f"feedback.{file_format}", path, count)
+            except Exception as e:
+                os.remove(path)
+                st.error(f"Lỗi export: {e}")
+    
+    export_file = st.session_state.get('export_file')
+    if export_file and not os.path.exists(export_file[1]):
+        st.session_state.pop('export_file')
+        export_file = None
+    if export_file:
+        file_name, path, count = export_file
+        with open(path, 'rb') as file:
+            st.download_button(
+                f"Tải {file_name} ({count} feedback)", file, file_name=file_name, on_click=clear_export_file
+            )
+
+def clear_export_file():
+    """Xóa file export tạm và bỏ khỏi session"""
+    export_file = st.session_state.pop('export_file', None)
+    if export_file and os.path.exists(export_file[1]):
+        os.remove(export_file[1])
+
+def show_feedback_search():
+    """Tìm feedback theo nội dung trên toàn bộ học sinh (không phân biệt dấu)"""
+    st.divider()
+    st.subheader("Tìm kiếm feedback")
+    
+    search_index = get_search_index()
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        query = st.text_input("Từ khóa", placeholder="vd: luận điểm, chính tả", key="feedback_search_query")
+    with col2:
+        st.write("")
+        if st.button("Nạp lại chỉ mục"):
+            search_index.reload()
+    
+    if not query.strip():
+        return
+    
+    started = time.perf_counter()
+    results = search_index.search(query)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    
+    index_stats = search_index.stats()
+    st.caption(
+        f"{len(results)} kết quả trong {elapsed_ms:.1f} ms "
+        f"(chỉ mục: {index_stats['feedbacks']} feedback, {index_stats['segments']} segment)"
+    )
+    if results:
+        st.dataframe(
+            [
+                {'Thời gian': item['thoi_gian'], 'Email': item['email'], 'Nội dung': item['snippet']}
+                for item in results
+            ],
+            hide_index=True
+        )
+
+def show_io_metrics():
+    """Số lần đọc/ghi storage và gọi Sheets API theo từng thao tác, tính từ lúc process khởi động"""
+    st.divider()
+    st.subheader("Chỉ số I/O")
+    
+    rows = io_metrics.summary_rows()
+    if not rows:
+        st.caption("Chưa có lời gọi I/O nào")
+    else:
+        st.dataframe(rows, hide_index=True)
+        if not MEASURE_PAYLOAD:
+            st.caption("payload_kb chỉ được đo khi bật IO_METRICS_BYTES=1")
+        with st.expander("Chi tiết theo backend/method"):
+            st.dataframe(
+                [
+                    {
+                        'operation': item['operation'],
+                        'backend': item['backend'],
+                        'method': item['method'],
+                        'calls': item['calls'],
+                        'reads': item['reads'],
+                        'writes': item['writes'],
+                        'avg_ms': round(item['latency_sum'] / item['calls'] * 1000, 1),
+                        'payload_kb': round(item['payload_bytes'] / 1024, 1)
+                    }
+                    for item in io_metrics.snapshot()['series']
+                ],
+                hide_index=True
+            )
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.download_button("Tải Prometheus", io_metrics.to_prometheus(), file_name="tce_metrics.prom", mime="text/plain")
+    with col2:
+        st.download_button(
+            "Tải JSON", json.dumps(io_metrics.snapshot(), indent=2),
+            file_name="tce_metrics.json", mime="application/json"
+        )
+    with col3:
+        if st.button("Đặt lại chỉ số"):
+            io_metrics.reset()
+            st.rerun()
+    
+    with st.expander("Thời gian khởi động"):
+        st.caption("Thời gian tạo từng thành phần và thời điểm sẵn sàng, tính từ lúc process nạp ứng dụng")
+        st.dataframe(startup_timings.rows(), hide_index=True)
+
+def parse_tabs(tabs_input):
+    """'10A1, 10A2' -> ['10A1', '10A2'], chuỗi rỗng -> None (tab đầu tiên)"""
+    tabs = [tab.strip() for tab in tabs_input.split(',') if tab.strip()]
+    return tabs or None
+
+def show_import_jobs():
+    """Danh sách import jobs, chỉ tự làm mới (2 giây/lần) khi còn job đang chờ hoặc đang chạy"""
+    polling = has_active_import_job(get_import_jobs().list_jobs())
+    # run_every cố định khi tạo fragment nên fragment được tạo lại mỗi lần chạy trang
+    st.fragment(run_every=2 if polling else None)(render_import_jobs)(polling)
+
+def has_active_import_job(jobs):
+    return any(job['state'] in (JOB_QUEUED, JOB_RUNNING) for job in jobs)
+
+def render_import_jobs(polling):
+    jobs = get_import_jobs().list_jobs()
+    if polling and not has_active_import_job(jobs):
+        # Job vừa xong: chạy lại cả trang để tạo fragment không còn tự làm mới
+        st.rerun()
+    if not jobs:
+        return
+    
+    st.markdown("**Import jobs gần đây**")
+    state_labels = {
+        JOB_QUEUED: "Đang chờ",
+        JOB_RUNNING: "Đang chạy",
+        JOB_DONE: "Hoàn thành",
+        JOB_FAILED: "Thất bại"
+    }
+    
+    for job in jobs:
+        label = state_labels.get(job['state'], job['state'])
+        sheet_ids = ', '.join(source['sheet_id'] for source in job.get('sources', []))
+        st.write(f"`{job['id']}` - {sheet_ids} - **{label}** ({job['created_at'][:19]})")
+        
+        if job['rows_total']:
+            progress = min(job['rows_processed'] / job['rows_total'], 1.0)
+        else:
+            progress = 1.0 if job['state'] == JOB_DONE else 0.0
+        st.progress(
+            progress,
+            text=f"{job['rows_processed']}/{job['rows_total']} dòng - "
+                 f"{job['updated']} thành công, {job['failed']} thất bại, {job['skipped']} đã import trước đó"
+        )
+        
+        if job['error']:
+            st.error(job['error'])
+        if job.get('search_index_error'):
+            st.warning(f"{job['search_index_error']} (chạy `python search_index.py --rebuild`)")
+        
+        if job['report']:
+            with st.expander(f"Kết quả từng tab ({len(job['report'])})"):
+                st.dataframe(job['report'])
+        
+        if job['failures']:
+            with st.expander(f"Dòng lỗi ({len(job['failures'])})"):
+                st.dataframe(job['failures'])
+        
+        if job.get('profile_changes'):
+            with st.expander(f"Thay đổi profile ({len(job['profile_changes'])})"):
+                st.dataframe(job['profile_changes'])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Benchmark pipeline import Google Sheets với Sheets API giả lập và storage local.
+Mỗi kịch bản sinh một sheet N dòng (có tỉ lệ dòng trùng / thiếu email), chạy
+GoogleSheetsExtractor.extract_and_update_firebase thật trên MemoryStorage/SQLiteStorage
+và in kết quả dạng JSON: thời gian, rows/s, số lần đọc/ghi backend, số request Sheets, peak memory.
+
+    python bench_import.py
+    python bench_import.py --rows 1000 10000 --duplicate-ratio 0.1 --missing-email-ratio 0.02
+    python bench_import.py --backend sqlite --output bench.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from init_firebase import FirebaseManager
+from ggsheet_extract import GoogleSheetsExtractor
+from storage import StorageBackend, MemoryStorage, SQLiteStorage
+
+HEADER = ['Dấu thời gian', 'Họ tên', 'Lớp', 'SĐT', 'Email', 'Link bài làm', 'Trạng thái', 'Feedback']
+
+class _FakeRequest:
+    """Request giả, execute() trả về kết quả đã tính sẵn"""
+
+    def __init__(self, service, result):
+        self.service = service
+        self.result = result
+
+    def execute(self, http=None, num_retries=0):
+        self.service.requests += 1
+        return self.result
+
+class FakeSheetsService:
+    """
+    Giả lập phần Sheets API mà extractor dùng: spreadsheets().get,
+    spreadsheets().values().get và spreadsheets().values().batchGet
+    sheets: {sheet_id: {'title': ..., 'tabs': [(tab_title, values)]}}
+    """
+
+    def __init__(self, sheets):
+        self.sheets = sheets
+        self.requests = 0
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId, fields=None, range=None):
+        # spreadsheets().get(spreadsheetId, fields) và values().get(spreadsheetId, range)
+        if range is not None:
+            return _FakeRequest(self, self._read_range(spreadsheetId, range))
+
+        sheet = self.sheets[spreadsheetId]
+        return _FakeRequest(self, {
+            'properties': {'title': sheet['title']},
+            'sheets': [
+                {'properties': {'sheetId': index, 'title': title, 'index': index}}
+                for index, (title, _) in enumerate(sheet['tabs'])
+            ]
+        })
+
+    def batchGet(self, spreadsheetId, ranges):
+        return _FakeRequest(self, {
+            'valueRanges': [self._read_range(spreadsheetId, a1_range) for a1_range in ranges]
+        })
+
+    def _read_range(self, sheet_id, a1_range):
+        """Hỗ trợ các range extractor tạo ra: 'Tab', 'Tab'!A:H, 'Tab'!A{n}:H"""
+        title, _, cells = a1_range.rpartition('!') if '!' in a1_range else (a1_range, '', '')
+        title = title[1:-1].replace("''", "'") if title.startswith("'") else title
+        values = dict(self.sheets[sheet_id]['tabs'])[title]
+
+        start_row = cells.split(':')[0].lstrip('A') if cells else ''
+        start = int(start_row) - 1 if start_row else 0
+        return {'range': a1_range, 'values': [list(row) for row in values[start:]]}
+
+class _CountingBatch:
+    def __init__(self, storage, inner):
+        self.storage = storage
+        self.inner = inner
+        self.ops = 0
+
+    def __getattr__(self, name):
+        method = getattr(self.inner, name)
+
+        def record(*args, **kwargs):
+            self.ops += 1
+            return method(*args, **kwargs)
+        return record
+
+    def __len__(self):
+        return len(self.inner)
+
+    def commit(self):
+        self.inner.commit()
+        self.storage.writes += self.ops
+        self.storage.commits += 1
+
+class CountingStorage(StorageBackend):
+    """Bọc một backend, đếm số document đọc, số thao tác ghi và số lần commit"""
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.name = inner.name
+        self.embeds_feedbacks = inner.embeds_feedbacks
+        self.reads = 0
+        self.writes = 0
+        self.commits = 0
+
+    def get_users(self, user_ids):
+        self.reads += len(user_ids)
+        return self.inner.get_users(user_ids)
+
+    def batch(self):
+        return _CountingBatch(self, self.inner.batch())
+
+    def query_feedbacks(self, user_id, limit=None, cursor=None, fields=None):
+        feedbacks, next_cursor = self.inner.query_feedbacks(user_id, limit, cursor, fields)
+        self.reads += max(1, len(feedbacks))
+        return feedbacks, next_cursor
+
+    def get_feedbacks(self, keys):
+        self.reads += len(keys)
+        return self.inner.get_feedbacks(keys)
+
+    def query_feedback_index(self, lop=None, start=None, end=None, limit=None, cursor=None):
+        entries, next_cursor = self.inner.query_feedback_index(lop, start, end, limit, cursor)
+        self.reads += max(1, len(entries))
+        return entries, next_cursor
+
+    def get_docs(self, collection, doc_ids):
+        self.reads += len(doc_ids)
+        return self.inner.get_docs(collection, doc_ids)
+
+    def query_docs(self, collection, order_by, descending=True, limit=None):
+        docs = self.inner.query_docs(collection, order_by, descending, limit)
+        self.reads += max(1, len(docs))
+        return docs
+
+    def stream_users(self):
+        for user in self.inner.stream_users():
+            self.reads += 1
+            yield user
+
+    def count_users(self, role=None):
+        self.reads += 1
+        return self.inner.count_users(role)
+
+    def count_feedbacks(self):
+        self.reads += 1
+        return self.inner.count_feedbacks()
+
+    def reset(self):
+        self.reads = self.writes = self.commits = 0
+
+class BenchExtractor(GoogleSheetsExtractor):
+    """Extractor thật nhưng dùng FakeSheetsService thay cho Google Sheets API"""
+
+    def __init__(self, service, firebase):
+        self._fake_service = service
+        super().__init__(firebase=firebase)
+
+    def _init_sheets_api(self):
+        self.service = self._fake_service
+
+    def _execute(self, request):
+        return request.execute()
+
+def make_emails(users):
+    return [f"hocsinh{index:05d}@example.com" for index in range(users)]
+
+def generate_rows(rows, emails, duplicate_ratio=0.0, missing_email_ratio=0.0, seed=0):
+    """
+    Sinh dữ liệu sheet (có header) gồm `rows` dòng:
+    - duplicate_ratio: tỉ lệ dòng lặp lại y hệt một dòng trước đó
+    - missing_email_ratio: tỉ lệ dòng để trống email
+    """
+    rng = random.Random(seed)
+    start = datetime(2025, 9, 1, 8, 0, 0)
+    values = [HEADER]
+
+    for index in range(rows):
+        if index and rng.random() < duplicate_ratio:
+            values.append(list(values[rng.randint(1, index)]))
+            continue
+
+        email = '' if rng.random() < missing_email_ratio else rng.choice(emails)
+        values.append([
+            (start + timedelta(seconds=index * 37)).strftime('%d/%m/%Y %H:%M:%S'),
+            f"Học sinh {index % 997}",
+            f"12A{index % 9 + 1}",
+            f"09{index:08d}",
+            email,
+            f"https://example.com/bai-lam/{index}",
+            'Đã chấm',
+            f"Feedback cho bài làm số {index}: cần trình bày rõ lập luận ở câu {index % 5 + 1}."
+        ])
+
+    return values
+
+def make_storage(backend, path=None):
+    if backend == 'sqlite':
+        return SQLiteStorage(path or ':memory:')
+    return MemoryStorage()
+
+def seed_users(storage, emails):
+    """Tạo sẵn tài khoản học sinh (không tính vào kết quả benchmark)"""
+    write_batch = storage.batch()
+    for email in emails:
+        user_id = email.replace('@', '_').replace('.', '_')
+        user_data = {
+            'email': email,
+            'password': '0900000000',
+            'role': 'user',
+            'active': True,
+            'profile': {'ho_ten': '', 'lop': '', 'phone': '0900000000'}
+        }
+        if storage.embeds_feedbacks:
+            user_data['feedbacks'] = []
+        write_batch.set_user(user_id, user_data)
+    write_batch.commit()
+
+def run_scenario(rows, users=500, duplicate_ratio=0.0, missing_email_ratio=0.0,
+                 backend='memory', batch=True, incremental=True, seed=0, trace_memory=True):
+    """Chạy một kịch bản import trên storage mới, trả về dict metrics"""
+    emails = make_emails(users)
+    values = generate_rows(rows, emails, duplicate_ratio, missing_email_ratio, seed)
+    service = FakeSheetsService({'bench': {'title': 'Benchmark', 'tabs': [('Sheet1', values)]}})
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        storage = CountingStorage(make_storage(backend, os.path.join(tmp_dir, 'bench.sqlite3')))
+        seed_users(storage, emails)
+        storage.reset()
+
+        firebase = FirebaseManager(storage=storage)
+        extractor = BenchExtractor(service, firebase)
+
+        if trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        # Log từng dòng của extractor bị bỏ đi để không ảnh hưởng thời gian đo
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            result = extractor.extract_and_update_firebase('bench', batch=batch, incremental=incremental)
+        wall_time = time.perf_counter() - started
+        peak_memory = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+
+    result = result or {}
+    return {
+        'rows': rows,
+        'users': users,
+        'duplicate_ratio': duplicate_ratio,
+        'missing_email_ratio': missing_email_ratio,
+        'backend': backend,
+        'batch': batch,
+        'wall_time_s': round(wall_time, 4),
+        'rows_per_s': round(rows / wall_time, 1) if wall_time else None,
+        'updated': result.get('updated'),
+        'failed': result.get('failed'),
+        'backend_reads': storage.reads,
+        'backend_writes': storage.writes,
+        'backend_commits': storage.commits,
+        'sheets_requests': service.requests,
+        'peak_memory_bytes': peak_memory
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark import Google Sheets với Sheets API giả lập")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000], help="Số dòng mỗi kịch bản")
+    parser.add_argument('--users', type=int, default=500, help="Số tài khoản học sinh")
+    parser.add_argument('--duplicate-ratio', type=float, default=0.05, help="Tỉ lệ dòng trùng lặp")
+    parser.add_argument('--missing-email-ratio', type=float, default=0.01, help="Tỉ lệ dòng thiếu email")
+    parser.add_argument('--backend', choices=('memory', 'sqlite'), default='memory')
+    parser.add_argument('--sequential', action='store_true', help="Dùng đường xử lý từng dòng thay vì batch")
+    parser.add_argument('--no-memory', action='store_true', help="Không đo peak memory (tracemalloc làm chậm import nhiều lần, nên tắt khi chỉ so sánh thời gian)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Ghi JSON ra file thay vì stdout")
+    args = parser.parse_args(argv)
+
+    results = []
+    for rows in args.rows:
+        metrics = run_scenario(
+            rows, users=args.users,
+            duplicate_ratio=args.duplicate_ratio,
+            missing_email_ratio=args.missing_email_ratio,
+            backend=args.backend,
+            batch=not args.sequential,
+            seed=args.seed,
+            trace_memory=not args.no_memory
+        )
+        print(f"{rows} dòng: {metrics['wall_time_s']}s, {metrics['rows_per_s']} dòng/s", file=sys.stderr)
+        results.append(metrics)
+
+    report = {
+        'created_at': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'scenarios': results
+    }
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
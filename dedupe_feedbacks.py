@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+import argparse
+from init_firebase import FirebaseManager
+from stats_service import StatsService
+from storage import FEEDBACK_VERSION_FIELD, make_feedback_id, make_version_stamp
+
+class FeedbackDeduplicator:
+    """
+    Gán id ổn định (email, dấu thời gian, link bài làm) cho các feedback đã lưu
+    và xóa các bản trùng do import lại nhiều lần. Chạy lại nhiều lần không thay đổi gì thêm.
+    """
+
+    # Số thao tác tối đa mỗi batch (Firestore giới hạn 500)
+    BATCH_SIZE = 400
+
+    def __init__(self, firebase=None):
+        self.firebase = firebase or FirebaseManager()
+        self.stats = StatsService(self.firebase)
+
+    def dedupe(self, dry_run=False):
+        """
+        Duyệt toàn bộ users, với mỗi nhóm feedback cùng id giữ lại bản được ghi sau cùng
+        dry_run: chỉ đếm, không ghi
+        Returns: dict {'users', 'removed', 'rekeyed', 'failed'}
+        """
+        storage = self.firebase.storage
+        result = {'users': 0, 'removed': 0, 'rekeyed': 0, 'failed': 0}
+
+        for user_id, user_data in storage.stream_users():
+            if user_data.get('role') != 'user':
+                continue
+
+            try:
+                if storage.embeds_feedbacks:
+                    # Thứ tự trong mảng là thứ tự import
+                    feedbacks = user_data.get('feedbacks', [])
+                else:
+                    # Mới nhất trước, đảo lại để bản sau cùng đứng cuối
+                    feedbacks, _ = storage.query_feedbacks(user_id)
+                    feedbacks.reverse()
+
+                deletes, upserts = self._plan_user(user_data.get('email', ''), feedbacks)
+                if not deletes and not upserts:
+                    continue
+
+                removed = len(deletes) - len(upserts)
+                if not dry_run:
+                    self._apply_user(user_id, deletes, upserts, removed)
+
+                result['users'] += 1
+                result['removed'] += removed
+                result['rekeyed'] += len(upserts)
+                print(f"✅ {user_id}: bỏ {removed} bản trùng, gán id cho {len(upserts)} feedback")
+
+            except Exception as e:
+                result['failed'] += 1
+                print(f"❌ {user_id}: {e}")
+
+        prefix = "[DRY RUN] " if dry_run else ""
+        print(
+            f"\n📊 {prefix}Kết quả: {result['users']} users, bỏ {result['removed']} feedback trùng, "
+            f"{result['rekeyed']} feedback được ghi lại, {result['failed']} thất bại"
+        )
+        return result
+
+    def _plan_user(self, email, feedbacks):
+        """
+        Returns: (deletes, upserts) - deletes là các bản đang lưu cần xóa,
+        upserts là bản giữ lại (đã có id ổn định) cho mỗi nhóm cần ghi lại
+        """
+        groups = {}
+        for feedback in feedbacks:
+            feedback_id = make_feedback_id(email, feedback.get('thoi_gian'), feedback.get('link_bai_lam'))
+            groups.setdefault(feedback_id, []).append(feedback)
+
+        deletes = []
+        upserts = []
+        for feedback_id, items in groups.items():
+            keeper = dict(items[-1], id=feedback_id)
+            if len(items) == 1 and items[0].get('id') == feedback_id:
+                continue
+
+            # Xóa mọi bản đang lưu rồi ghi lại một bản với id ổn định
+            deletes.extend(items)
+            upserts.append(keeper)
+
+        return deletes, upserts
+
+    def _apply_user(self, user_id, deletes, upserts, removed):
+        storage = self.firebase.storage
+        if not storage.embeds_feedbacks:
+            # Bản đang lưu trùng id với bản giữ lại sẽ được ghi đè, không cần xóa
+            keep_ids = {feedback['id'] for feedback in upserts}
+            deletes = [feedback for feedback in deletes if feedback.get('id') not in keep_ids]
+
+        # Ghi bản giữ lại trước, xóa bản cũ sau để dừng giữa chừng cũng không mất feedback
+        ops = [('upsert', feedback) for feedback in upserts] + [('delete', feedback) for feedback in deletes]
+        write_batch = storage.batch()
+        for kind, feedback in ops:
+            if kind == 'upsert':
+                write_batch.upsert_feedback(user_id, feedback)
+            else:
+                write_batch.delete_feedback(user_id, feedback)
+
+            if len(write_batch) >= self.BATCH_SIZE:
+                write_batch.commit()
+                write_batch = storage.batch()
+
+        # Counter graded_submissions giảm theo số bản trùng đã bỏ
+        self.stats.add_increments(write_batch, graded=-removed)
+        write_batch.update_user(user_id, {FEEDBACK_VERSION_FIELD: make_version_stamp()})
+        write_batch.commit()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gán id ổn định và xóa feedback trùng")
+    parser.add_argument('--dry-run', action='store_true', help="Chỉ đếm, không ghi dữ liệu")
+    args = parser.parse_args()
+
+    try:
+        deduplicator = FeedbackDeduplicator()
+        deduplicator.dedupe(dry_run=args.dry_run)
+    except Exception as e:
+        print(f"❌ Lỗi: {e}")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Export toàn bộ feedback ra CSV hoặc Parquet.
+Đọc collection feedback_index theo từng trang (cursor) và ghi từng dòng ngay ra file,
+nên bộ nhớ dùng không phụ thuộc số feedback. Lọc theo lớp/khoảng ngày được làm ở query.
+
+    python export_feedbacks.py --output feedback.csv
+    python export_feedbacks.py --output hk1.parquet --lop 10A1 --from 2025-09-01 --to 2026-01-15
+"""
+import csv
+import sys
+import argparse
+from datetime import date, datetime
+from init_firebase import FirebaseManager
+from feedback_index import date_bounds
+from metrics import operation
+
+# Các cột của file export, theo thứ tự
+EXPORT_COLUMNS = (
+    'thoi_gian', 'timestamp', 'lop', 'ho_ten', 'email', 'trang_thai',
+    'noi_dung', 'link_bai_lam', 'feedback_id', 'user_id'
+)
+
+def _as_datetime(value):
+    """timestamp có thể là datetime (Firestore/memory) hoặc chuỗi ISO (SQLite)"""
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, str) and value:
+        try:
+            return datetime.fromisoformat(value).replace(tzinfo=None)
+        except ValueError:
+            return None
+    return None
+
+class FeedbackExporter:
+    # Số entry mỗi lần query (mỗi trang giữ trong bộ nhớ cùng lúc)
+    PAGE_SIZE = 500
+    # Số dòng mỗi row group Parquet
+    PARQUET_BATCH_ROWS = 5000
+
+    def __init__(self, firebase=None):
+        self.firebase = firebase or FirebaseManager()
+
+    def iter_rows(self, lop=None, start_date=None, end_date=None):
+        """Generator các dòng export (dict theo EXPORT_COLUMNS), mới nhất trước"""
+        start, end = date_bounds(start_date, end_date)
+        cursor = None
+        while True:
+            entries, cursor = self.firebase.storage.query_feedback_index(
+                lop=lop or None, start=start, end=end, limit=self.PAGE_SIZE, cursor=cursor
+            )
+            for entry in entries:
+                row = {column: entry.get(column, '') for column in EXPORT_COLUMNS}
+                row['timestamp'] = _as_datetime(entry.get('timestamp'))
+                yield row
+            if cursor is None:
+                return
+
+    @operation('export')
+    def export_csv(self, file, lop=None, start_date=None, end_date=None):
+        """Ghi CSV (UTF-8 BOM để Excel đọc đúng tiếng Việt) vào file object text. Returns: số dòng"""
+        writer = csv.DictWriter(file, fieldnames=EXPORT_COLUMNS)
+        file.write('\ufeff')
+        writer.writeheader()
+        count = 0
+        for row in self.iter_rows(lop, start_date, end_date):
+            if row['timestamp'] is not None:
+                row['timestamp'] = row['timestamp'].isoformat()
+            writer.writerow(row)
+            count += 1
+        return count
+
+    @operation('export')
+    def export_parquet(self, path, lop=None, start_date=None, end_date=None):
+        """Ghi Parquet theo từng row group PARQUET_BATCH_ROWS dòng. Returns: số dòng"""
+        # pyarrow đi kèm streamlit, chỉ cần khi export Parquet
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Export Parquet cần pyarrow (pip install pyarrow)")
+
+        schema = pa.schema([
+            (column, pa.timestamp('s') if column == 'timestamp' else pa.string())
+            for column in EXPORT_COLUMNS
+        ])
+        count = 0
+        with pq.ParquetWriter(path, schema) as writer:
+            buffer = []
+            for row in self.iter_rows(lop, start_date, end_date):
+                buffer.append(row)
+                if len(buffer) >= self.PARQUET_BATCH_ROWS:
+                    writer.write_table(pa.Table.from_pylist(buffer, schema=schema))
+                    count += len(buffer)
+                    buffer = []
+            if buffer or not count:
+                writer.write_table(pa.Table.from_pylist(buffer, schema=schema))
+                count += len(buffer)
+        return count
+
+    def export(self, path, lop=None, start_date=None, end_date=None):
+        """Chọn định dạng theo đuôi file (.parquet hoặc CSV). Returns: số dòng"""
+        if path.lower().endswith('.parquet'):
+            return self.export_parquet(path, lop, start_date, end_date)
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            return self.export_csv(file, lop, start_date, end_date)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export feedback ra CSV/Parquet")
+    parser.add_argument('--output', required=True, help="File output (.csv hoặc .parquet)")
+    parser.add_argument('--lop', help="Chỉ export một lớp")
+    parser.add_argument('--from', dest='start_date', type=date.fromisoformat, help="Từ ngày (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='end_date', type=date.fromisoformat, help="Đến ngày (YYYY-MM-DD), tính cả ngày này")
+    args = parser.parse_args()
+
+    try:
+        exporter = FeedbackExporter()
+        count = exporter.export(args.output, args.lop, args.start_date, args.end_date)
+        print(f"✅ Đã export {count} feedback vào {args.output}")
+    except Exception as e:
+        print(f"❌ Lỗi: {e}")
+        sys.exit(1)
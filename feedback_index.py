@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Bản phẳng của feedback cho trang admin: mỗi feedback một document trong collection
+`feedback_index` (storage.FEEDBACK_INDEX_COLLECTION) kèm lớp, email, họ tên, timestamp
+và trạng thái chấm (cột G), được ghi cùng batch với feedback khi import.
+Duyệt "toàn bộ feedback lớp 10A1 tuần này" là một query theo (lop, timestamp),
+mỗi trang chỉ tốn số lần đọc bằng số feedback trong trang.
+
+    python feedback_index.py --rebuild    # tạo bản phẳng cho dữ liệu đã import trước đây
+"""
+import argparse
+from datetime import datetime, time, timedelta
+from init_firebase import FirebaseManager
+from storage import parse_feedback_time
+from metrics import operation
+
+# Field profile được chép vào entry, đổi một trong các field này thì entry cũ của user phải ghi lại
+INDEXED_PROFILE_FIELDS = ('ho_ten', 'lop')
+
+def make_index_entry(user_id, user_data, feedback, profile_updates=None):
+    """
+    Entry phẳng của một feedback
+    profile_updates: {field: value} profile đang được ghi cùng batch (chưa có trong user_data)
+    """
+    profile = dict(user_data.get('profile', {}))
+    profile.update(profile_updates or {})
+    return {
+        'feedback_id': feedback['id'],
+        'user_id': user_id,
+        'email': user_data.get('email', ''),
+        'ho_ten': profile.get('ho_ten', ''),
+        'lop': profile.get('lop', ''),
+        'thoi_gian': feedback.get('thoi_gian', ''),
+        'timestamp': parse_feedback_time(feedback.get('thoi_gian', '')),
+        'trang_thai': feedback.get('trang_thai', ''),
+        'noi_dung': feedback.get('noi_dung', ''),
+        'link_bai_lam': feedback.get('link_bai_lam', '')
+    }
+
+def stored_feedbacks(storage, user_id, user_data):
+    """Feedback đang lưu của user (trong user document hoặc lưu riêng)"""
+    if storage.embeds_feedbacks:
+        return user_data.get('feedbacks', [])
+    feedbacks, _ = storage.query_feedbacks(user_id)
+    return feedbacks
+
+def reindex_user(storage, user_id, user_data, profile_updates, skip_ids=(), batch_size=400):
+    """
+    Ghi lại entry cho các feedback đã lưu của user khi họ tên/lớp đổi, để duyệt theo lớp thấy lớp mới
+    profile_updates: {field: value} profile vừa ghi, không đổi INDEXED_PROFILE_FIELDS thì không làm gì
+    skip_ids: feedback vừa được ghi entry mới cùng lần import
+    Returns: số entry đã ghi
+    """
+    if not any(field in profile_updates for field in INDEXED_PROFILE_FIELDS):
+        return 0
+
+    count = 0
+    write_batch = storage.batch()
+    for feedback in stored_feedbacks(storage, user_id, user_data):
+        if not feedback.get('id') or feedback['id'] in skip_ids:
+            continue
+        write_batch.index_feedback(make_index_entry(user_id, user_data, feedback, profile_updates))
+        count += 1
+        if len(write_batch) >= batch_size:
+            write_batch.commit()
+            write_batch = storage.batch()
+
+    if len(write_batch):
+        write_batch.commit()
+    return count
+
+def date_bounds(start_date=None, end_date=None):
+    """(date, date) tính cả hai đầu -> (start, end) datetime cho query start <= timestamp < end"""
+    start = datetime.combine(start_date, time.min) if start_date else None
+    end = datetime.combine(end_date + timedelta(days=1), time.min) if end_date else None
+    return start, end
+
+class FeedbackIndex:
+    """Đọc/dựng lại bản phẳng feedback dùng cho trang admin"""
+
+    # Số thao tác tối đa mỗi batch (Firestore giới hạn 500)
+    BATCH_SIZE = 400
+
+    def __init__(self, firebase=None):
+        self.firebase = firebase or FirebaseManager()
+
+    @operation('feedback_browser')
+    def browse(self, lop=None, start_date=None, end_date=None, limit=20, cursor=None):
+        """
+        Một trang feedback mới nhất trước
+        lop: tên lớp (None/'' là mọi lớp), start_date/end_date: date, tính cả hai đầu
+        Returns: (entries, next_cursor)
+        """
+        start, end = date_bounds(start_date, end_date)
+        return self.firebase.storage.query_feedback_index(
+            lop=lop or None, start=start, end=end, limit=limit, cursor=cursor
+        )
+
+    @operation('feedback_index')
+    def rebuild(self):
+        """Ghi lại entry cho toàn bộ feedback đang lưu. Returns: số entry đã ghi"""
+        storage = self.firebase.storage
+        count = 0
+        write_batch = storage.batch()
+        for user_id, user_data in storage.stream_users():
+            if user_data.get('role') != 'user':
+                continue
+            for feedback in stored_feedbacks(storage, user_id, user_data):
+                # Feedback chưa có id ổn định cần chạy dedupe_feedbacks.py trước
+                if not feedback.get('id'):
+                    continue
+                write_batch.index_feedback(make_index_entry(user_id, user_data, feedback))
+                count += 1
+                if len(write_batch) >= self.BATCH_SIZE:
+                    write_batch.commit()
+                    write_batch = storage.batch()
+
+        write_batch.commit()
+        return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bản phẳng feedback cho trang admin")
+    parser.add_argument('--rebuild', action='store_true', help="Ghi lại entry cho toàn bộ feedback đang lưu")
+    args = parser.parse_args()
+
+    try:
+        if args.rebuild:
+            print(f"✅ Đã ghi {FeedbackIndex().rebuild()} feedback")
+        else:
+            parser.print_help()
+    except Exception as e:
+        print(f"❌ Lỗi: {e}")
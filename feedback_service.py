@@ -3,11 +3,49 @@ import os
 import json
 from datetime import datetime
 from init_firebase import FirebaseManager
+from cache import LRUTTLCache
+from metrics import operation
+from storage import FEEDBACK_VERSION_FIELD, make_feedback_id, parse_feedback_time, project_feedback, sort_feedbacks
 
 class UserFeedbackService:
-    def __init__(self):
-        self.firebase = FirebaseManager()
+    def __init__(self, firebase=None, mirror=None):
+        self.firebase = firebase or FirebaseManager()
+        # Bản sao users trong RAM (user_mirror.UserMirror), chỉ dùng khi đã warm up xong
+        self.mirror = mirror
+        # Cache users/{id} để login và các lần rerun dashboard dùng chung một lần đọc
+        self.user_cache = LRUTTLCache(
+            max_size=int(os.getenv('USER_CACHE_SIZE', '1024')),
+            ttl=float(os.getenv('USER_CACHE_TTL', '60'))
+        )
     
+    def _get_user_data(self, user_id):
+        """Đọc users/{user_id} qua bản sao hoặc cache, trả về None nếu user không tồn tại"""
+        if self.mirror is not None and self.mirror.ready:
+            return self.mirror.get_user(user_id)
+        
+        user_data = self.user_cache.get(user_id)
+        if user_data is not None:
+            return user_data
+        
+        user_data = self.firebase.storage.get_user(user_id)
+        if user_data is None:
+            return None
+        
+        self.user_cache.set(user_id, user_data)
+        return user_data
+    
+    def invalidate_user(self, user_id):
+        """Xóa user khỏi cache sau khi dữ liệu của user thay đổi"""
+        self.user_cache.invalidate(user_id)
+    
+    def cache_stats(self):
+        return self.user_cache.stats()
+    
+    def mirror_stats(self):
+        """None nếu không bật USER_MIRROR"""
+        return self.mirror.stats() if self.mirror is not None else None
+    
+    @operation('login')
     def authenticate_user(self, email, password):
         """
         Xác thực user bằng email và password (SĐT)
@@ -19,14 +57,10 @@ class UserFeedbackService:
             user_id = normalized_email.replace('@', '_').replace('.', '_').replace(' ', '_')
             
             # Lấy user document
-            user_ref = self.firebase.db.collection('users').document(user_id)
-            user_doc = user_ref.get()
-            
-            if not user_doc.exists:
+            user_data = self._get_user_data(user_id)
+            if user_data is None:
                 return None
             
-            user_data = user_doc.to_dict()
-            
             # Check password (SĐT)
             if user_data.get('password') == password.replace(' ', ''):
                 return user_data
@@ -37,6 +71,7 @@ class UserFeedbackService:
             print(f"Lỗi authenticate: {e}")
             return None
     
+    @operation('feedback_view')
     def get_user_feedbacks(self, email):
         """
         Lấy tất cả feedbacks của user theo email
@@ -47,53 +82,123 @@ class UserFeedbackService:
             normalized_email = email.replace(' ', '')
             user_id = normalized_email.replace('@', '_').replace('.', '_').replace(' ', '_')
             
-            # Lấy user document
-            user_ref = self.firebase.db.collection('users').document(user_id)
-            user_doc = user_ref.get()
+            if not self.firebase.storage.embeds_feedbacks:
+                feedbacks, _ = self._query_feedbacks(user_id)
+                return feedbacks
             
-            if not user_doc.exists:
+            # Lấy user document (feedbacks nằm trong document, dùng chung cache với login)
+            user_data = self._get_user_data(user_id)
+            if user_data is None:
                 return []
             
-            user_data = user_doc.to_dict()
-            feedbacks = user_data.get('feedbacks', [])
-            
-            # Sort theo thời gian mới nhất (giả sử format: DD/MM/YYYY HH:MM:SS)
-            feedbacks_sorted = sorted(
-                feedbacks, 
-                key=lambda x: self._parse_datetime(x.get('thoi_gian', '')), 
-                reverse=True
-            )
-            
-            return feedbacks_sorted
+            return self._sort_feedbacks(self._with_ids(user_data, normalized_email))
             
         except Exception as e:
             print(f"Lỗi get feedbacks: {e}")
             return []
     
-    def _parse_datetime(self, time_str):
-        """Parse thời gian từ string sang datetime để sort"""
+    @operation('feedback_view')
+    def get_user_feedbacks_page(self, email, limit=10, cursor=None, fields=None):
+        """
+        Lấy một trang feedbacks (mới nhất trước)
+        cursor: giá trị next_cursor của trang trước, None cho trang đầu
+        fields: chỉ lấy các field này (storage.FEEDBACK_SUMMARY_FIELDS cho danh sách), None là toàn bộ
+        Returns: (feedbacks, next_cursor) - next_cursor là None khi đã hết
+        """
         try:
-            if not time_str:
-                return datetime.min
+            normalized_email = email.replace(' ', '')
+            user_id = normalized_email.replace('@', '_').replace('.', '_').replace(' ', '_')
+            
+            if self.firebase.storage.embeds_feedbacks:
+                # Mảng feedbacks nằm trong user document, cursor là offset
+                offset = cursor or 0
+                feedbacks = self.get_user_feedbacks(email)
+                page = [project_feedback(feedback, fields) for feedback in feedbacks[offset:offset + limit]]
+                next_cursor = offset + limit if offset + limit < len(feedbacks) else None
+                return page, next_cursor
+            
+            return self._query_feedbacks(user_id, limit=limit, cursor=cursor, fields=fields)
             
-            # Format: "17/10/2025 22:39:05"
-            return datetime.strptime(time_str, "%d/%m/%Y %H:%M:%S")
-        except:
-            return datetime.min
+        except Exception as e:
+            print(f"Lỗi get feedbacks page: {e}")
+            return [], None
     
+    @operation('feedback_view')
+    def get_feedback(self, email, feedback_id):
+        """
+        Một feedback đầy đủ (nội dung, link bài làm) theo id, tải khi học sinh mở feedback
+        Returns: dict hoặc None nếu không tìm thấy
+        """
+        try:
+            normalized_email = email.replace(' ', '')
+            user_id = normalized_email.replace('@', '_').replace('.', '_').replace(' ', '_')
+            
+            if self.firebase.storage.embeds_feedbacks:
+                # Feedback nằm trong user document đã cache, không cần đọc thêm
+                user_data = self._get_user_data(user_id)
+                if user_data is None or not feedback_id:
+                    return None
+                return next((feedback for feedback in self._with_ids(user_data, normalized_email) if feedback['id'] == feedback_id), None)
+            
+            if self.mirror is not None and self.mirror.ready:
+                return self.mirror.get_feedback(user_id, feedback_id)
+            return self.firebase.storage.get_feedbacks([(user_id, feedback_id)]).get((user_id, feedback_id))
+            
+        except Exception as e:
+            print(f"Lỗi get feedback: {e}")
+            return None
+    
+    def get_feedback_version(self, email):
+        """
+        Version stamp feedback của user (FEEDBACK_VERSION_FIELD), chỉ đọc user document qua bản sao/cache
+        Returns: None nếu user không tồn tại, 0 nếu chưa có feedback nào được ghi kèm stamp
+        """
+        normalized_email = email.replace(' ', '')
+        user_id = normalized_email.replace('@', '_').replace('.', '_').replace(' ', '_')
+        
+        user_data = self._get_user_data(user_id)
+        if user_data is None:
+            return None
+        return user_data.get(FEEDBACK_VERSION_FIELD, 0)
+    
+    def _query_feedbacks(self, user_id, limit=None, cursor=None, fields=None):
+        """Feedback lưu riêng (subcollection), từ bản sao nếu đã sẵn sàng"""
+        if self.mirror is not None and self.mirror.ready:
+            return self.mirror.query_feedbacks(user_id, limit=limit, cursor=cursor, fields=fields)
+        return self.firebase.storage.query_feedbacks(user_id, limit=limit, cursor=cursor, fields=fields)
+    
+    def _with_ids(self, user_data, email):
+        """
+        Feedback trong mảng của user, bản ghi cũ chưa có 'id' được gán id ổn định
+        (cùng công thức với import) để danh sách và get_feedback khớp đúng từng bài
+        """
+        email = user_data.get('email') or email
+        return [
+            feedback if feedback.get('id') else dict(
+                feedback, id=make_feedback_id(email, feedback.get('thoi_gian'), feedback.get('link_bai_lam'))
+            )
+            for feedback in user_data.get('feedbacks', [])
+        ]
+    
+    def _sort_feedbacks(self, feedbacks):
+        # Sort theo thời gian mới nhất (giả sử format: DD/MM/YYYY HH:MM:SS)
+        return sort_feedbacks(feedbacks)
+    
+    def _parse_datetime(self, time_str):
+        """Parse thời gian từ string sang datetime để sort"""
+        return parse_feedback_time(time_str) or datetime.min
+    
+    @operation('profile')
     def get_user_profile(self, email):
         """Lấy thông tin profile của user"""
         try:
             normalized_email = email.replace(' ', '')
             user_id = normalized_email.replace('@', '_').replace('.', '_').replace(' ', '_')
             
-            user_ref = self.firebase.db.collection('users').document(user_id)
-            user_doc = user_ref.get()
-            
-            if not user_doc.exists:
+            user_data = self._get_user_data(user_id)
+            if user_data is None:
                 return None
             
-            user_data = user_doc.to_dict()
             return {
                 'email': user_data.get('email'),
                 'role': user_data.get('role'),
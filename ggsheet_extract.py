@@ -1,18 +1,76 @@
 #!/usr/bin/env python3
 import os
+import sys
 import json
+import time
+import argparse
+import threading
+import contextlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from init_firebase import FirebaseManager
+from storage import FEEDBACK_VERSION_FIELD, make_feedback_id, make_preview, make_version_stamp, parse_feedback_time
+from cache import LRUTTLCache
+from stats_service import StatsService
+from feedback_index import make_index_entry, reindex_user
+from metrics import io_metrics, operation, payload_size, startup_timings
+from resilience import AdaptiveConcurrency, TokenBucket, call_with_retry, is_throttle_error
+
+def parse_sheet_id(sheet_url):
+    """Lấy sheet ID từ URL Google Sheets, hoặc trả về nguyên giá trị nếu đã là ID"""
+    sheet_url = sheet_url.strip()
+    if '/d/' in sheet_url:
+        return sheet_url.split('/d/')[1].split('/')[0]
+    if '/' in sheet_url or not sheet_url:
+        raise ValueError(f"URL không hợp lệ: {sheet_url}")
+    return sheet_url
 
 class GoogleSheetsExtractor:
-    def __init__(self):
-        self.service = None
-        self.firebase = FirebaseManager()
-        self._init_sheets_api()
+    # Số thao tác tối đa mỗi WriteBatch (Firestore giới hạn 500 thao tác / batch)
+    BATCH_SIZE = 400
+    # Chỉ lấy tên sheet và properties của các tab, bỏ qua grid data/format
+    METADATA_FIELDS = 'properties.title,sheets.properties(sheetId,title,index)'
+    # Field profile -> key trong row_data (cột B, C, D) được đồng bộ từ sheet
+    PROFILE_FIELDS = (('ho_ten', 'ho_ten'), ('lop', 'lop'), ('phone', 'sdt'))
+    
+    def __init__(self, firebase=None, user_cache=None, stats=None, search_index=None):
+        # Sheets client được tạo ở lần dùng đầu tiên (chỉ admin cần), xem property service
+        self._service = None
+        self._service_lock = threading.Lock()
+        self.credentials = None
+        # Pool kết nối HTTP dùng chung giữa các thread, tạo cùng Sheets client
+        self.http_pool = None
+        # Metadata theo sheet_id, dùng chung giữa test_connection và import
+        self.metadata_cache = LRUTTLCache(max_size=64, ttl=300)
+        # Quota đọc của Sheets API tính theo phút, dùng chung cho mọi import job của process
+        self.rate_limiter = TokenBucket(per_minute=int(os.getenv('SHEETS_REQUESTS_PER_MINUTE', '60')))
+        self.concurrency = AdaptiveConcurrency(max_limit=int(os.getenv('SHEETS_MAX_CONCURRENCY', '4')))
+        self.firebase = firebase or FirebaseManager()
+        # Cache user documents của UserFeedbackService, cần invalidate sau khi import
+        self.user_cache = user_cache
+        self.stats = stats or StatsService(self.firebase)
+        # Chỉ mục tìm kiếm nội dung feedback, cập nhật sau mỗi lần ghi thành công
+        self.search_index = search_index
+    
+    @property
+    def service(self):
+        if self._service is None:
+            with self._service_lock:
+                if self._service is None:
+                    with startup_timings.timed('sheets_client'):
+                        self._init_sheets_api()
+        return self._service
+    
+    @service.setter
+    def service(self, value):
+        self._service = value
     
     def _init_sheets_api(self):
+        # Import khi cần để session học sinh không phải nạp googleapiclient/httplib2
+        from google.oauth2 import service_account
+        from googleapiclient.discovery import build
+        from sheets_http import SheetsHttpPool
         try:
             firebase_config = os.getenv('FIREBASE_CONFIG')
             if not firebase_config:
@@ -20,23 +78,75 @@ class GoogleSheetsExtractor:
             
             config_dict = json.loads(firebase_config)
             
-            credentials = service_account.Credentials.from_service_account_info(
+            self.credentials = service_account.Credentials.from_service_account_info(
                 config_dict,
                 scopes=['https://www.googleapis.com/auth/spreadsheets.readonly']
             )
             
-            self.service = build('sheets', 'v4', credentials=credentials)
+            pool_size = int(os.getenv('SHEETS_HTTP_POOL_SIZE', os.getenv('SHEETS_MAX_CONCURRENCY', '4')))
+            self.http_pool = SheetsHttpPool(self.credentials, size=pool_size)
+            
+            # Discovery document đóng gói sẵn trong googleapiclient, không tải qua mạng
+            self.service = build(
+                'sheets', 'v4', credentials=self.credentials, static_discovery=True, cache_discovery=False
+            )
             
         except Exception as e:
             raise Exception(f"Lỗi khởi tạo Google Sheets API: {e}")
     
+    def _execute(self, request):
+        """
+        Chạy request Sheets API bằng một kết nối mượn từ http_pool
+        (httplib2.Http không thread-safe, các import job chạy song song).
+        Request được giới hạn theo quota/phút và số lời gọi đồng thời, lỗi 429/5xx được retry
+        (mọi request Sheets ở đây đều là đọc nên retry an toàn)
+        """
+        # methodId dạng 'sheets.spreadsheets.values.batchGet'
+        method = getattr(request, 'methodId', 'request').replace('sheets.spreadsheets.', '')
+        
+        def send():
+            with self.concurrency.slot():
+                self.rate_limiter.acquire()
+                with self.http_pool.connection() as http, io_metrics.timed('sheets', method) as call:
+                    result = request.execute(http=http)
+                    call['payload_bytes'] = payload_size(result)
+            self.concurrency.on_success()
+            return result
+        
+        def on_error(error):
+            if is_throttle_error(error):
+                # Vượt quota: giảm số request song song và chờ bucket nạp lại
+                self.concurrency.on_throttle()
+                self.rate_limiter.drain()
+        
+        return call_with_retry(send, description=f"Sheets {method}", on_error=on_error)
+    
     def _normalize_email(self, email):
         """Xóa tất cả space trong email để match với rule tạo account"""
         return email.replace(' ', '') if email else ''
     
+    def get_sheet_metadata(self, sheet_id, refresh=False):
+        """
+        Metadata (tên sheet và các tab) của spreadsheet, có cache theo sheet_id
+        refresh=True: luôn gọi API và cập nhật cache
+        """
+        if not refresh:
+            sheet_metadata = self.metadata_cache.get(sheet_id)
+            if sheet_metadata is not None:
+                return sheet_metadata
+        
+        sheet_metadata = self._execute(self.service.spreadsheets().get(
+            spreadsheetId=sheet_id,
+            fields=self.METADATA_FIELDS
+        ))
+        self.metadata_cache.set(sheet_id, sheet_metadata)
+        return sheet_metadata
+    
+    @operation('sheet_check')
     def test_connection(self, sheet_id):
         try:
-            sheet_metadata = self.service.spreadsheets().get(spreadsheetId=sheet_id).execute()
+            # Luôn gọi API để kiểm tra quyền truy cập, kết quả được cache cho lần import ngay sau
+            sheet_metadata = self.get_sheet_metadata(sheet_id, refresh=True)
             sheet_title = sheet_metadata.get('properties', {}).get('title', 'Unknown')
             print(f"Kết nối thành công với sheet: '{sheet_title}'")
             
@@ -52,107 +162,778 @@ class GoogleSheetsExtractor:
             print(f"Lỗi kết nối: {e}")
             return False
     
-    def extract_and_update_firebase(self, sheet_id):
+    def read_tab_values(self, sheet_id, tab=None):
+        """Đọc toàn bộ giá trị của một tab (mặc định tab đầu tiên)"""
+        tabs = self._select_tabs(self.get_sheet_metadata(sheet_id), [tab] if tab else None)
+        quoted = tabs[0]['title'].replace("'", "''")
+        result = self._execute(self.service.spreadsheets().values().get(
+            spreadsheetId=sheet_id,
+            range=f"'{quoted}'"
+        ))
+        return result.get('values', [])
+    
+    def extract_and_update_firebase(self, sheet_id, batch=True, incremental=True, on_row=None):
+        """
+        Import dữ liệu từ tab đầu tiên của sheet vào Firebase
+        batch=True: gom dòng theo user và ghi bằng WriteBatch (nhanh với sheet lớn)
+        batch=False: xử lý tuần tự từng dòng như trước
+        incremental=True: chỉ đọc các dòng sau watermark của lần import trước
+        incremental=False: đọc lại toàn bộ tab và đặt lại watermark
+        on_row: callback(index, total, email, error, source) sau mỗi dòng, error None nếu thành công,
+            source là {'sheet_id', 'tab', 'row'} của dòng trong sheet
+        Returns: dict {'updated', 'failed', 'skipped', 'sources'} hoặc None nếu lỗi
+        """
         try:
-            # Lấy tên tab đầu tiên
-            sheet_metadata = self.service.spreadsheets().get(spreadsheetId=sheet_id).execute()
-            first_sheet_name = sheet_metadata['sheets'][0]['properties']['title']
-            range_name = f"'{first_sheet_name}'!A:H"  # A đến H
+            return self.run_import([{'sheet_id': sheet_id}], batch=batch, incremental=incremental, on_row=on_row)
+        except Exception as e:
+            print(f"Lỗi extract data: {e}")
+            return None
+    
+    @operation('import')
+    def run_import(self, sources, batch=True, incremental=True, on_row=None, max_workers=4, dry_run=False):
+        """
+        Import nhiều spreadsheet/tab trong một lần, raise exception nếu không đọc được sheet nào.
+        sources: list {'sheet_id': ..., 'tabs': None | [tên tab] | ['*']}
+            tabs None: chỉ tab đầu tiên, ['*']: tất cả các tab
+        Các spreadsheet được đọc song song (tối đa max_workers), mỗi spreadsheet một lần
+        values.batchGet, sau đó mọi dòng được gộp thành một write plan duy nhất.
+        dry_run=True: đọc sheet và tính write plan nhưng không ghi gì (kể cả watermark),
+            'updated' là số dòng sẽ được ghi
+        Returns: {'updated', 'failed', 'skipped', 'rows_read', 'written': {'feedbacks', 'profiles'},
+            'profile_changes': [{'email', 'field', 'old', 'new'}],
+            'unresolved_users': [{'email', 'sheet_id', 'tab', 'row'}] - dòng của email chưa có tài khoản,
+            'search_index_error': None hoặc lỗi ghi chỉ mục,
+            'timings': {'fetch_s', 'write_s', 'total_s'}, 'sources': [báo cáo từng tab / lỗi từng sheet]}
+        """
+        started = time.perf_counter()
+        segments, source_errors = self._fetch_sources(sources, incremental, max_workers)
+        fetched = time.perf_counter()
+        if source_errors and not segments:
+            raise Exception(source_errors[0]['error'])
+        
+        # Gộp tất cả các dòng thành một danh sách, nhớ vị trí của từng dòng trong sheet
+        data_rows = []
+        row_sources = []
+        row_segments = []
+        for segment in segments:
+            segment['start'] = len(data_rows) + 1
+            for offset, row in enumerate(segment['rows']):
+                data_rows.append(row)
+                row_sources.append({
+                    'sheet_id': segment['sheet_id'],
+                    'tab': segment['tab_name'],
+                    'row': segment['first_row_number'] + offset
+                })
+                row_segments.append(segment)
+        
+        def tally(index, total, email, error, source):
+            segment = row_segments[index - 1]
+            if error is None:
+                segment['updated'] += 1
+            else:
+                segment['failed'] += 1
+            if on_row is not None:
+                on_row(index, total, email, error, source)
+        
+        written = {'feedbacks': 0, 'profiles': 0}
+        profile_changes = []
+        unresolved = []
+        if data_rows:
+            print(f"Số dòng dữ liệu mới: {len(data_rows)} ({len(segments)} tab)")
+            if batch or dry_run:
+                updated_count, failed_count, retry_indexes = self._batch_update_users(
+                    data_rows, tally, row_sources, written=written, dry_run=dry_run,
+                    profile_changes=profile_changes, unresolved=unresolved
+                )
+            else:
+                updated_count, failed_count, retry_indexes = self._sequential_update_users(
+                    data_rows, tally, row_sources, written=written, profile_changes=profile_changes,
+                    unresolved=unresolved
+                )
+        else:
+            print("Không có dòng mới")
+            updated_count, failed_count, retry_indexes = 0, 0, []
+        
+        search_index_error = None
+        if not dry_run:
+            for segment in segments:
+                self._advance_watermark(segment, retry_indexes)
+            search_index_error = self._flush_search_index()
+        finished = time.perf_counter()
+        
+        skipped_count = sum(segment['skipped'] for segment in segments)
+        report = [self._segment_report(segment) for segment in segments] + source_errors
+        
+        print(f"\nKết quả: {updated_count} thành công, {failed_count} thất bại, {skipped_count} dòng đã import trước đó")
+        for item in report:
+            if item.get('error'):
+                print(f"   {item['sheet_id']}: {item['error']}")
+            else:
+                print(f"   {item['sheet_id']} / {item['tab']}: {item['updated']} thành công, {item['failed']} thất bại")
+        if unresolved:
+            print(f"Email chưa có tài khoản ({len(unresolved)} dòng, cần import --full sau khi tạo tài khoản):")
+            for item in unresolved:
+                print(f"   {item['email']} ({item['tab']} dòng {item['row']})")
+        if profile_changes:
+            print(f"Cập nhật profile ({len(profile_changes)} thay đổi):")
+            for change in profile_changes:
+                print(f"   {change['email']}: {change['field']} '{change['old']}' -> '{change['new']}'")
+        
+        return {
+            'updated': updated_count,
+            'failed': failed_count,
+            'skipped': skipped_count,
+            'rows_read': len(data_rows),
+            'written': written,
+            'profile_changes': profile_changes,
+            'unresolved_users': unresolved,
+            'dry_run': dry_run,
+            'search_index_error': search_index_error,
+            'timings': {
+                'fetch_s': round(fetched - started, 3),
+                'write_s': round(finished - fetched, 3),
+                'total_s': round(finished - started, 3)
+            },
+            'sources': report
+        }
+    
+    def _fetch_sources(self, sources, incremental, max_workers):
+        """
+        Đọc song song các spreadsheet
+        Returns: (segments, source_errors) - mỗi segment là các dòng mới của một tab
+        """
+        segments = []
+        source_errors = []
+        workers = max(1, min(max_workers, len(sources)))
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sheets-fetch') as executor:
+            futures = [
+                # copy_context để lời gọi Sheets trong thread con vẫn được tính cho thao tác import
+                (source, executor.submit(contextvars.copy_context().run, self._fetch_sheet_segments, source, incremental))
+                for source in sources
+            ]
+            # Giữ thứ tự các sheet như đầu vào để kết quả ổn định
+            for source, future in futures:
+                try:
+                    segments.extend(future.result())
+                except Exception as e:
+                    print(f"Lỗi đọc sheet {source['sheet_id']}: {e}")
+                    source_errors.append({'sheet_id': source['sheet_id'], 'tab': None, 'error': str(e)})
+        
+        return segments, source_errors
+    
+    def _fetch_sheet_segments(self, source, incremental):
+        """Đọc các dòng chưa import của những tab được chọn trong một spreadsheet"""
+        sheet_id = source['sheet_id']
+        sheet_metadata = self.get_sheet_metadata(sheet_id)
+        tabs = self._select_tabs(sheet_metadata, source.get('tabs'))
+        watermarks = self._load_watermarks(sheet_id, tabs) if incremental else {}
+        
+        # Có watermark: đọc từ dòng cuối đã import (để kiểm tra sheet không bị sửa thứ tự) trở đi
+        ranges = []
+        for tab in tabs:
+            watermark = watermarks.get(tab.get('sheetId', 0))
+            ranges.append(self._a1_range(tab['title'], watermark['last_row'] if watermark else None))
+        
+        segments = []
+        reread_tabs = []
+        for tab, value_range in zip(tabs, self._batch_get(sheet_id, ranges)):
+            print(f"Đang đọc từ tab: {tab['title']}")
+            values = value_range.get('values', [])
+            watermark = watermarks.get(tab.get('sheetId', 0))
+            
+            if watermark is None:
+                segments.append(self._make_segment(sheet_id, tab, values[1:], 2))
+                continue
             
-            print(f"Đang đọc từ tab: {first_sheet_name}")
+            last_imported = values[0][0] if values and values[0] else ''
+            if last_imported == watermark.get('last_dau_thoi_gian'):
+                segments.append(self._make_segment(sheet_id, tab, values[1:], watermark['last_row'] + 1))
+            else:
+                print(f"Tab '{tab['title']}': dòng {watermark['last_row']} đã thay đổi so với lần import trước, đọc lại toàn bộ tab")
+                reread_tabs.append(tab)
+        
+        if reread_tabs:
+            ranges = [self._a1_range(tab['title']) for tab in reread_tabs]
+            for tab, value_range in zip(reread_tabs, self._batch_get(sheet_id, ranges)):
+                segments.append(self._make_segment(sheet_id, tab, value_range.get('values', [])[1:], 2))
+        
+        return segments
+    
+    def _select_tabs(self, sheet_metadata, tabs):
+        """tabs None: tab đầu tiên, ['*']: tất cả, ngược lại là danh sách tên tab"""
+        sheet_tabs = [sheet['properties'] for sheet in sheet_metadata.get('sheets', [])]
+        if not tabs:
+            return sheet_tabs[:1]
+        if '*' in tabs:
+            return sheet_tabs
+        
+        tabs_by_title = {tab['title']: tab for tab in sheet_tabs}
+        missing = [title for title in tabs if title not in tabs_by_title]
+        if missing:
+            raise ValueError(f"Không tìm thấy tab: {', '.join(missing)}")
+        return [tabs_by_title[title] for title in tabs]
+    
+    def _batch_get(self, sheet_id, ranges):
+        """Đọc nhiều range của một spreadsheet bằng một request values.batchGet"""
+        result = self._execute(self.service.spreadsheets().values().batchGet(
+            spreadsheetId=sheet_id,
+            ranges=ranges
+        ))
+        return result.get('valueRanges', [])
+    
+    def _make_segment(self, sheet_id, tab, rows, first_row_number):
+        return {
+            'sheet_id': sheet_id,
+            'tab_id': tab.get('sheetId', 0),
+            'tab_name': tab['title'],
+            'rows': rows,
+            'first_row_number': first_row_number,
+            'skipped': first_row_number - 2,  # Trừ header
+            'updated': 0,
+            'failed': 0
+        }
+    
+    def _segment_report(self, segment):
+        return {
+            'sheet_id': segment['sheet_id'],
+            'tab': segment['tab_name'],
+            'rows': len(segment['rows']),
+            'updated': segment['updated'],
+            'failed': segment['failed'],
+            'skipped': segment['skipped'],
+            'error': None
+        }
+    
+    def _advance_watermark(self, segment, retry_indexes):
+        """
+        Lưu watermark của tab, dừng trước dòng đầu tiên cần import lại: dòng commit lỗi
+        (retry_indexes) hoặc dòng giáo viên chưa chấm (cột H trống, sẽ được điền sau).
+        Dòng của email chưa có tài khoản không giữ watermark (xem unresolved_users của run_import)
+        """
+        rows = segment['rows']
+        if not rows:
+            return
+        
+        start = segment['start']
+        failed = [index for index in retry_indexes if start <= index < start + len(rows)]
+        failed += [start + offset for offset, row in enumerate(rows) if self._awaiting_feedback(row)]
+        last_index = min(failed) - start if failed else len(rows)
+        if last_index <= 0:
+            return
+        
+        last_row = rows[last_index - 1]
+        self._save_watermark(
+            segment['sheet_id'], segment['tab_id'], segment['tab_name'],
+            last_row=segment['first_row_number'] + last_index - 1,
+            last_dau_thoi_gian=last_row[0] if last_row else ''
+        )
+    
+    def _awaiting_feedback(self, row):
+        """Dòng có email nhưng chưa có feedback (form đã nộp, giáo viên chưa chấm)"""
+        email = row[4].strip() if len(row) > 4 else ''
+        feedback = row[7].strip() if len(row) > 7 else ''
+        return bool(email) and not feedback
+    
+    def _a1_range(self, tab_name, start_row=None):
+        """Range cột A-H của tab, bắt đầu từ start_row (1-based) nếu có"""
+        quoted = tab_name.replace("'", "''")
+        if start_row:
+            return f"'{quoted}'!A{start_row}:H"
+        return f"'{quoted}'!A:H"  # A đến H
+    
+    def _watermark_id(self, sheet_id, tab_id):
+        # Dùng sheetId (gid) của tab thay vì tên tab vì tên có thể đổi hoặc chứa '/'
+        return f"{sheet_id}_{tab_id}"
+    
+    def _load_watermarks(self, sheet_id, tabs):
+        """Đọc watermark của các tab bằng một lần đọc, trả về {tab_id: watermark}"""
+        doc_ids = [self._watermark_id(sheet_id, tab.get('sheetId', 0)) for tab in tabs]
+        docs = self.firebase.storage.get_docs('import_watermarks', doc_ids)
+        return {watermark['tab_id']: watermark for watermark in docs.values()}
+    
+    def _save_watermark(self, sheet_id, tab_id, tab_name, last_row, last_dau_thoi_gian):
+        self.firebase.storage.set_doc('import_watermarks', self._watermark_id(sheet_id, tab_id), {
+            'sheet_id': sheet_id,
+            'tab_id': tab_id,
+            'tab_name': tab_name,
+            'last_row': last_row,
+            'last_dau_thoi_gian': last_dau_thoi_gian,
+            'updated_at': datetime.now().isoformat()
+        })
+    
+    def _parse_row(self, row):
+        """Chuyển một dòng sheet (cột A-H) thành row_data"""
+        # Đảm bảo row có đủ cột (8 cột)
+        while len(row) < 8:
+            row.append('')
+        
+        return {
+            'dau_thoi_gian': row[0],
+            'ho_ten': row[1],
+            'lop': row[2],
+            'sdt': row[3],
+            'email': self._normalize_email(row[4]),  # Normalize email
+            'link_bai_lam': row[5],
+            'status': row[6],  # Cột G
+            'feedback': row[7]  # Cột H
+        }
+    
+    def _make_user_id(self, email):
+        """Tạo user_id từ email (same rule với tạo account)"""
+        return email.replace('@', '_').replace('.', '_').replace(' ', '_')
+    
+    def _invalidate_user(self, user_id):
+        if self.user_cache is not None:
+            self.user_cache.invalidate(user_id)
+    
+    def _index_feedbacks(self, user_id, email, feedbacks):
+        if self.search_index is not None:
+            for feedback in feedbacks:
+                self.search_index.add_feedback(user_id, email, feedback)
+    
+    def _flush_search_index(self):
+        """
+        Lỗi ghi chỉ mục không làm hỏng import (feedback đã được ghi), được báo trong kết quả import
+        để dựng lại bằng search_index.py --rebuild. Returns: thông báo lỗi hoặc None
+        """
+        if self.search_index is not None:
+            try:
+                self.search_index.flush()
+            except Exception as e:
+                print(f"   Lỗi ghi chỉ mục tìm kiếm: {e}")
+                return f"Lỗi ghi chỉ mục tìm kiếm: {e}"
+        return None
+    
+    def _build_feedback(self, row_data):
+        feedback = {
+            # Id ổn định: import lại cùng một dòng sẽ ghi đè thay vì tạo feedback trùng
+            'id': make_feedback_id(row_data['email'], row_data['dau_thoi_gian'], row_data['link_bai_lam']),
+            'thoi_gian': row_data['dau_thoi_gian'],
+            'noi_dung': row_data['feedback'],
+            'link_bai_lam': row_data['link_bai_lam'],
+            'trang_thai': row_data['status'],
+            # Trích đoạn cho danh sách feedback (đọc bằng projection, không tải cả nội dung)
+            'preview': make_preview(row_data['feedback'])
+        }
+        # Feedback lưu riêng (subcollection/bảng) có thêm timestamp thật để order_by phía server
+        if not self.firebase.storage.embeds_feedbacks:
+            feedback['timestamp'] = parse_feedback_time(row_data['dau_thoi_gian'])
+        return feedback
+    
+    def _report_row(self, on_row, i, total, email, error=None, row_sources=None):
+        """In kết quả một dòng và báo cho on_row (nếu có)"""
+        if error is None:
+            print(f"[{i}/{total}] {email}")
+        else:
+            print(f"[{i}/{total}] {email} - FAILED ({error})")
+        
+        if on_row is not None:
+            on_row(i, total, email, error, row_sources[i - 1] if row_sources else None)
+    
+    def _sequential_update_users(self, data_rows, on_row=None, row_sources=None, written=None, profile_changes=None,
+                                 unresolved=None):
+        """
+        Update từng dòng một (mỗi dòng 1 get + tối đa 2 update)
+        written: dict {'feedbacks', 'profiles'} được cộng số feedback/profile đã ghi
+        profile_changes: list được thêm các thay đổi profile đã ghi
+        unresolved: list được thêm các dòng của email chưa có tài khoản
+        Returns: (updated_count, failed_count, retry_indexes) - retry_indexes là số thứ tự
+        (1-based) của các dòng ghi lỗi cần import lại
+        """
+        unresolved = [] if unresolved is None else unresolved
+        updated_count = 0
+        failed_count = 0
+        retry_indexes = []
+        
+        # Profile mới nhất của từng user tính trước từ mọi dòng, giống chế độ batch
+        rows_by_user = {}
+        for row in data_rows:
+            try:
+                row_data = self._parse_row(row)
+            except Exception:
+                continue
+            if row_data['email']:
+                rows_by_user.setdefault(self._make_user_id(row_data['email']), []).append(row_data)
+        profiles = {user_id: self._latest_profile(rows) for user_id, rows in rows_by_user.items()}
+        
+        for i, row in enumerate(data_rows, 1):
+            try:
+                row_data = self._parse_row(row)
+                if not row_data['email']:
+                    failed_count += 1
+                    self._report_row(on_row, i, len(data_rows), '', "Thiếu email", row_sources)
+                    continue
+                profile = profiles.get(self._make_user_id(row_data['email']))
+                
+                # Update vào Firebase
+                missing = []
+                if self._update_user_data(row_data, written, profile, profile_changes, missing=missing):
+                    updated_count += 1
+                    self._report_row(on_row, i, len(data_rows), row_data['email'], None, row_sources)
+                elif missing:
+                    failed_count += 1
+                    self._record_unresolved(unresolved, i, row_data, row_sources)
+                    self._report_row(on_row, i, len(data_rows), row_data['email'], "User không tồn tại", row_sources)
+                else:
+                    failed_count += 1
+                    retry_indexes.append(i)
+                    self._report_row(on_row, i, len(data_rows), row_data['email'], "Không cập nhật được user", row_sources)
+                
+            except Exception as e:
+                failed_count += 1
+                self._report_row(on_row, i, len(data_rows), '', f"Lỗi parse dòng: {e}", row_sources)
+        
+        return updated_count, failed_count, retry_indexes
+    
+    def _batch_update_users(self, data_rows, on_row=None, row_sources=None, written=None, dry_run=False,
+                            profile_changes=None, unresolved=None):
+        """
+        Gom các dòng theo user, đọc tất cả user documents bằng một lần get_all,
+        tính thay đổi profile/feedback trong bộ nhớ rồi commit theo từng chunk WriteBatch
+        written: dict {'feedbacks', 'profiles'} được cộng số feedback/profile đã ghi
+        profile_changes: list được thêm các thay đổi profile đã ghi (hoặc sẽ ghi khi dry_run)
+        unresolved: list được thêm các dòng của email chưa có tài khoản
+        dry_run: chỉ tính write plan, không commit
+        Returns: (updated_count, failed_count, retry_indexes) - retry_indexes là số thứ tự
+        (1-based) của các dòng commit lỗi cần import lại
+        """
+        unresolved = [] if unresolved is None else unresolved
+        total = len(data_rows)
+        updated_count = 0
+        failed_count = 0
+        retry_indexes = []
+        
+        # Gom các dòng theo user_id, giữ nguyên thứ tự trong sheet
+        rows_by_user = {}
+        for i, row in enumerate(data_rows, 1):
+            try:
+                row_data = self._parse_row(row)
+            except Exception as e:
+                failed_count += 1
+                self._report_row(on_row, i, total, '', f"Lỗi parse dòng: {e}", row_sources)
+                continue
             
-            # Đọc dữ liệu
-            result = self.service.spreadsheets().values().get(
-                spreadsheetId=sheet_id,
-                range=range_name
-            ).execute()
+            if not row_data['email']:
+                failed_count += 1
+                self._report_row(on_row, i, total, '', "Thiếu email", row_sources)
+                continue
             
-            values = result.get('values', [])
-            if not values:
-                print("Không có dữ liệu trong sheet")
-                return
+            user_id = self._make_user_id(row_data['email'])
+            rows_by_user.setdefault(user_id, []).append((i, row_data))
+        
+        if not rows_by_user:
+            return updated_count, failed_count, retry_indexes
+        
+        # Đọc tất cả user documents trong một lần
+        users = self.firebase.storage.get_users(list(rows_by_user))
+        
+        # Các feedback đã lưu có cùng id với các dòng sắp import
+        existing = self._load_existing_feedbacks(users, rows_by_user)
+        
+        # Tính thay đổi cho từng user trong bộ nhớ
+        writes = []  # (user_id, updates, upserts, rows)
+        for user_id, rows in rows_by_user.items():
+            user_data = users.get(user_id)
+            if user_data is None:
+                # Không giữ watermark (tài khoản có thể không bao giờ được tạo), import --full để lấy lại
+                for i, row_data in rows:
+                    failed_count += 1
+                    self._record_unresolved(unresolved, i, row_data, row_sources)
+                    self._report_row(on_row, i, total, row_data['email'], "User không tồn tại", row_sources)
+                continue
             
-            headers = values[0]
-            data_rows = values[1:]
+            updates, upserts = self._build_user_updates(
+                user_data, [row_data for _, row_data in rows], existing.get(user_id, {})
+            )
+            writes.append((user_id, updates, upserts, rows))
+        
+        # Commit theo chunk (Firestore giới hạn 500 thao tác mỗi batch, chừa 1 cho stats)
+        for chunk in self._chunk_writes(writes):
+            commit_error = None
+            if dry_run:
+                self._count_written(written, chunk)
+                self._record_profile_changes(profile_changes, users, chunk)
+                for _, _, _, rows in chunk:
+                    for i, row_data in rows:
+                        updated_count += 1
+                        self._report_row(on_row, i, total, row_data['email'], None, row_sources)
+                continue
             
-            print(f"Headers: {headers}")
-            print(f"Số dòng dữ liệu: {len(data_rows)}")
+            try:
+                write_batch = self.firebase.storage.batch()
+                for user_id, updates, upserts, _ in chunk:
+                    profile_updates = {path.split('.', 1)[1]: value for path, value in updates.items()}
+                    if upserts:
+                        # Đổi version stamp cùng thao tác update để read API biết feedback đã thay đổi
+                        updates = dict(updates, **{FEEDBACK_VERSION_FIELD: make_version_stamp()})
+                    if updates:
+                        write_batch.update_user(user_id, updates)
+                    for feedback, previous in upserts:
+                        write_batch.upsert_feedback(user_id, feedback, previous)
+                        write_batch.index_feedback(
+                            make_index_entry(user_id, users[user_id], feedback, profile_updates)
+                        )
+                if len(write_batch):
+                    # Counter thống kê được ghi cùng batch với feedback, chỉ tính feedback mới
+                    graded = sum(
+                        1 for _, _, upserts, _ in chunk for _, previous in upserts if previous is None
+                    )
+                    self.stats.add_increments(write_batch, graded=graded, activity=graded)
+                    write_batch.commit()
+                    self._count_written(written, chunk)
+                    self._record_profile_changes(profile_changes, users, chunk)
+            except Exception as e:
+                commit_error = f"Lỗi commit batch: {e}"
+                print(f"   {commit_error}")
             
-            updated_count = 0
-            failed_count = 0
+            for user_id, updates, upserts, rows in chunk:
+                if updates or upserts:
+                    self._invalidate_user(user_id)
+                if commit_error is None and updates:
+                    self._reindex_user(
+                        user_id, users[user_id], {path.split('.', 1)[1]: value for path, value in updates.items()},
+                        skip_ids={feedback['id'] for feedback, _ in upserts}
+                    )
+                if commit_error is None and upserts:
+                    self._index_feedbacks(user_id, rows[0][1]['email'], [feedback for feedback, _ in upserts])
             
-            for i, row in enumerate(data_rows, 1):
-                try:
-                    # Đảm bảo row có đủ cột (8 cột)
-                    while len(row) < 8:
-                        row.append('')
-                    
-                    row_data = {
-                        'dau_thoi_gian': row[0],
-                        'ho_ten': row[1],
-                        'lop': row[2],
-                        'sdt': row[3],
-                        'email': self._normalize_email(row[4]),  # Normalize email
-                        'link_bai_lam': row[5],
-                        'status': row[6],  # Cột G
-                        'feedback': row[7]  # Cột H
-                    }
-                    
-                    # Update vào Firebase
-                    if self._update_user_data(row_data):
+            for _, _, _, rows in chunk:
+                for i, row_data in rows:
+                    if commit_error is None:
                         updated_count += 1
-                        print(f"[{i}/{len(data_rows)}] {row_data['email']}")
                     else:
                         failed_count += 1
-                        print(f"[{i}/{len(data_rows)}] {row_data['email']} - FAILED")
-                    
-                except Exception as e:
-                    failed_count += 1
-                    print(f"[{i}/{len(data_rows)}] Lỗi parse dòng: {e}")
-            
-            print(f"\nKết quả: {updated_count} thành công, {failed_count} thất bại")
-            
+                        retry_indexes.append(i)
+                    self._report_row(on_row, i, total, row_data['email'], commit_error, row_sources)
+        
+        return updated_count, failed_count, retry_indexes
+    
+    def _reindex_user(self, user_id, user_data, profile_updates, skip_ids=()):
+        """Ghi lại entry feedback_index của user khi họ tên/lớp đổi, lỗi chỉ được in ra (sửa bằng --rebuild)"""
+        try:
+            reindex_user(self.firebase.storage, user_id, user_data, profile_updates, skip_ids=skip_ids)
         except Exception as e:
-            print(f"Lỗi extract data: {e}")
+            print(f"   Lỗi cập nhật feedback_index của {user_id}: {e} (chạy `python feedback_index.py --rebuild`)")
+    
+    def _record_unresolved(self, unresolved, i, row_data, row_sources=None):
+        source = row_sources[i - 1] if row_sources else {}
+        unresolved.append({
+            'email': row_data['email'],
+            'sheet_id': source.get('sheet_id'),
+            'tab': source.get('tab'),
+            'row': source.get('row', i)
+        })
     
-    def _update_user_data(self, row_data):
+    def _count_written(self, written, chunk):
+        if written is not None:
+            written['feedbacks'] += sum(len(upserts) for _, _, upserts, _ in chunk)
+            written['profiles'] += sum(1 for _, updates, _, _ in chunk if updates)
+    
+    def _record_profile_changes(self, profile_changes, users, chunk):
+        if profile_changes is None:
+            return
+        for user_id, updates, _, rows in chunk:
+            user_data = users[user_id]
+            stored = user_data.get('profile', {})
+            for path, value in updates.items():
+                if path.startswith('profile.'):
+                    field = path.split('.', 1)[1]
+                    profile_changes.append({
+                        'email': user_data.get('email') or rows[0][1]['email'],
+                        'field': field,
+                        'old': stored.get(field, ''),
+                        'new': value
+                    })
+    
+    def _chunk_writes(self, writes):
+        """Chia writes thành các chunk có tổng số thao tác <= BATCH_SIZE (tính cả entry feedback_index)"""
+        chunk = []
+        chunk_ops = 0
+        for write in writes:
+            _, updates, upserts, _ = write
+            if self.firebase.storage.embeds_feedbacks:
+                # Feedback được gộp vào cùng thao tác update user document,
+                # cộng thêm một thao tác gỡ các bản cũ nếu có feedback bị sửa
+                ops = 1 if updates or upserts else 0
+                ops += 1 if any(previous is not None for _, previous in upserts) else 0
+            else:
+                # Update user document gồm cả version stamp khi có feedback thay đổi
+                ops = (1 if updates or upserts else 0) + len(upserts)
+            ops += len(upserts)
+            if chunk and chunk_ops + ops > self.BATCH_SIZE:
+                yield chunk
+                chunk = []
+                chunk_ops = 0
+            chunk.append(write)
+            chunk_ops += ops
+        if chunk:
+            yield chunk
+    
+    def _load_existing_feedbacks(self, users, rows_by_user):
+        """
+        Feedback đang lưu có cùng id với các dòng sẽ import
+        Returns: {user_id: {feedback_id: feedback}}
+        """
+        existing = {}
+        if self.firebase.storage.embeds_feedbacks:
+            # Feedback nằm sẵn trong user documents vừa đọc, không tốn thêm lần đọc nào
+            for user_id, user_data in users.items():
+                existing[user_id] = {
+                    feedback['id']: feedback for feedback in user_data.get('feedbacks', []) if feedback.get('id')
+                }
+            return existing
+        
+        keys = {
+            (user_id, make_feedback_id(row_data['email'], row_data['dau_thoi_gian'], row_data['link_bai_lam']))
+            for user_id, rows in rows_by_user.items()
+            if users.get(user_id, {}).get('role') == 'user'
+            for _, row_data in rows if row_data['feedback']
+        }
+        for (user_id, feedback_id), feedback in self.firebase.storage.get_feedbacks(sorted(keys)).items():
+            existing.setdefault(user_id, {})[feedback_id] = feedback
+        return existing
+    
+    def _latest_profile(self, rows):
+        """
+        Gộp các dòng của một user thành profile mới nhất: mỗi field lấy giá trị khác rỗng
+        của dòng có dấu thời gian mới nhất (cùng thời gian thì dòng sau trong sheet thắng)
+        Returns: {field: value}
+        """
+        ordered = sorted(
+            enumerate(rows),
+            key=lambda item: (parse_feedback_time(item[1]['dau_thoi_gian']) or datetime.min, item[0])
+        )
+        profile = {}
+        for _, row_data in ordered:
+            for field, key in self.PROFILE_FIELDS:
+                value = self._normalize_profile_value(field, row_data.get(key))
+                if value:
+                    profile[field] = value
+        return profile
+    
+    def _normalize_profile_value(self, field, value):
+        value = (value or '').strip()
+        if field == 'phone':
+            # Cùng quy tắc với SĐT khi tạo tài khoản (account.py)
+            return value.replace(' ', '')
+        return ' '.join(value.split())
+    
+    def _diff_profile(self, user_data, profile):
+        """Các field của profile khác với bản đang lưu. Returns: {field: giá trị mới}"""
+        stored = user_data.get('profile', {})
+        return {field: value for field, value in profile.items() if stored.get(field) != value}
+    
+    def _same_feedback(self, stored, feedback):
+        # Feedback import trước khi lưu trạng thái/trích đoạn chưa có field trang_thai/preview,
+        # được ghi lại một lần ở lần import --full tiếp theo
+        return all(
+            stored.get(field, '') == feedback[field]
+            for field in ('thoi_gian', 'noi_dung', 'link_bai_lam', 'trang_thai', 'preview')
+        )
+    
+    def _build_user_updates(self, user_data, rows, existing=None):
+        """
+        Tính các field cần update cho một user từ tất cả các dòng của user đó,
+        cho kết quả giống như chạy _update_user_data lần lượt từng dòng
+        (profile: giá trị mới nhất của từng field, xem _latest_profile)
+        existing: {feedback_id: feedback đang lưu}
+        Returns: (updates, upserts) - upserts là list (feedback, bản đang lưu hoặc None),
+        bỏ qua feedback không thay đổi
+        """
+        updates = {}
+        upserts = []
+        
+        # Chỉ ghi các field profile có giá trị mới nhất khác với bản đang lưu
+        for field, value in self._diff_profile(user_data, self._latest_profile(rows)).items():
+            updates[f'profile.{field}'] = value
+        
+        # Thêm/sửa feedback (chỉ với user role), dòng trùng id thì dòng sau cùng thắng
+        if user_data.get('role') == 'user':
+            existing = existing or {}
+            feedbacks = {}
+            for row_data in rows:
+                if row_data['feedback']:
+                    feedback = self._build_feedback(row_data)
+                    feedbacks[feedback['id']] = feedback
+            
+            for feedback_id, feedback in feedbacks.items():
+                previous = existing.get(feedback_id)
+                if previous is None or not self._same_feedback(previous, feedback):
+                    upserts.append((feedback, previous))
+        
+        return updates, upserts
+    
+    def _update_user_data(self, row_data, written=None, profile=None, profile_changes=None, missing=None):
+        """
+        profile: profile mới nhất của user (_latest_profile trên mọi dòng của user), None thì lấy từ dòng này
+        profile_changes: list được thêm các thay đổi profile đã ghi
+        missing: list được thêm email nếu user chưa có tài khoản (phân biệt với lỗi ghi khi trả về False)
+        """
         try:
             email = row_data['email']
             if not email:
                 return False
             
             # Tạo user_id từ email (same rule với tạo account)
-            user_id = email.replace('@', '_').replace('.', '_').replace(' ', '_')
+            user_id = self._make_user_id(email)
             
             # Lấy user document
-            user_ref = self.firebase.db.collection('users').document(user_id)
-            user_doc = user_ref.get()
+            storage = self.firebase.storage
+            user_data = storage.get_user(user_id)
             
-            if not user_doc.exists:
+            if user_data is None:
                 print(f"   User {email} không tồn tại")
+                if missing is not None:
+                    missing.append(email)
                 return False
             
-            user_data = user_doc.to_dict()
-            
-            # Update profile nếu chưa có
-            if not user_data.get('profile', {}).get('ho_ten'):
-                user_ref.update({
-                    'profile.ho_ten': row_data['ho_ten'],
-                    'profile.lop': row_data['lop']
-                })
-            
-            # Tạo feedback object
-            feedback = {
-                'thoi_gian': row_data['dau_thoi_gian'],
-                'noi_dung': row_data['feedback'],
-                'link_bai_lam': row_data['link_bai_lam']
-            }
-            
-            # Thêm feedback vào array (chỉ với user role)
-            if user_data.get('role') == 'user' and row_data['feedback']:
-                user_ref.update({
-                    'feedbacks': user_data.get('feedbacks', []) + [feedback]
-                })
+            try:
+                # Update các field profile đã thay đổi (các dòng sau của cùng user không còn gì để ghi)
+                if profile is None:
+                    profile = self._latest_profile([row_data])
+                profile_updates = self._diff_profile(user_data, profile)
+                if profile_updates:
+                    write_batch = storage.batch()
+                    write_batch.update_user(user_id, {
+                        f'profile.{field}': value for field, value in profile_updates.items()
+                    })
+                    write_batch.commit()
+                    self._reindex_user(user_id, user_data, profile_updates)
+                    if written is not None:
+                        written['profiles'] += 1
+                    if profile_changes is not None:
+                        stored = user_data.get('profile', {})
+                        profile_changes.extend(
+                            {'email': email, 'field': field, 'old': stored.get(field, ''), 'new': value}
+                            for field, value in profile_updates.items()
+                        )
+                
+                # Tạo feedback object
+                feedback = self._build_feedback(row_data)
+                
+                # Thêm/sửa feedback (chỉ với user role), bỏ qua nếu không thay đổi
+                if user_data.get('role') == 'user' and row_data['feedback']:
+                    if storage.embeds_feedbacks:
+                        stored = {item.get('id'): item for item in user_data.get('feedbacks', [])}
+                        previous = stored.get(feedback['id'])
+                    else:
+                        previous = storage.get_feedbacks([(user_id, feedback['id'])]).get((user_id, feedback['id']))
+                    
+                    if previous is None or not self._same_feedback(previous, feedback):
+                        write_batch = storage.batch()
+                        write_batch.upsert_feedback(user_id, feedback, previous)
+                        write_batch.index_feedback(make_index_entry(user_id, user_data, feedback, profile_updates))
+                        write_batch.update_user(user_id, {FEEDBACK_VERSION_FIELD: make_version_stamp()})
+                        if previous is None:
+                            self.stats.add_increments(write_batch, graded=1, activity=1)
+                        write_batch.commit()
+                        if written is not None:
+                            written['feedbacks'] += 1
+                        self._index_feedbacks(user_id, email, [feedback])
+            finally:
+                # Học sinh thấy dữ liệu mới ngay, kể cả khi chỉ ghi được một phần
+                self._invalidate_user(user_id)
             
             return True
             
@@ -160,16 +941,44 @@ class GoogleSheetsExtractor:
             print(f"   Lỗi update user {row_data.get('email', 'Unknown')}: {e}")
             return False
 
-# Test script
-if __name__ == "__main__":
-    SHEET_ID = "1T6fH1S4JkYq1JuC497hdoDqKmMoC-5X1yjzg6fEIHP0"
-    
+def main(argv=None):
+    """
+    Chạy import không cần Streamlit (cron/batch job). Log tiến độ ra stderr, stdout chỉ có JSON tổng kết.
+    Exit code: 0 thành công, 1 lỗi (không đọc được sheet nào, lỗi cấu hình), 2 có dòng/sheet lỗi hoặc lỗi ghi chỉ mục tìm kiếm
+    """
+    parser = argparse.ArgumentParser(description="Import feedback từ Google Sheets")
+    parser.add_argument('sheets', nargs='+', help="Sheet ID hoặc URL Google Sheets")
+    parser.add_argument('--tabs', help="Tên các tab, cách nhau bởi dấu phẩy ('*': tất cả, mặc định: tab đầu tiên)")
+    parser.add_argument('--workers', type=int, default=4, help="Số spreadsheet đọc song song (mặc định 4)")
+    parser.add_argument('--full', action='store_true', help="Đọc lại toàn bộ tab thay vì chỉ các dòng mới")
+    parser.add_argument('--sequential', action='store_true', help="Ghi từng dòng thay vì theo batch")
+    parser.add_argument('--dry-run', action='store_true', help="Chỉ đọc và tính thay đổi, không ghi gì")
+    args = parser.parse_args(argv)
+
+    tabs = [tab.strip() for tab in args.tabs.split(',') if tab.strip()] if args.tabs else None
+    summary = {'ok': False}
+    exit_code = 1
     try:
-        extractor = GoogleSheetsExtractor()
-        
-        if extractor.test_connection(SHEET_ID):
-            print("="*50)
-            extractor.extract_and_update_firebase(SHEET_ID)
-        
+        sources = [{'sheet_id': parse_sheet_id(sheet), 'tabs': tabs} for sheet in args.sheets]
+        with contextlib.redirect_stdout(sys.stderr):
+            # Extractor dùng chung của process, kèm search index để feedback import từ CLI tìm được
+            from resources import get_sheets_extractor
+            extractor = get_sheets_extractor()
+            result = extractor.run_import(
+                sources,
+                batch=not args.sequential,
+                incremental=not args.full,
+                max_workers=args.workers,
+                dry_run=args.dry_run
+            )
+        source_failed = any(item.get('error') for item in result['sources'])
+        exit_code = 2 if result['failed'] or source_failed or result['search_index_error'] else 0
+        summary = dict(result, ok=exit_code == 0)
     except Exception as e:
-        print(f"Lỗi: {e}")
\ No newline at end of file
+        summary['error'] = str(e)
+
+    print(json.dumps(summary, indent=2, ensure_ascii=False, default=str))
+    return exit_code
+
+if __name__ == "__main__":
+    sys.exit(main())
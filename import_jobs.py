@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from metrics import operation
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+class ImportJobManager:
+    """
+    Chạy import Google Sheets trong worker pool của process, độc lập với script Streamlit.
+    Trạng thái job được giữ trong bộ nhớ để trang admin poll nhanh,
+    đồng thời lưu vào storage (import_jobs/{job_id}) để không mất khi đóng tab.
+    """
+
+    # Số lỗi (và số thay đổi profile) tối đa lưu cho mỗi job (giữ document nhỏ)
+    MAX_FAILURES = 200
+    # Khoảng thời gian tối thiểu giữa 2 lần lưu tiến độ vào storage (giây)
+    PERSIST_INTERVAL = 2.0
+    JOBS_COLLECTION = 'import_jobs'
+
+    def __init__(self, extractor, firebase, max_workers=2):
+        self.extractor = extractor
+        self.firebase = firebase
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='import-job')
+        self._jobs = {}
+        self._last_persist = {}
+        self._lock = threading.Lock()
+        self._history_loaded = False
+
+    def submit(self, sources, incremental=True, created_by=None):
+        """
+        Tạo job mới và đưa vào hàng đợi, trả về job_id
+        sources: list {'sheet_id', 'tabs'} như GoogleSheetsExtractor.run_import
+        """
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            'id': job_id,
+            'sources': [dict(source) for source in sources],
+            'incremental': incremental,
+            'created_by': created_by,
+            'state': JOB_QUEUED,
+            'rows_total': 0,
+            'rows_processed': 0,
+            'updated': 0,
+            'failed': 0,
+            'skipped': 0,
+            'failures': [],
+            'report': [],
+            'profile_changes': [],
+            'search_index_error': None,
+            'error': None,
+            'created_at': datetime.now().isoformat(),
+            'started_at': None,
+            'finished_at': None
+        }
+
+        with self._lock:
+            self._jobs[job_id] = job
+        self._persist(job_id, force=True)
+
+        self._executor.submit(self._run, job_id)
+        return job_id
+
+    def get_job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return self._copy(job)
+
+        return self.firebase.storage.get_doc(self.JOBS_COLLECTION, job_id)
+
+    @operation('import_jobs')
+    def list_jobs(self, limit=10):
+        """Các job gần nhất (mới nhất trước), gồm cả job của các lần chạy process trước"""
+        self._load_history(limit)
+        with self._lock:
+            jobs = sorted(self._jobs.values(), key=lambda job: job['created_at'], reverse=True)
+            return [self._copy(job) for job in jobs[:limit]]
+
+    @operation('import')
+    def _run(self, job_id):
+        self._update(job_id, state=JOB_RUNNING, started_at=datetime.now().isoformat())
+        job = self.get_job(job_id)
+
+        def on_row(index, total, email, error, source):
+            with self._lock:
+                job = self._jobs[job_id]
+                job['rows_total'] = total
+                job['rows_processed'] += 1
+                if error is None:
+                    job['updated'] += 1
+                else:
+                    job['failed'] += 1
+                    if len(job['failures']) < self.MAX_FAILURES:
+                        failure = {'row': index, 'email': email, 'error': error}
+                        if source:
+                            failure.update(source)
+                        job['failures'].append(failure)
+            self._persist(job_id)
+
+        try:
+            result = self.extractor.run_import(
+                job['sources'], incremental=job['incremental'], on_row=on_row
+            )
+            self._update(
+                job_id,
+                state=JOB_DONE,
+                updated=result['updated'],
+                failed=result['failed'],
+                skipped=result['skipped'],
+                report=result['sources'],
+                profile_changes=result['profile_changes'][:self.MAX_FAILURES],
+                search_index_error=result['search_index_error'],
+                finished_at=datetime.now().isoformat()
+            )
+        except Exception as e:
+            print(f"Lỗi import job {job_id}: {e}")
+            self._update(job_id, state=JOB_FAILED, error=str(e), finished_at=datetime.now().isoformat())
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+        self._persist(job_id, force=True)
+
+    def _persist(self, job_id, force=False):
+        """Lưu job vào storage, giới hạn tần suất khi chỉ cập nhật tiến độ"""
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._last_persist.get(job_id, 0) < self.PERSIST_INTERVAL:
+                return
+            self._last_persist[job_id] = now
+            data = self._copy(self._jobs[job_id])
+
+        try:
+            self.firebase.storage.set_doc(self.JOBS_COLLECTION, job_id, data)
+        except Exception as e:
+            print(f"Lỗi lưu trạng thái job {job_id}: {e}")
+
+    def _load_history(self, limit):
+        """Đọc các job cũ từ storage một lần duy nhất"""
+        if self._history_loaded:
+            return
+        self._history_loaded = True
+
+        try:
+            docs = self.firebase.storage.query_docs(self.JOBS_COLLECTION, 'created_at', limit=limit)
+            for job in docs:
+                # Job đang chạy ở process trước đã bị dừng giữa chừng
+                if job.get('state') in (JOB_QUEUED, JOB_RUNNING):
+                    job['state'] = JOB_FAILED
+                    job['error'] = 'Bị gián đoạn do process khởi động lại'
+                with self._lock:
+                    self._jobs.setdefault(job['id'], job)
+        except Exception as e:
+            print(f"Lỗi đọc lịch sử import jobs: {e}")
+
+    def _copy(self, job):
+        job = dict(job)
+        job['failures'] = list(job.get('failures', []))
+        job['report'] = list(job.get('report', []))
+        job['profile_changes'] = list(job.get('profile_changes', []))
+        return job
@@ -3,16 +3,47 @@ import os
 import json
 from datetime import datetime
 from typing import List, Dict, Any
-import firebase_admin
-from firebase_admin import credentials, firestore
+from storage import FirestoreStorage, MemoryStorage, SQLiteStorage
+from metrics import InstrumentedStorage
+
+# Cách lưu feedback:
+# - 'array': mảng `feedbacks` trong document users/{id} (mặc định)
+# - 'subcollection': mỗi feedback là một document trong users/{id}/feedbacks
+FEEDBACK_STORAGE_ARRAY = 'array'
+FEEDBACK_STORAGE_SUBCOLLECTION = 'subcollection'
 
 class FirebaseManager:
-    def __init__(self):
+    def __init__(self, storage=None):
+        """
+        storage: backend lưu trữ có sẵn (ví dụ MemoryStorage cho benchmark),
+        mặc định chọn theo biến môi trường STORAGE_BACKEND.
+        Mọi lời gọi storage được đo qua metrics.InstrumentedStorage
+        """
         self.db = None
+        self.feedback_storage = os.getenv('FEEDBACK_STORAGE', FEEDBACK_STORAGE_ARRAY)
+        if self.feedback_storage not in (FEEDBACK_STORAGE_ARRAY, FEEDBACK_STORAGE_SUBCOLLECTION):
+            raise ValueError(f"FEEDBACK_STORAGE không hợp lệ: {self.feedback_storage}")
+        
+        self.storage = InstrumentedStorage(storage or self._create_storage())
+    
+    def _create_storage(self):
+        """Chọn backend theo STORAGE_BACKEND: firestore (mặc định), memory, sqlite"""
+        backend = os.getenv('STORAGE_BACKEND', 'firestore')
+        if backend == 'memory':
+            return MemoryStorage()
+        if backend == 'sqlite':
+            return SQLiteStorage(os.getenv('SQLITE_PATH', 'tce.sqlite3'))
+        if backend != 'firestore':
+            raise ValueError(f"STORAGE_BACKEND không hợp lệ: {backend}")
+        
         self._init_firebase()
+        return FirestoreStorage(self.db, subcollection=self.uses_feedback_subcollection)
     
     def _init_firebase(self):
         """Initialize Firebase từ biến môi trường"""
+        # Import ở đây để process chỉ dùng SQLite/memory (và lúc khởi động app) không phải nạp firebase_admin
+        import firebase_admin
+        from firebase_admin import credentials, firestore
         try:
             if firebase_admin._apps:
                 self.db = firestore.client()
@@ -31,13 +62,14 @@ class FirebaseManager:
         except Exception as e:
             raise Exception(f"Lỗi khởi tạo Firebase: {e}")
     
+    @property
+    def uses_feedback_subcollection(self):
+        return self.feedback_storage == FEEDBACK_STORAGE_SUBCOLLECTION
+    
     def test_connection(self):
         """Test kết nối Firebase"""
         try:
-            # Thử đọc một collection để test
-            test_ref = self.db.collection('test').limit(1)
-            list(test_ref.stream())
-            return True
+            return self.storage.test_connection()
         except Exception as e:
             raise Exception(f"Không thể kết nối Firebase: {e}")
 
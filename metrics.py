@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Đo I/O của storage (Firestore/SQLite/memory) và Google Sheets API theo từng thao tác
+nghiệp vụ (login, xem feedback, import...): số lần gọi, số document đọc/ghi,
+histogram độ trễ và kích thước payload. Xuất dạng Prometheus text hoặc JSON snapshot.
+
+Thao tác hiện tại được gắn bằng `operation('login')` (context manager hoặc decorator),
+mọi lời gọi I/O bên trong được tính cho thao tác đó, ngoài ra là 'other'.
+Kích thước payload chỉ được đo khi bật IO_METRICS_BYTES=1 (serialize JSON mọi kết quả đọc tốn CPU).
+"""
+import os
+import json
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from storage import StorageBackend
+
+# Ngưỡng histogram độ trễ (giây)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Opt-in: đo payload_bytes bằng cách serialize JSON kết quả của mọi lời gọi
+MEASURE_PAYLOAD = os.getenv('IO_METRICS_BYTES', '0') == '1'
+
+_current_operation = contextvars.ContextVar('io_operation', default='other')
+
+@contextmanager
+def operation(name):
+    """Gắn các lời gọi I/O bên trong cho thao tác `name`, lồng nhau thì thao tác trong cùng được tính"""
+    token = _current_operation.set(name)
+    try:
+        yield
+    finally:
+        _current_operation.reset(token)
+
+def current_operation():
+    return _current_operation.get()
+
+def payload_size(value):
+    """Kích thước ước lượng (bytes) của dữ liệu khi serialize JSON, 0 nếu không bật IO_METRICS_BYTES"""
+    if value is None or not MEASURE_PAYLOAD:
+        return 0
+    try:
+        return len(json.dumps(value, ensure_ascii=False, default=str).encode('utf-8'))
+    except (TypeError, ValueError):
+        return 0
+
+class IOMetrics:
+    """Bộ đếm I/O thread-safe, key theo (operation, backend, method)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+        self.started_at = time.time()
+
+    def record(self, backend, method, latency, reads=0, writes=0, payload_bytes=0, error=False):
+        key = (current_operation(), backend, method)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = {
+                    'calls': 0,
+                    'errors': 0,
+                    'reads': 0,
+                    'writes': 0,
+                    'payload_bytes': 0,
+                    'latency_sum': 0.0,
+                    'latency_max': 0.0,
+                    'latency_buckets': [0] * (len(LATENCY_BUCKETS) + 1)
+                }
+                self._series[key] = series
+
+            series['calls'] += 1
+            series['errors'] += 1 if error else 0
+            series['reads'] += reads
+            series['writes'] += writes
+            series['payload_bytes'] += payload_bytes
+            series['latency_sum'] += latency
+            series['latency_max'] = max(series['latency_max'], latency)
+            series['latency_buckets'][self._bucket_index(latency)] += 1
+
+    @contextmanager
+    def timed(self, backend, method):
+        """
+        Đo một lời gọi; body gán call['reads'], call['writes'], call['payload_bytes'] nếu biết
+        """
+        call = {'reads': 0, 'writes': 0, 'payload_bytes': 0}
+        started = time.perf_counter()
+        error = False
+        try:
+            yield call
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.record(backend, method, time.perf_counter() - started, error=error, **call)
+
+    def _bucket_index(self, latency):
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                return index
+        return len(LATENCY_BUCKETS)
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+            self.started_at = time.time()
+
+    def snapshot(self):
+        """JSON snapshot: danh sách series và tổng hợp theo operation"""
+        with self._lock:
+            series = [
+                dict(data, operation=key[0], backend=key[1], method=key[2],
+                     latency_buckets=list(data['latency_buckets']))
+                for key, data in sorted(self._series.items())
+            ]
+
+        operations = {}
+        for item in series:
+            summary = operations.setdefault(item['operation'], {
+                'calls': 0, 'errors': 0, 'reads': 0, 'writes': 0, 'payload_bytes': 0,
+                'latency_sum': 0.0, 'latency_max': 0.0,
+                'latency_buckets': [0] * (len(LATENCY_BUCKETS) + 1)
+            })
+            for field in ('calls', 'errors', 'reads', 'writes', 'payload_bytes', 'latency_sum'):
+                summary[field] += item[field]
+            summary['latency_max'] = max(summary['latency_max'], item['latency_max'])
+            summary['latency_buckets'] = [a + b for a, b in zip(summary['latency_buckets'], item['latency_buckets'])]
+
+        for summary in operations.values():
+            summary['latency_p95'] = self._quantile(summary['latency_buckets'], 0.95, summary['latency_max'])
+
+        return {
+            'started_at': self.started_at,
+            'buckets': list(LATENCY_BUCKETS),
+            'operations': operations,
+            'series': series
+        }
+
+    def summary_rows(self):
+        """Bảng tổng hợp theo operation cho trang admin"""
+        rows = []
+        for name, summary in sorted(self.snapshot()['operations'].items()):
+            calls = summary['calls']
+            rows.append({
+                'operation': name,
+                'calls': calls,
+                'reads': summary['reads'],
+                'writes': summary['writes'],
+                'errors': summary['errors'],
+                'avg_ms': round(summary['latency_sum'] / calls * 1000, 1) if calls else 0.0,
+                'p95_ms': round(summary['latency_p95'] * 1000, 1),
+                'max_ms': round(summary['latency_max'] * 1000, 1),
+                'payload_kb': round(summary['payload_bytes'] / 1024, 1)
+            })
+        return rows
+
+    def _quantile(self, buckets, q, latency_max):
+        """Ước lượng quantile từ histogram: cận trên của bucket chứa quantile, không vượt quá max"""
+        total = sum(buckets)
+        if not total:
+            return 0.0
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(buckets):
+            cumulative += count
+            if cumulative >= rank:
+                return min(LATENCY_BUCKETS[index], latency_max) if index < len(LATENCY_BUCKETS) else latency_max
+        return latency_max
+
+    def to_prometheus(self, prefix='tce_io'):
+        """Xuất Prometheus text exposition format"""
+        series = self.snapshot()['series']
+        lines = []
+
+        def labels(item, extra=''):
+            text = f'operation="{item["operation"]}",backend="{item["backend"]}",method="{item["method"]}"'
+            return '{' + text + extra + '}'
+
+        counters = (
+            ('calls_total', 'calls', 'Số lời gọi I/O'),
+            ('errors_total', 'errors', 'Số lời gọi I/O bị lỗi'),
+            ('documents_read_total', 'reads', 'Số document đọc (tính phí đọc Firestore)'),
+            ('documents_written_total', 'writes', 'Số thao tác ghi document'),
+            ('payload_bytes_total', 'payload_bytes', 'Tổng kích thước payload (ước lượng JSON)')
+        )
+        for name, field, help_text in counters:
+            lines.append(f'# HELP {prefix}_{name} {help_text}')
+            lines.append(f'# TYPE {prefix}_{name} counter')
+            for item in series:
+                lines.append(f'{prefix}_{name}{labels(item)} {item[field]}')
+
+        name = f'{prefix}_latency_seconds'
+        lines.append(f'# HELP {name} Độ trễ lời gọi I/O')
+        lines.append(f'# TYPE {name} histogram')
+        for item in series:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), item['latency_buckets']):
+                cumulative += count
+                le = f',le="{bound}"'
+                lines.append(f'{name}_bucket{labels(item, le)} {cumulative}')
+            lines.append(f'{name}_sum{labels(item)} {item["latency_sum"]:.6f}')
+            lines.append(f'{name}_count{labels(item)} {item["calls"]}')
+
+        return '\n'.join(lines) + '\n'
+
+# Bộ đếm dùng chung cho cả process
+io_metrics = IOMetrics()
+
+class StartupTimings:
+    """
+    Thời gian khởi tạo từng thành phần (Firebase, services, Sheets client...) và thời điểm
+    sẵn sàng tính từ lúc process nạp module này, để theo dõi cold start giữa các phiên bản
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._components = {}  # name -> {'duration_s', 'ready_at_s', 'error'}
+
+    @contextmanager
+    def timed(self, component):
+        started = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            finished = time.perf_counter()
+            with self._lock:
+                self._components[component] = {
+                    'duration_s': finished - started,
+                    'ready_at_s': finished - self.started,
+                    'error': error
+                }
+
+    def rows(self):
+        """Bảng theo thứ tự sẵn sàng; thời gian của một thành phần gồm cả các thành phần nó tạo kèm"""
+        with self._lock:
+            items = sorted(self._components.items(), key=lambda item: item[1]['ready_at_s'])
+        return [
+            {
+                'component': name,
+                'duration_ms': round(data['duration_s'] * 1000, 1),
+                'ready_at_ms': round(data['ready_at_s'] * 1000, 1),
+                'error': data['error'] or ''
+            }
+            for name, data in items
+        ]
+
+startup_timings = StartupTimings()
+
+class _InstrumentedBatch:
+    """Bọc batch ghi của backend, đo thời gian và số thao tác khi commit"""
+
+    def __init__(self, storage, inner):
+        self._storage = storage
+        self._inner = inner
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+    def __len__(self):
+        return len(self._inner)
+
+    def commit(self):
+        with self._storage.metrics.timed(self._storage.name, 'commit') as call:
+            call['writes'] = len(self._inner)
+            self._inner.commit()
+
+class InstrumentedStorage(StorageBackend):
+    """Bọc một StorageBackend và ghi nhận mọi lời gọi vào IOMetrics"""
+
+    def __init__(self, inner, metrics=None):
+        self.inner = inner
+        self.metrics = metrics or io_metrics
+        self.name = inner.name
+        self.embeds_feedbacks = inner.embeds_feedbacks
+
+    def __getattr__(self, name):
+        # Thuộc tính riêng của backend (db, subcollection...)
+        return getattr(self.inner, name)
+
+    def get_user(self, user_id):
+        with self.metrics.timed(self.name, 'get_user') as call:
+            user = self.inner.get_user(user_id)
+            call['reads'] = 1
+            call['payload_bytes'] = payload_size(user)
+            return user
+
+    def get_users(self, user_ids):
+        with self.metrics.timed(self.name, 'get_users') as call:
+            users = self.inner.get_users(user_ids)
+            call['reads'] = len(user_ids)
+            call['payload_bytes'] = payload_size(users)
+            return users
+
+    def batch(self):
+        return _InstrumentedBatch(self, self.inner.batch())
+
+    def query_feedbacks(self, user_id, limit=None, cursor=None, fields=None):
+        with self.metrics.timed(self.name, 'query_feedbacks') as call:
+            feedbacks, next_cursor = self.inner.query_feedbacks(user_id, limit, cursor, fields)
+            # Query trả về 0 document vẫn tính 1 lần đọc
+            call['reads'] = 1 if self.embeds_feedbacks else max(1, len(feedbacks))
+            call['payload_bytes'] = payload_size(feedbacks)
+            return feedbacks, next_cursor
+
+    def get_feedbacks(self, keys):
+        with self.metrics.timed(self.name, 'get_feedbacks') as call:
+            feedbacks = self.inner.get_feedbacks(keys)
+            # Chế độ array: đọc user documents chứa các feedback
+            call['reads'] = len({user_id for user_id, _ in keys}) if self.embeds_feedbacks else len(keys)
+            call['payload_bytes'] = payload_size(list(feedbacks.values()))
+            return feedbacks
+
+    def query_feedback_index(self, lop=None, start=None, end=None, limit=None, cursor=None):
+        with self.metrics.timed(self.name, 'query_feedback_index') as call:
+            entries, next_cursor = self.inner.query_feedback_index(lop, start, end, limit, cursor)
+            call['reads'] = max(1, len(entries))
+            call['payload_bytes'] = payload_size(entries)
+            return entries, next_cursor
+
+    def get_docs(self, collection, doc_ids):
+        with self.metrics.timed(self.name, f'get_docs:{collection}') as call:
+            docs = self.inner.get_docs(collection, doc_ids)
+            call['reads'] = len(doc_ids)
+            call['payload_bytes'] = payload_size(docs)
+            return docs
+
+    def query_docs(self, collection, order_by, descending=True, limit=None):
+        with self.metrics.timed(self.name, f'query_docs:{collection}') as call:
+            docs = self.inner.query_docs(collection, order_by, descending, limit)
+            call['reads'] = max(1, len(docs))
+            call['payload_bytes'] = payload_size(docs)
+            return docs
+
+    def stream_users(self):
+        started = time.perf_counter()
+        reads = 0
+        try:
+            for user in self.inner.stream_users():
+                reads += 1
+                yield user
+        finally:
+            self.metrics.record(self.name, 'stream_users', time.perf_counter() - started, reads=reads)
+
+    def watch_users(self, on_changes):
+        return self.inner.watch_users(self._counting_listener('watch_users', on_changes))
+
+    def watch_feedbacks(self, on_changes):
+        return self.inner.watch_feedbacks(self._counting_listener('watch_feedbacks', on_changes))
+
+    def _counting_listener(self, method, on_changes):
+        # Mỗi document thay đổi gửi về listener tính một lần đọc
+        def listener(changes):
+            with self.metrics.timed(self.name, method) as call:
+                call['reads'] = len(changes)
+                on_changes(changes)
+        return listener
+
+    def count_users(self, role=None):
+        with self.metrics.timed(self.name, 'count_users') as call:
+            count = self.inner.count_users(role)
+            # Count aggregation tính 1 lần đọc cho mỗi 1000 document
+            call['reads'] = max(1, (count or 0) // 1000 + 1)
+            return count
+
+    def count_feedbacks(self):
+        with self.metrics.timed(self.name, 'count_feedbacks') as call:
+            count = self.inner.count_feedbacks()
+            call['reads'] = 0 if count is None else count // 1000 + 1
+            return count
+
+    def test_connection(self):
+        with self.metrics.timed(self.name, 'test_connection') as call:
+            call['reads'] = 1
+            return self.inner.test_connection()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+import argparse
+from firebase_admin import firestore
+from init_firebase import FirebaseManager
+from storage import make_feedback_id, parse_feedback_time
+
+class FeedbackMigrator:
+    """Chuyển mảng `feedbacks` trong users/{id} sang subcollection users/{id}/feedbacks"""
+
+    # Số thao tác tối đa mỗi WriteBatch (Firestore giới hạn 500)
+    BATCH_SIZE = 400
+
+    def __init__(self):
+        self.firebase = FirebaseManager()
+        if self.firebase.db is None:
+            raise ValueError("Migrate chỉ áp dụng cho STORAGE_BACKEND=firestore")
+
+    def migrate(self, dry_run=False, keep_array=False):
+        """
+        Migrate toàn bộ users. Id document là id ổn định của feedback (cùng công thức với import),
+        nên chạy lại nhiều lần hay import lại sheet sau khi migrate không tạo feedback trùng.
+        dry_run: chỉ đếm, không ghi
+        keep_array: giữ lại mảng cũ sau khi copy (mặc định sẽ xóa field `feedbacks`)
+        """
+        users_ref = self.firebase.db.collection('users')
+
+        migrated_users = 0
+        migrated_feedbacks = 0
+        failed_count = 0
+
+        for user_doc in users_ref.stream():
+            user_data = user_doc.to_dict() or {}
+            feedbacks = user_data.get('feedbacks')
+            if not feedbacks:
+                continue
+
+            try:
+                if not dry_run:
+                    self._migrate_user(user_doc.reference, user_data.get('email', ''), feedbacks, keep_array)
+                migrated_users += 1
+                migrated_feedbacks += len(feedbacks)
+                print(f"✅ {user_doc.id}: {len(feedbacks)} feedbacks")
+
+            except Exception as e:
+                failed_count += 1
+                print(f"❌ {user_doc.id}: {e}")
+
+        prefix = "[DRY RUN] " if dry_run else ""
+        print(f"\n📊 {prefix}Kết quả: {migrated_users} users, {migrated_feedbacks} feedbacks, {failed_count} thất bại")
+        return {'users': migrated_users, 'feedbacks': migrated_feedbacks, 'failed': failed_count}
+
+    @staticmethod
+    def feedback_doc(email, feedback):
+        """
+        Document subcollection cho một feedback trong mảng cũ
+        Returns: (doc_id, doc) - doc_id là id sẵn có hoặc make_feedback_id(email, thoi_gian, link_bai_lam),
+        giống id import sinh ra cho cùng dòng sheet
+        """
+        doc = dict(feedback)
+        doc['id'] = feedback.get('id') or make_feedback_id(email, feedback.get('thoi_gian'), feedback.get('link_bai_lam'))
+        doc['timestamp'] = parse_feedback_time(feedback.get('thoi_gian', ''))
+        return doc['id'], doc
+
+    def _migrate_user(self, user_ref, email, feedbacks, keep_array):
+        feedbacks_ref = user_ref.collection('feedbacks')
+
+        write_batch = self.firebase.db.batch()
+        op_count = 0
+        for feedback in feedbacks:
+            doc_id, doc = self.feedback_doc(email, feedback)
+            write_batch.set(feedbacks_ref.document(doc_id), doc)
+            op_count += 1
+
+            if op_count >= self.BATCH_SIZE:
+                write_batch.commit()
+                write_batch = self.firebase.db.batch()
+                op_count = 0
+
+        # Xóa mảng cũ trong batch cuối, sau khi mọi feedback đã được copy
+        if not keep_array:
+            write_batch.update(user_ref, {'feedbacks': firestore.DELETE_FIELD})
+            op_count += 1
+
+        if op_count:
+            write_batch.commit()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate feedbacks sang subcollection users/{id}/feedbacks")
+    parser.add_argument('--dry-run', action='store_true', help="Chỉ đếm, không ghi dữ liệu")
+    parser.add_argument('--keep-array', action='store_true', help="Giữ lại mảng feedbacks cũ")
+    args = parser.parse_args()
+
+    try:
+        migrator = FeedbackMigrator()
+        migrator.migrate(dry_run=args.dry_run, keep_array=args.keep_array)
+    except Exception as e:
+        print(f"❌ Lỗi: {e}")
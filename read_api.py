@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+HTTP JSON API chỉ đọc cho feedback của học sinh (tích hợp LMS, app khác), chạy cạnh Streamlit.
+
+    GET /health
+    GET /users/{email}/profile
+    GET /users/{email}/feedbacks?limit=20&cursor=...
+
+Mọi request (trừ /health) cần header `Authorization: Bearer <READ_API_TOKEN>`.
+Response có ETag; request gửi lại If-None-Match trùng ETag nhận 304 không body. ETag của
+danh sách feedback lấy từ version stamp trên user document (đổi mỗi khi feedback được ghi),
+nên request 304 chỉ đọc user document qua bản sao/cache của service, không query feedback.
+
+    python read_api.py --port 8502
+"""
+import os
+import sys
+import json
+import hmac
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from metrics import operation
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def make_etag(*parts):
+    return '"' + hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()[:20] + '"'
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match có thể là '*' hoặc danh sách ETag (so sánh weak)"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == '*' or candidate == etag:
+            return True
+    return False
+
+def encode_cursor(cursor):
+    """Cursor của service có thể là offset (int) hoặc id/key (str), giữ nguyên kiểu khi trả về client"""
+    if cursor is None:
+        return None
+    return f"o{cursor}" if isinstance(cursor, int) else f"k{cursor}"
+
+def decode_cursor(value):
+    if not value:
+        return None
+    if value[0] == 'o' and value[1:].isdigit():
+        return int(value[1:])
+    if value[0] == 'k' and len(value) > 1:
+        return value[1:]
+    raise ValueError("cursor không hợp lệ")
+
+class APIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class ReadAPIHandler(BaseHTTPRequestHandler):
+    server_version = 'TCEReadAPI/1.0'
+    # Keep-alive: client gọi nhiều request liên tiếp không phải mở kết nối lại
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # Không log từng request (tần suất cao), lỗi được print riêng
+        pass
+
+    @operation('api')
+    def do_GET(self):
+        try:
+            status, payload, etag = self._route()
+        except APIError as e:
+            status, payload, etag = e.status, {'error': str(e)}, None
+        except Exception as e:
+            print(f"Read API: lỗi {self.path}: {e}")
+            status, payload, etag = 500, {'error': "Lỗi server"}, None
+
+        if etag is not None and etag_matches(self.headers.get('If-None-Match'), etag):
+            self._send(304, None, etag)
+        else:
+            self._send(status, payload, etag)
+
+    def _route(self):
+        url = urlsplit(self.path)
+        parts = [unquote(part) for part in url.path.strip('/').split('/') if part]
+        if parts == ['health']:
+            return 200, {'ok': True}, None
+
+        self._check_token()
+        if len(parts) == 3 and parts[0] == 'users' and parts[2] == 'profile':
+            return self._profile(parts[1])
+        if len(parts) == 3 and parts[0] == 'users' and parts[2] == 'feedbacks':
+            return self._feedbacks(parts[1], parse_qs(url.query))
+        raise APIError(404, "Không tìm thấy")
+
+    def _check_token(self):
+        expected = self.server.token
+        header = self.headers.get('Authorization', '')
+        token = header[len('Bearer '):] if header.startswith('Bearer ') else ''
+        if not hmac.compare_digest(token.encode('utf-8'), expected.encode('utf-8')):
+            raise APIError(401, "Sai hoặc thiếu token")
+
+    def _profile(self, email):
+        profile = self.server.service.get_user_profile(email)
+        if profile is None:
+            raise APIError(404, "User không tồn tại")
+        # Profile nằm ngay trong user document (đã cache), ETag lấy từ chính nội dung
+        return 200, profile, make_etag('profile', json.dumps(profile, sort_keys=True, default=str))
+
+    def _feedbacks(self, email, query):
+        try:
+            limit = int(query.get('limit', [DEFAULT_PAGE_SIZE])[0])
+            cursor = decode_cursor(query.get('cursor', [''])[0])
+        except ValueError as e:
+            raise APIError(400, f"Tham số không hợp lệ: {e}")
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+        service = self.server.service
+        version = service.get_feedback_version(email)
+        if version is None:
+            raise APIError(404, "User không tồn tại")
+
+        etag = make_etag('feedbacks', email.replace(' ', ''), version, limit, cursor)
+        if etag_matches(self.headers.get('If-None-Match'), etag):
+            # Client đã có đúng trang này, không cần query feedback
+            return 304, None, etag
+
+        feedbacks, next_cursor = service.get_user_feedbacks_page(email, limit=limit, cursor=cursor)
+        return 200, {'feedbacks': feedbacks, 'next_cursor': encode_cursor(next_cursor)}, etag
+
+    def _send(self, status, payload, etag=None):
+        body = b'' if payload is None else json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        if etag is not None:
+            self.send_header('ETag', etag)
+            # Client luôn hỏi lại bằng If-None-Match, dữ liệu mới thấy ngay sau import
+            self.send_header('Cache-Control', 'private, no-cache')
+        if status != 304:
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if status != 304:
+            self.wfile.write(body)
+
+def create_server(service, host='0.0.0.0', port=8502, token=None):
+    """ThreadingHTTPServer phục vụ API từ `service` (UserFeedbackService dùng chung với app)"""
+    token = token if token is not None else os.getenv('READ_API_TOKEN')
+    if not token:
+        raise ValueError("Chưa cấu hình READ_API_TOKEN")
+    server = ThreadingHTTPServer((host, port), ReadAPIHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.token = token
+    return server
+
+def start_in_background(service, host='0.0.0.0', port=8502, token=None):
+    """Chạy API trên thread nền (cùng process Streamlit, dùng chung cache/bản sao users). Returns: server"""
+    server = create_server(service, host, port, token)
+    threading.Thread(target=server.serve_forever, name='read-api', daemon=True).start()
+    print(f"Read API: đang chạy ở {host}:{port}")
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP JSON API chỉ đọc cho feedback")
+    parser.add_argument('--host', default='0.0.0.0', help="Địa chỉ lắng nghe (mặc định 0.0.0.0)")
+    parser.add_argument('--port', type=int, default=int(os.getenv('READ_API_PORT', '8502')), help="Cổng (mặc định 8502)")
+    args = parser.parse_args()
+
+    try:
+        from resources import get_feedback_service, warm_up
+        warm_up()
+        server = create_server(get_feedback_service(), args.host, args.port)
+        print(f"✅ Read API đang chạy ở {args.host}:{args.port}")
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"❌ Lỗi: {e}")
+        sys.exit(1)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Retry, giới hạn tốc độ và điều chỉnh concurrency cho các lời gọi Google Sheets / Firestore.
+- call_with_retry: retry exponential backoff có jitter cho lỗi tạm thời (429, 5xx, contention)
+- TokenBucket: giới hạn số request theo quota mỗi phút
+- AdaptiveConcurrency: giảm một nửa số lời gọi song song khi bị throttle, tăng dần lại khi ổn định
+"""
+import time
+import random
+import socket
+import threading
+from contextlib import contextmanager
+
+# HTTP status của lỗi tạm thời, gọi lại có thể thành công
+TRANSIENT_STATUS = (408, 429, 500, 502, 503, 504)
+
+# google.api_core (kéo theo grpc) và googleapiclient chỉ được import khi xử lý lỗi,
+# để import storage/resources lúc khởi động không tốn thời gian nạp các thư viện này
+
+def _transient_api_errors():
+    """Lỗi Firestore/gRPC tạm thời"""
+    from google.api_core import exceptions as api_exceptions
+    return (
+        api_exceptions.TooManyRequests,  # gồm ResourceExhausted
+        api_exceptions.ServiceUnavailable,
+        api_exceptions.InternalServerError,
+        api_exceptions.DeadlineExceeded,
+        api_exceptions.Aborted,
+        api_exceptions.GatewayTimeout,
+        api_exceptions.BadGateway
+    )
+
+def _write_safe_api_errors():
+    """Lỗi chắc chắn chưa ghi gì (bị từ chối hoặc transaction bị hủy), retry ghi không gây trùng"""
+    from google.api_core import exceptions as api_exceptions
+    return (
+        api_exceptions.TooManyRequests,
+        api_exceptions.Aborted
+    )
+
+def _http_status(error):
+    from googleapiclient.errors import HttpError
+    if isinstance(error, HttpError):
+        return error.status_code or getattr(error.resp, 'status', None)
+    return None
+
+def is_throttle_error(error):
+    """Lỗi do vượt quota / rate limit"""
+    from google.api_core import exceptions as api_exceptions
+    return _http_status(error) == 429 or isinstance(error, api_exceptions.TooManyRequests)
+
+def is_transient_error(error):
+    """Lỗi tạm thời, an toàn để retry lời gọi đọc (idempotent)"""
+    status = _http_status(error)
+    if status is not None:
+        return status in TRANSIENT_STATUS
+    if isinstance(error, _transient_api_errors()):
+        return True
+    return isinstance(error, (socket.timeout, ConnectionError, TimeoutError))
+
+def is_retryable_write_error(error):
+    """Lỗi mà lần ghi chắc chắn chưa được áp dụng (retry không làm counter/feedback bị cộng hai lần)"""
+    return isinstance(error, _write_safe_api_errors())
+
+def retry_after_seconds(error):
+    """Giá trị header Retry-After (giây) nếu server gửi kèm"""
+    resp = getattr(error, 'resp', None)
+    value = resp.get('retry-after') if resp is not None and hasattr(resp, 'get') else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+def call_with_retry(fn, is_retryable=is_transient_error, attempts=5, base_delay=0.5, max_delay=32.0,
+                    description='request', on_error=None):
+    """
+    Gọi fn(), retry khi lỗi thỏa is_retryable với exponential backoff + full jitter
+    (hoặc theo Retry-After nếu có). Raise lỗi cuối cùng khi hết số lần thử.
+    on_error: callback(error) mỗi lần lỗi, ví dụ để giảm concurrency khi bị throttle
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if on_error is not None:
+                on_error(e)
+            if attempt >= attempts or not is_retryable(e):
+                raise
+
+            delay = retry_after_seconds(e)
+            if delay is None:
+                delay = random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+            print(f"   {description}: {e.__class__.__name__}, thử lại lần {attempt} sau {delay:.1f}s")
+            time.sleep(delay)
+
+class TokenBucket:
+    """Giới hạn tốc độ: tối đa `per_minute` request mỗi phút, cho phép burst tới `capacity`"""
+
+    def __init__(self, per_minute, capacity=None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1):
+        """Chờ tới khi đủ token. Returns: số giây đã chờ"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def drain(self):
+        """Bỏ hết token còn lại (khi server báo vượt quota), các request sau phải chờ refill"""
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+
+class AdaptiveConcurrency:
+    """
+    Giới hạn số lời gọi đồng thời theo kiểu AIMD: giảm một nửa khi bị throttle,
+    tăng 1 sau mỗi `increase_after` lời gọi thành công liên tiếp, tối đa max_limit
+    """
+
+    def __init__(self, max_limit, min_limit=1, increase_after=20):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.increase_after = increase_after
+        self.limit = self.max_limit
+        self._active = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def on_success(self):
+        with self._cond:
+            self._successes += 1
+            if self._successes >= self.increase_after and self.limit < self.max_limit:
+                self.limit += 1
+                self._successes = 0
+                self._cond.notify_all()
+
+    def on_throttle(self):
+        with self._cond:
+            self.limit = max(self.min_limit, self.limit // 2)
+            self._successes = 0
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Các resource dùng chung cho toàn process (Firebase client, Sheets client, services).
+Mỗi resource được tạo lazily đúng một lần, an toàn khi nhiều session/thread gọi cùng lúc.
+start_warm_up() khởi tạo trước Firebase và các service học sinh cần trên thread nền,
+rồi chạy read API (read_api.py) trong cùng process nếu có READ_API_PORT và thread đối soát thống kê.
+
+    python resources.py    # đo thời gian khởi tạo từng thành phần (JSON)
+"""
+import os
+import json
+import time
+import threading
+from init_firebase import FirebaseManager
+from feedback_service import UserFeedbackService
+from feedback_index import FeedbackIndex
+from export_feedbacks import FeedbackExporter
+from ggsheet_extract import GoogleSheetsExtractor
+from import_jobs import ImportJobManager
+from search_index import SearchIndex
+from stats_service import StatsService
+from user_mirror import UserMirror
+from metrics import startup_timings
+
+# RLock vì factory của một resource có thể gọi getter của resource khác
+_lock = threading.RLock()
+_resources = {}
+
+def _get_or_create(name, factory):
+    resource = _resources.get(name)
+    if resource is not None:
+        return resource
+    
+    with _lock:
+        # Kiểm tra lại sau khi có lock, thread khác có thể đã tạo xong
+        resource = _resources.get(name)
+        if resource is None:
+            with startup_timings.timed(name):
+                resource = factory()
+            _resources[name] = resource
+        return resource
+
+def get_firebase_manager():
+    return _get_or_create('firebase_manager', FirebaseManager)
+
+def _create_user_mirror():
+    # Opt-in: giữ toàn bộ users (và feedback lưu riêng) trong RAM của process
+    if os.getenv('USER_MIRROR', '0') != '1':
+        return None
+    mirror = UserMirror(get_firebase_manager())
+    mirror.start()
+    return mirror
+
+def get_feedback_service():
+    return _get_or_create(
+        'feedback_service',
+        lambda: UserFeedbackService(firebase=get_firebase_manager(), mirror=_create_user_mirror())
+    )
+
+def get_stats_service():
+    return _get_or_create(
+        'stats_service',
+        lambda: StatsService(firebase=get_firebase_manager())
+    )
+
+def get_feedback_index():
+    return _get_or_create(
+        'feedback_index',
+        lambda: FeedbackIndex(firebase=get_firebase_manager())
+    )
+
+def get_feedback_exporter():
+    return _get_or_create(
+        'feedback_exporter',
+        lambda: FeedbackExporter(firebase=get_firebase_manager())
+    )
+
+def get_search_index():
+    return _get_or_create(
+        'search_index',
+        lambda: SearchIndex(firebase=get_firebase_manager())
+    )
+
+def get_sheets_extractor():
+    return _get_or_create(
+        'sheets_extractor',
+        lambda: GoogleSheetsExtractor(
+            firebase=get_firebase_manager(),
+            user_cache=get_feedback_service().user_cache,
+            stats=get_stats_service(),
+            search_index=get_search_index()
+        )
+    )
+
+def get_import_jobs():
+    return _get_or_create(
+        'import_jobs',
+        lambda: ImportJobManager(
+            extractor=get_sheets_extractor(),
+            firebase=get_firebase_manager(),
+            max_workers=int(os.getenv('IMPORT_WORKERS', '2'))
+        )
+    )
+
+_warm_up_thread = None
+
+# Khoảng thời gian giữa hai lần kiểm tra đối soát, việc đối soát thật theo STATS_RECONCILE_HOURS
+STATS_RECONCILE_CHECK_SECONDS = 3600
+
+def warm_up():
+    """
+    Khởi tạo Firebase (kết nối + lần đọc đầu tiên để mở channel/lấy token) và các service
+    mà mọi session đều cần. Sheets client không nằm ở đây, được tạo khi admin dùng lần đầu.
+    """
+    with startup_timings.timed('warm_up'):
+        firebase = get_firebase_manager()
+        with startup_timings.timed('storage_connection'):
+            firebase.test_connection()
+        get_feedback_service()
+        get_stats_service()
+
+def start_warm_up():
+    """Chạy warm_up() trên thread nền đúng một lần mỗi process, trang đầu tiên không phải chờ"""
+    global _warm_up_thread
+    with _lock:
+        if _warm_up_thread is not None:
+            return
+        
+        def run():
+            try:
+                warm_up()
+                print("Warm-up xong: " + ", ".join(
+                    f"{row['component']} {row['duration_ms']}ms" for row in startup_timings.rows()
+                ))
+            except Exception as e:
+                # Session đầu tiên sẽ tạo lại resource và hiển thị lỗi
+                print(f"Lỗi warm-up: {e}")
+            start_read_api()
+            start_stats_reconcile()
+        
+        _warm_up_thread = threading.Thread(target=run, name='warm-up', daemon=True)
+        _warm_up_thread.start()
+
+def start_stats_reconcile():
+    """Thread nền đối soát thống kê khi quá hạn (reconcile_if_stale), trang admin chỉ đọc document stats"""
+    def run():
+        while True:
+            try:
+                get_stats_service().reconcile_if_stale()
+            except Exception as e:
+                print(f"Lỗi đối soát thống kê: {e}")
+            time.sleep(STATS_RECONCILE_CHECK_SECONDS)
+    
+    threading.Thread(target=run, name='stats-reconcile', daemon=True).start()
+
+def start_read_api():
+    """Chạy read API trên thread nền nếu có READ_API_PORT. Returns: server hoặc None"""
+    port = os.getenv('READ_API_PORT')
+    if not port:
+        return None
+    try:
+        import read_api
+        return read_api.start_in_background(get_feedback_service(), port=int(port))
+    except Exception as e:
+        print(f"Lỗi khởi động read API: {e}")
+        return None
+
+if __name__ == "__main__":
+    try:
+        warm_up()
+        # Sheets client chỉ admin dùng, tạo thêm để report đủ mọi thành phần
+        get_sheets_extractor().service
+    except Exception as e:
+        print(f"❌ Lỗi: {e}")
+    print(json.dumps(startup_timings.rows(), indent=2, ensure_ascii=False))
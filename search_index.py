@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Chỉ mục tìm kiếm full-text cho nội dung feedback.
+
+Chỉ mục được lưu dạng các segment trong collection `search_segments`, mỗi segment gồm
+danh sách feedback (key, email, thời gian, trích đoạn) và postings {term: [vị trí trong danh sách]}.
+Import ghi thêm segment mới, nên đọc lại chỉ mục chỉ tốn một lần đọc cho mỗi segment;
+khi có quá nhiều segment nhỏ chúng được gộp lại (compaction). Khi truy vấn, toàn bộ
+postings nằm trong bộ nhớ process.
+
+Segment được chia theo tổng số posting và kích thước ước lượng (không theo số feedback) để nằm
+trong giới hạn 1 MiB mỗi document của Firestore. Field `postings` và `docs` cần được miễn
+single-field index (xem README), nếu không mỗi phần tử mảng là một index entry (giới hạn 40.000).
+
+    python search_index.py --rebuild      # dựng lại chỉ mục từ toàn bộ feedback
+    python search_index.py "luận điểm"    # thử truy vấn
+"""
+import os
+import re
+import sys
+import time
+import uuid
+import argparse
+import threading
+import unicodedata
+import math
+from init_firebase import FirebaseManager
+from storage import feedback_sort_key
+from metrics import operation, payload_size
+
+SEGMENTS_COLLECTION = 'search_segments'
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+def normalize_text(text):
+    """Chữ thường, bỏ dấu tiếng Việt (kể cả đ -> d): 'Luận điểm' -> 'luan diem'"""
+    text = (text or '').lower().replace('đ', 'd')
+    decomposed = unicodedata.normalize('NFD', text)
+    return ''.join(char for char in decomposed if unicodedata.category(char) != 'Mn')
+
+def tokenize(text):
+    """Các term đã chuẩn hóa, bỏ term 1 ký tự (trừ chữ số)"""
+    return [token for token in _TOKEN_RE.findall(normalize_text(text)) if len(token) > 1 or token.isdigit()]
+
+def feedback_key(user_id, feedback_id):
+    return f"{user_id}:{feedback_id}"
+
+class SearchIndex:
+    """
+    Chỉ mục term -> feedback trong bộ nhớ, đồng bộ với các segment đã lưu.
+    Thread-safe; được nạp lazily ở lần tìm kiếm đầu tiên và nạp lại sau `ttl` giây
+    để thấy dữ liệu do process khác (CLI import) ghi.
+    """
+
+    # Tổng số posting (cặp term, feedback) tối đa mỗi segment
+    MAX_SEGMENT_POSTINGS = 20000
+    # Kích thước ước lượng tối đa mỗi segment (Firestore giới hạn 1 MiB mỗi document)
+    MAX_SEGMENT_BYTES = 600 * 1024
+    # Tổng kích thước tối đa các segment trong một batch ghi (Firestore giới hạn 10 MiB mỗi request)
+    MAX_BATCH_BYTES = 3 * 1024 * 1024
+    # Số ký tự nội dung lưu kèm để hiển thị kết quả
+    SNIPPET_LENGTH = 240
+    # Gộp segment khi số segment vượt quá số cần thiết cộng thêm ngưỡng này
+    COMPACT_SLACK = 10
+
+    def __init__(self, firebase=None, ttl=None):
+        self.firebase = firebase or FirebaseManager()
+        self.ttl = ttl if ttl is not None else float(os.getenv('SEARCH_INDEX_TTL', '300'))
+        self._lock = threading.RLock()
+        self._postings = {}  # term -> set(key)
+        self._terms = {}  # key -> set(term), để gỡ bản cũ khi feedback bị sửa
+        self._docs = {}  # key -> {user_id, feedback_id, email, thoi_gian, snippet}
+        self._sizes = {}  # key -> kích thước ước lượng của feedback trong segment
+        self._segment_ids = []
+        self._pending = []
+        self._loaded_at = None
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+                self.reload()
+
+    def reload(self):
+        """Đọc lại toàn bộ segment (mỗi segment một lần đọc), segment sau ghi đè segment trước"""
+        segments = self.firebase.storage.query_docs(SEGMENTS_COLLECTION, 'seq', descending=False)
+        with self._lock:
+            self._postings = {}
+            self._terms = {}
+            self._docs = {}
+            self._sizes = {}
+            for segment in segments:
+                self._load_segment(segment)
+            self._segment_ids = [segment['id'] for segment in segments]
+            # Thay đổi chưa flush vẫn phải thấy được
+            for entry, terms in self._pending:
+                self._add_entry(entry, terms)
+            self._loaded_at = time.monotonic()
+
+    def _load_segment(self, segment):
+        entries = segment.get('docs', [])
+        terms_by_position = {}
+        for term, positions in segment.get('postings', {}).items():
+            for position in positions:
+                terms_by_position.setdefault(position, set()).add(term)
+        for position, entry in enumerate(entries):
+            self._add_entry(entry, terms_by_position.get(position, set()))
+
+    def _add_entry(self, entry, terms):
+        key = feedback_key(entry['user_id'], entry['feedback_id'])
+        for term in self._terms.pop(key, ()):
+            keys = self._postings.get(term)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[term]
+        self._docs[key] = entry
+        self._terms[key] = set(terms)
+        self._sizes[key] = self._item_size(entry, terms)
+        for term in terms:
+            self._postings.setdefault(term, set()).add(key)
+
+    def add_feedback(self, user_id, email, feedback):
+        """Thêm/cập nhật một feedback (gọi sau khi feedback đã được ghi), lưu khi flush()"""
+        content = feedback.get('noi_dung', '')
+        entry = {
+            'user_id': user_id,
+            'feedback_id': feedback['id'],
+            'email': email,
+            'thoi_gian': feedback.get('thoi_gian', ''),
+            'snippet': content[:self.SNIPPET_LENGTH]
+        }
+        terms = set(tokenize(content))
+        with self._lock:
+            self._pending.append((entry, terms))
+            if self._loaded_at is not None:
+                self._add_entry(entry, terms)
+
+    def flush(self):
+        """Ghi các feedback đã thêm thành segment mới, gộp segment nếu quá nhiều"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+
+        try:
+            segment_ids = self._write_segments(pending)
+        except Exception:
+            with self._lock:
+                self._pending = pending + self._pending
+            raise
+
+        with self._lock:
+            self._segment_ids.extend(segment_ids)
+            needed = self._segments_needed()
+            should_compact = self._loaded_at is not None and len(self._segment_ids) > needed + self.COMPACT_SLACK
+        if should_compact:
+            self.compact()
+        return len(pending)
+
+    def _item_size(self, entry, terms):
+        """Kích thước ước lượng (bytes) của một feedback trong segment: entry + vị trí trong postings"""
+        return payload_size(entry) + sum(len(term) + 8 for term in terms)
+
+    def _segments_needed(self):
+        """Số segment tối thiểu để chứa toàn bộ chỉ mục (gọi khi giữ lock)"""
+        postings = sum(len(terms) for terms in self._terms.values())
+        size = sum(self._sizes.values())
+        return max(1, math.ceil(postings / self.MAX_SEGMENT_POSTINGS), math.ceil(size / self.MAX_SEGMENT_BYTES))
+
+    def _split_segments(self, items):
+        """Chia items (entry, terms) thành các segment trong giới hạn posting và kích thước"""
+        chunk = []
+        chunk_postings = 0
+        chunk_bytes = 0
+        for entry, terms in items:
+            size = self._item_size(entry, terms)
+            if chunk and (chunk_postings + len(terms) > self.MAX_SEGMENT_POSTINGS
+                          or chunk_bytes + size > self.MAX_SEGMENT_BYTES):
+                yield chunk, chunk_bytes
+                chunk = []
+                chunk_postings = 0
+                chunk_bytes = 0
+            chunk.append((entry, terms))
+            chunk_postings += len(terms)
+            chunk_bytes += size
+        if chunk:
+            yield chunk, chunk_bytes
+
+    def _write_segments(self, items):
+        """items: list (entry, terms). Returns: id các segment đã ghi"""
+        storage = self.firebase.storage
+        segment_ids = []
+        write_batch = storage.batch()
+        batch_bytes = 0
+        for chunk, chunk_bytes in self._split_segments(items):
+            if len(write_batch) and batch_bytes + chunk_bytes > self.MAX_BATCH_BYTES:
+                write_batch.commit()
+                write_batch = storage.batch()
+                batch_bytes = 0
+            postings = {}
+            for position, (_, terms) in enumerate(chunk):
+                for term in terms:
+                    postings.setdefault(term, []).append(position)
+
+            # seq theo thời gian ghi để segment sau ghi đè segment trước khi nạp
+            seq = time.time_ns()
+            segment_id = f"{seq}_{uuid.uuid4().hex[:6]}"
+            write_batch.set_doc(SEGMENTS_COLLECTION, segment_id, {
+                'seq': seq,
+                'size': len(chunk),
+                'docs': [entry for entry, _ in chunk],
+                'postings': postings
+            })
+            segment_ids.append(segment_id)
+            batch_bytes += chunk_bytes
+        write_batch.commit()
+        return segment_ids
+
+    def compact(self):
+        """Ghi lại toàn bộ chỉ mục trong bộ nhớ thành các segment đầy rồi xóa segment cũ"""
+        self._ensure_loaded()
+        with self._lock:
+            old_ids = list(self._segment_ids)
+            items = [(entry, self._terms.get(key, set())) for key, entry in self._docs.items()]
+
+        new_ids = self._write_segments(items)
+        self._delete_segments(old_ids)
+        with self._lock:
+            # Giữ các segment được flush trong lúc đang gộp
+            removed = set(old_ids)
+            self._segment_ids = new_ids + [segment_id for segment_id in self._segment_ids if segment_id not in removed]
+        print(f"Search index: gộp {len(old_ids)} segment thành {len(new_ids)}")
+
+    def _delete_segments(self, segment_ids):
+        storage = self.firebase.storage
+        for start in range(0, len(segment_ids), 400):
+            write_batch = storage.batch()
+            for segment_id in segment_ids[start:start + 400]:
+                write_batch.delete_doc(SEGMENTS_COLLECTION, segment_id)
+            write_batch.commit()
+
+    @operation('search')
+    def rebuild(self):
+        """Dựng lại chỉ mục từ toàn bộ feedback đang lưu"""
+        storage = self.firebase.storage
+        old_ids = [segment['id'] for segment in storage.query_docs(SEGMENTS_COLLECTION, 'seq', descending=False)]
+
+        items = []
+        for user_id, user_data in storage.stream_users():
+            if user_data.get('role') != 'user':
+                continue
+            if storage.embeds_feedbacks:
+                feedbacks = user_data.get('feedbacks', [])
+            else:
+                feedbacks, _ = storage.query_feedbacks(user_id)
+            for feedback in feedbacks:
+                if not feedback.get('id'):
+                    continue
+                content = feedback.get('noi_dung', '')
+                items.append(({
+                    'user_id': user_id,
+                    'feedback_id': feedback['id'],
+                    'email': user_data.get('email', ''),
+                    'thoi_gian': feedback.get('thoi_gian', ''),
+                    'snippet': content[:self.SNIPPET_LENGTH]
+                }, set(tokenize(content))))
+
+        self._write_segments(items)
+        self._delete_segments(old_ids)
+        with self._lock:
+            self._pending = []
+        self.reload()
+        return len(items)
+
+    @operation('search')
+    def search(self, query, limit=50):
+        """
+        Feedback chứa tất cả các term của query (không phân biệt dấu), mới nhất trước
+        Returns: list {user_id, feedback_id, email, thoi_gian, snippet}
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        self._ensure_loaded()
+        with self._lock:
+            # Giao các postings, bắt đầu từ term hiếm nhất
+            postings = sorted((self._postings.get(term, set()) for term in terms), key=len)
+            keys = set(postings[0])
+            for other in postings[1:]:
+                keys &= other
+                if not keys:
+                    break
+            results = [dict(self._docs[key]) for key in keys]
+
+        results.sort(key=lambda entry: feedback_sort_key({'thoi_gian': entry['thoi_gian']}), reverse=True)
+        return results[:limit]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'feedbacks': len(self._docs),
+                'terms': len(self._postings),
+                'segments': len(self._segment_ids),
+                'pending': len(self._pending)
+            }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chỉ mục tìm kiếm nội dung feedback")
+    parser.add_argument('query', nargs='?', help="Từ khóa cần tìm")
+    parser.add_argument('--rebuild', action='store_true', help="Dựng lại chỉ mục từ toàn bộ feedback")
+    args = parser.parse_args()
+
+    try:
+        index = SearchIndex()
+        if args.rebuild:
+            print(f"✅ Đã index {index.rebuild()} feedback")
+        if args.query:
+            started = time.perf_counter()
+            results = index.search(args.query)
+            print(f"{len(results)} kết quả ({(time.perf_counter() - started) * 1000:.1f} ms)")
+            for result in results[:20]:
+                print(f"- {result['thoi_gian']} {result['email']}: {result['snippet'][:80]}")
+    except Exception as e:
+        print(f"❌ Lỗi: {e}")
+        sys.exit(1)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Pool kết nối HTTP cho Google Sheets API.
+httplib2.Http không thread-safe, nên mỗi request mượn một Http riêng từ pool rồi trả lại;
+Http giữ kết nối keep-alive nên các request sau không phải bắt tay TLS lại.
+Token của service account được refresh một lần dưới lock, dùng chung cho mọi kết nối.
+"""
+import queue
+import threading
+from contextlib import contextmanager
+import httplib2
+import google_auth_httplib2
+from googleapiclient.errors import HttpError
+
+class SheetsHttpPool:
+    def __init__(self, credentials, size=4, timeout=60):
+        self.credentials = credentials
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()  # Kết nối dùng gần nhất còn ấm nhất
+        self._lock = threading.Lock()
+        self._token_lock = threading.Lock()
+        self.created = 0
+        self.discarded = 0
+        self.refreshes = 0
+
+    def _new_http(self):
+        return google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=self.timeout))
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self.created < self.size:
+                self.created += 1
+                return self._new_http()
+        # Đủ size kết nối đang được dùng, chờ một kết nối được trả lại
+        return self._idle.get()
+
+    def _ensure_token(self):
+        """Refresh token trước khi cần để các thread không cùng refresh một lúc"""
+        if self.credentials.valid:
+            return
+        with self._token_lock:
+            if not self.credentials.valid:
+                self.credentials.refresh(google_auth_httplib2.Request(httplib2.Http(timeout=self.timeout)))
+                self.refreshes += 1
+
+    @contextmanager
+    def connection(self):
+        """Mượn một AuthorizedHttp cho request.execute(http=...)"""
+        self._ensure_token()
+        http = self._checkout()
+        try:
+            yield http
+        except HttpError:
+            # Server trả lỗi HTTP bình thường, kết nối vẫn dùng tiếp được
+            self._idle.put(http)
+            raise
+        except Exception:
+            # Lỗi mạng: bỏ kết nối có thể đang hỏng, tạo mới ở lần sau
+            self._discard(http)
+            raise
+        else:
+            self._idle.put(http)
+
+    def _discard(self, http):
+        for connection in list(http.http.connections.values()):
+            try:
+                connection.close()
+            except Exception:
+                pass
+        with self._lock:
+            self.discarded += 1
+        # Thay bằng kết nối mới để số kết nối của pool không giảm
+        self._idle.put(self._new_http())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': self.size,
+                'created': self.created,
+                'idle': self._idle.qsize(),
+                'discarded': self.discarded,
+                'token_refreshes': self.refreshes
+            }
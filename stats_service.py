@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+import os
+import argparse
+from datetime import datetime, timedelta
+from init_firebase import FirebaseManager
+from metrics import operation
+
+class StatsService:
+    """
+    Thống kê hệ thống lưu trong một document stats/summary:
+    - students: số tài khoản học sinh
+    - graded_submissions: số feedback đã import
+    - activity.{YYYY-MM-DD}: số feedback được import trong ngày
+    Các counter được tăng cùng batch với dữ liệu (import, tạo tài khoản),
+    count aggregation query chỉ dùng để đối soát định kỳ.
+    """
+
+    STATS_COLLECTION = 'stats'
+    STATS_DOC = 'summary'
+
+    def __init__(self, firebase=None):
+        self.firebase = firebase or FirebaseManager()
+
+    def _increment_data(self, students=0, graded=0, activity=0):
+        counters = {}
+        if students:
+            counters['students'] = students
+        if graded:
+            counters['graded_submissions'] = graded
+        if activity:
+            today = datetime.now().strftime('%Y-%m-%d')
+            counters[f'activity.{today}'] = activity
+        return counters
+
+    def add_increments(self, write_batch, students=0, graded=0, activity=0):
+        """
+        Thêm thao tác tăng counter vào write_batch có sẵn, để counter được ghi
+        cùng lúc với dữ liệu. Returns: số thao tác đã thêm (0 hoặc 1)
+        """
+        counters = self._increment_data(students, graded, activity)
+        if not counters:
+            return 0
+        write_batch.increment(self.STATS_COLLECTION, self.STATS_DOC, counters)
+        return 1
+
+    def increment(self, students=0, graded=0, activity=0):
+        """Tăng counter ngay (dùng khi dữ liệu không được ghi bằng batch)"""
+        write_batch = self.firebase.storage.batch()
+        if self.add_increments(write_batch, students, graded, activity):
+            write_batch.commit()
+
+    @operation('admin_stats')
+    def get_stats(self):
+        """Đọc thống kê bằng một lần đọc document"""
+        try:
+            data = self.firebase.storage.get_doc(self.STATS_COLLECTION, self.STATS_DOC) or {}
+            today = datetime.now().strftime('%Y-%m-%d')
+            return {
+                'students': data.get('students', 0),
+                'graded_submissions': data.get('graded_submissions', 0),
+                'activity_today': data.get('activity', {}).get(today, 0),
+                'reconciled_at': data.get('reconciled_at'),
+                'reconcile_attempted_at': data.get('reconcile_attempted_at')
+            }
+        except Exception as e:
+            print(f"Lỗi đọc thống kê: {e}")
+            return {
+                'students': 0, 'graded_submissions': 0, 'activity_today': 0,
+                'reconciled_at': None, 'reconcile_attempted_at': None
+            }
+
+    @operation('stats_reconcile')
+    def reconcile(self):
+        """
+        Đối soát counter với count query của backend và ghi đè nếu lệch.
+        Khi feedback nằm trong user document (không có count query), graded_submissions được đếm
+        bằng cách đọc toàn bộ users, nên chỉ chạy ở thread nền/CLI (reconcile_if_stale), không chạy khi render trang.
+        Returns: dict giá trị đếm được
+        """
+        storage = self.firebase.storage
+        counted = {'students': storage.count_users(role='user')}
+
+        graded = storage.count_feedbacks()
+        if graded is None:
+            graded = sum(len(user_data.get('feedbacks', [])) for _, user_data in storage.stream_users())
+        counted['graded_submissions'] = graded
+
+        stored = self.get_stats()
+        for field, value in counted.items():
+            if stored.get(field) != value:
+                print(f"Thống kê lệch {field}: {stored.get(field)} -> {value}")
+
+        storage.set_doc(
+            self.STATS_COLLECTION, self.STATS_DOC,
+            dict(counted, reconciled_at=datetime.now().isoformat()), merge=True
+        )
+        return counted
+
+    def reconcile_if_stale(self, stats=None):
+        """
+        Đối soát nếu lần thử trước đã quá STATS_RECONCILE_HOURS giờ (mặc định 24).
+        Thời điểm thử được ghi trước khi đối soát nên lần lỗi cũng không bị thử lại ngay.
+        Returns: True nếu đã đối soát thành công
+        """
+        stats = stats or self.get_stats()
+        max_age = timedelta(hours=float(os.getenv('STATS_RECONCILE_HOURS', '24')))
+
+        last_attempt = max(filter(None, (stats.get('reconciled_at'), stats.get('reconcile_attempted_at'))), default=None)
+        if last_attempt and datetime.now() - datetime.fromisoformat(last_attempt) < max_age:
+            return False
+
+        try:
+            self.firebase.storage.set_doc(
+                self.STATS_COLLECTION, self.STATS_DOC,
+                {'reconcile_attempted_at': datetime.now().isoformat()}, merge=True
+            )
+            self.reconcile()
+            return True
+        except Exception as e:
+            print(f"Lỗi đối soát thống kê: {e}")
+            return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Đối soát counter thống kê (stats/summary)")
+    parser.add_argument('--if-stale', action='store_true', help="Chỉ chạy nếu đã quá STATS_RECONCILE_HOURS từ lần thử trước")
+    args = parser.parse_args()
+
+    try:
+        service = StatsService()
+        if args.if_stale:
+            if not service.reconcile_if_stale():
+                print("Chưa cần đối soát")
+        else:
+            print(service.reconcile())
+    except Exception as e:
+        print(f"❌ Lỗi: {e}")
@@ -0,0 +1,956 @@
+#!/usr/bin/env python3
+"""
+Lớp lưu trữ bên dưới FirebaseManager.
+Các service chỉ làm việc với interface StorageBackend (đọc user, batch ghi,
+upsert feedback theo id, query feedback theo trang, document phụ như stats/watermark/job).
+Backend được chọn bằng biến môi trường STORAGE_BACKEND:
+- firestore (mặc định): Firestore thật, theo FEEDBACK_STORAGE array/subcollection
+- memory: dữ liệu trong RAM, dùng cho benchmark/load test
+- sqlite: file SQLite (SQLITE_PATH), dùng để đo hiệu năng offline với dữ liệu lớn
+"""
+import copy
+import json
+import hashlib
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from resilience import call_with_retry, is_retryable_write_error
+
+# Format cột dấu thời gian trong sheet, ví dụ "17/10/2025 22:39:05"
+FEEDBACK_TIME_FORMAT = "%d/%m/%Y %H:%M:%S"
+
+# Bản sao phẳng của mọi feedback (kèm lớp, email, trạng thái) để admin duyệt theo lớp/khoảng thời gian
+FEEDBACK_INDEX_COLLECTION = 'feedback_index'
+
+# Các field danh sách feedback cần (không có nội dung đầy đủ và link), đọc bằng projection
+FEEDBACK_SUMMARY_FIELDS = ('id', 'thoi_gian', 'timestamp', 'trang_thai', 'preview')
+# Số ký tự tối đa của trích đoạn nội dung (field preview)
+PREVIEW_LENGTH = 160
+
+# Field của user document, đổi giá trị mỗi khi feedback của user được ghi/xóa (dùng làm ETag ở read API)
+FEEDBACK_VERSION_FIELD = 'feedback_version'
+
+def parse_feedback_time(time_str):
+    """Parse thời gian feedback từ string, trả về None nếu không parse được"""
+    try:
+        if not time_str:
+            return None
+        return datetime.strptime(time_str.strip(), FEEDBACK_TIME_FORMAT)
+    except (ValueError, AttributeError):
+        return None
+
+def make_feedback_id(email, thoi_gian, link_bai_lam):
+    """Id ổn định của feedback: cùng (email, dấu thời gian, link bài làm) luôn cho cùng id"""
+    key = '\x1f'.join((email or '', (thoi_gian or '').strip(), (link_bai_lam or '').strip()))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+def make_preview(text):
+    """Trích đoạn một dòng của nội dung feedback, cắt ở khoảng trắng và thêm '…' nếu quá dài"""
+    text = ' '.join((text or '').split())
+    if len(text) <= PREVIEW_LENGTH:
+        return text
+    return text[:PREVIEW_LENGTH].rsplit(' ', 1)[0] + '…'
+
+def project_feedback(feedback, fields):
+    """Chỉ giữ các field trong fields (None là giữ nguyên), preview tính từ noi_dung nếu chưa lưu"""
+    if fields is None:
+        return feedback
+    projected = {field: feedback[field] for field in fields if field in feedback}
+    if 'preview' in fields and 'preview' not in projected and 'noi_dung' in feedback:
+        projected['preview'] = make_preview(feedback['noi_dung'])
+    return projected
+
+def make_version_stamp():
+    """Giá trị mới cho FEEDBACK_VERSION_FIELD (tăng dần theo thời gian ghi)"""
+    return time.time_ns()
+
+def feedback_sort_key(feedback):
+    """Key sort feedback theo thời gian (dùng timestamp nếu có, không thì parse thoi_gian)"""
+    timestamp = feedback.get('timestamp')
+    if isinstance(timestamp, datetime):
+        return timestamp.replace(tzinfo=None)
+    if isinstance(timestamp, str) and timestamp:
+        try:
+            return datetime.fromisoformat(timestamp).replace(tzinfo=None)
+        except ValueError:
+            pass
+    return parse_feedback_time(feedback.get('thoi_gian', '')) or datetime.min
+
+def sort_feedbacks(feedbacks):
+    """Sort feedbacks theo thời gian mới nhất"""
+    return sorted(feedbacks, key=feedback_sort_key, reverse=True)
+
+def _firestore():
+    """firebase_admin.firestore, chỉ import khi dùng backend Firestore (import mất vài trăm ms)"""
+    from firebase_admin import firestore
+    return firestore
+
+def _set_path(data, path, value):
+    """Gán value theo đường dẫn dạng 'profile.ho_ten'"""
+    parts = path.split('.')
+    for part in parts[:-1]:
+        data = data.setdefault(part, {})
+    data[parts[-1]] = value
+
+def _get_path(data, path):
+    for part in path.split('.'):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+def _deep_merge(target, source):
+    """Merge source vào target giống set(merge=True) của Firestore"""
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _deep_merge(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+class StorageBackend:
+    """Interface chung cho các backend lưu trữ"""
+
+    name = 'base'
+    # True nếu feedbacks nằm trong user document (Firestore chế độ array)
+    embeds_feedbacks = False
+
+    def get_user(self, user_id):
+        """users/{user_id} dạng dict, None nếu không tồn tại"""
+        return self.get_users([user_id]).get(user_id)
+
+    def get_users(self, user_ids):
+        """Đọc nhiều user một lần, trả về {user_id: dict} (chỉ các user tồn tại)"""
+        raise NotImplementedError
+
+    def batch(self):
+        """
+        Tạo batch ghi (update_user, set_user, upsert_feedback, delete_feedback,
+        index_feedback, set_doc, delete_doc, increment, commit)
+        """
+        raise NotImplementedError
+
+    def get_feedbacks(self, keys):
+        """
+        Đọc các feedback theo id, keys: list (user_id, feedback_id)
+        Returns: {(user_id, feedback_id): dict} (chỉ các feedback tồn tại)
+        """
+        raise NotImplementedError
+
+    def query_feedbacks(self, user_id, limit=None, cursor=None, fields=None):
+        """
+        Feedbacks của user, mới nhất trước
+        fields: chỉ đọc các field này (projection, ví dụ FEEDBACK_SUMMARY_FIELDS), None là toàn bộ
+        Returns: (feedbacks, next_cursor) - next_cursor None khi đã hết
+        """
+        raise NotImplementedError
+
+    def query_feedback_index(self, lop=None, start=None, end=None, limit=None, cursor=None):
+        """
+        Feedback của mọi học sinh trong FEEDBACK_INDEX_COLLECTION, mới nhất trước
+        lop: lọc theo lớp, start/end: datetime, lọc start <= timestamp < end
+        Returns: (entries, next_cursor) - next_cursor None khi đã hết
+        """
+        raise NotImplementedError
+
+    def get_doc(self, collection, doc_id):
+        return self.get_docs(collection, [doc_id]).get(doc_id)
+
+    def get_docs(self, collection, doc_ids):
+        raise NotImplementedError
+
+    def set_doc(self, collection, doc_id, data, merge=False):
+        write_batch = self.batch()
+        write_batch.set_doc(collection, doc_id, data, merge=merge)
+        write_batch.commit()
+
+    def query_docs(self, collection, order_by, descending=True, limit=None):
+        """Các document trong collection, sort theo field order_by"""
+        raise NotImplementedError
+
+    def stream_users(self):
+        """Duyệt toàn bộ users, yield (user_id, dict)"""
+        raise NotImplementedError
+
+    def watch_users(self, on_changes):
+        """
+        Lắng nghe thay đổi của users: on_changes(list (user_id, dict hoặc None nếu bị xóa)),
+        lần gọi đầu tiên chứa toàn bộ users. Callback có thể chạy trên thread khác.
+        Returns: hàm dừng lắng nghe. NotImplementedError nếu backend không hỗ trợ
+        """
+        raise NotImplementedError
+
+    def watch_feedbacks(self, on_changes):
+        """
+        Như watch_users cho feedback lưu riêng (không embeds_feedbacks):
+        on_changes(list ((user_id, feedback_id), dict hoặc None))
+        """
+        raise NotImplementedError
+
+    def count_users(self, role=None):
+        raise NotImplementedError
+
+    def count_feedbacks(self):
+        """Tổng số feedback, None nếu backend không đếm được rẻ"""
+        return None
+
+    def test_connection(self):
+        return True
+
+def _index_sort_key(entry):
+    timestamp = entry.get('timestamp')
+    return timestamp.replace(tzinfo=None) if isinstance(timestamp, datetime) else datetime.min
+
+def _page(items, limit, cursor):
+    """Cắt trang theo offset cho các backend sort trong bộ nhớ"""
+    offset = cursor or 0
+    if limit is None:
+        return items[offset:], None
+    page = items[offset:offset + limit]
+    next_cursor = offset + limit if offset + limit < len(items) else None
+    return page, next_cursor
+
+class _PendingBatch:
+    """Batch ghi dạng danh sách thao tác, được backend áp dụng khi commit"""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.ops = []
+
+    def update_user(self, user_id, fields):
+        self.ops.append(('update_user', user_id, fields))
+
+    def set_user(self, user_id, data, merge=False):
+        self.ops.append(('set_user', user_id, data, merge))
+
+    def upsert_feedback(self, user_id, feedback, previous=None):
+        """Ghi feedback theo feedback['id'], previous là bản đang lưu (nếu có) bị thay thế"""
+        self.ops.append(('upsert_feedback', user_id, feedback))
+
+    def delete_feedback(self, user_id, feedback):
+        self.ops.append(('delete_feedback', user_id, feedback['id']))
+
+    def index_feedback(self, entry):
+        """Ghi/ghi đè bản phẳng của feedback, id là entry['feedback_id']"""
+        self.ops.append(('index_feedback', entry))
+
+    def set_doc(self, collection, doc_id, data, merge=False):
+        self.ops.append(('set_doc', collection, doc_id, data, merge))
+
+    def delete_doc(self, collection, doc_id):
+        self.ops.append(('delete_doc', collection, doc_id))
+
+    def increment(self, collection, doc_id, counters):
+        """counters: {field_path: số cần cộng}, ví dụ {'activity.2025-10-17': 1}"""
+        self.ops.append(('increment', collection, doc_id, counters))
+
+    def __len__(self):
+        return len(self.ops)
+
+    def commit(self):
+        if self.ops:
+            self.storage._apply(self.ops)
+
+class MemoryStorage(StorageBackend):
+    """Backend trong RAM, thread-safe, dữ liệu mất khi process kết thúc"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._users = {}
+        self._feedbacks = {}  # user_id -> {feedback_id: feedback}
+        self._docs = {}  # collection -> {doc_id: dict}
+        self._feedback_index = {}  # feedback_id -> entry
+        self._watchers = {'users': [], 'feedbacks': []}
+        self._lock = threading.RLock()
+
+    def get_users(self, user_ids):
+        with self._lock:
+            return {
+                user_id: copy.deepcopy(self._users[user_id])
+                for user_id in user_ids if user_id in self._users
+            }
+
+    def batch(self):
+        return _PendingBatch(self)
+
+    def _apply(self, ops):
+        with self._lock:
+            # Kiểm tra trước để batch được áp dụng nguyên vẹn hoặc không gì cả
+            for op in ops:
+                if op[0] == 'update_user' and op[1] not in self._users:
+                    raise KeyError(f"User {op[1]} không tồn tại")
+
+            changed_users = set()
+            changed_feedbacks = set()
+            for op in ops:
+                kind = op[0]
+                if kind == 'update_user':
+                    _, user_id, fields = op
+                    for path, value in fields.items():
+                        _set_path(self._users[user_id], path, copy.deepcopy(value))
+                    changed_users.add(user_id)
+                elif kind == 'set_user':
+                    _, user_id, data, merge = op
+                    if merge and user_id in self._users:
+                        _deep_merge(self._users[user_id], data)
+                    else:
+                        self._users[user_id] = copy.deepcopy(data)
+                    changed_users.add(user_id)
+                elif kind == 'upsert_feedback':
+                    _, user_id, feedback = op
+                    feedback = copy.deepcopy(feedback)
+                    feedback.setdefault('id', uuid.uuid4().hex[:20])
+                    self._feedbacks.setdefault(user_id, {})[feedback['id']] = feedback
+                    changed_feedbacks.add((user_id, feedback['id']))
+                elif kind == 'delete_feedback':
+                    _, user_id, feedback_id = op
+                    self._feedbacks.get(user_id, {}).pop(feedback_id, None)
+                    changed_feedbacks.add((user_id, feedback_id))
+                elif kind == 'index_feedback':
+                    _, entry = op
+                    self._feedback_index[entry['feedback_id']] = copy.deepcopy(entry)
+                elif kind == 'set_doc':
+                    _, collection, doc_id, data, merge = op
+                    docs = self._docs.setdefault(collection, {})
+                    if merge and doc_id in docs:
+                        _deep_merge(docs[doc_id], data)
+                    else:
+                        docs[doc_id] = copy.deepcopy(data)
+                elif kind == 'delete_doc':
+                    _, collection, doc_id = op
+                    self._docs.get(collection, {}).pop(doc_id, None)
+                elif kind == 'increment':
+                    _, collection, doc_id, counters = op
+                    doc = self._docs.setdefault(collection, {}).setdefault(doc_id, {})
+                    for path, amount in counters.items():
+                        _set_path(doc, path, (_get_path(doc, path) or 0) + amount)
+
+            # Báo thay đổi trong lock để listener nhận theo đúng thứ tự commit
+            if changed_users:
+                self._notify('users', [
+                    (user_id, copy.deepcopy(self._users.get(user_id))) for user_id in sorted(changed_users)
+                ])
+            if changed_feedbacks:
+                self._notify('feedbacks', [
+                    (key, copy.deepcopy(self._feedbacks.get(key[0], {}).get(key[1])))
+                    for key in sorted(changed_feedbacks)
+                ])
+
+    def _notify(self, kind, changes):
+        for on_changes in list(self._watchers[kind]):
+            on_changes(changes)
+
+    def _watch(self, kind, on_changes, snapshot):
+        with self._lock:
+            on_changes(snapshot())
+            self._watchers[kind].append(on_changes)
+
+        def stop():
+            with self._lock:
+                if on_changes in self._watchers[kind]:
+                    self._watchers[kind].remove(on_changes)
+        return stop
+
+    def watch_users(self, on_changes):
+        return self._watch('users', on_changes, lambda: [
+            (user_id, copy.deepcopy(user)) for user_id, user in self._users.items()
+        ])
+
+    def watch_feedbacks(self, on_changes):
+        return self._watch('feedbacks', on_changes, lambda: [
+            ((user_id, feedback_id), copy.deepcopy(feedback))
+            for user_id, feedbacks in self._feedbacks.items()
+            for feedback_id, feedback in feedbacks.items()
+        ])
+
+    def query_feedbacks(self, user_id, limit=None, cursor=None, fields=None):
+        with self._lock:
+            feedbacks = sort_feedbacks(self._feedbacks.get(user_id, {}).values())
+            page, next_cursor = _page(feedbacks, limit, cursor)
+            return copy.deepcopy([project_feedback(feedback, fields) for feedback in page]), next_cursor
+
+    def get_feedbacks(self, keys):
+        with self._lock:
+            found = {}
+            for user_id, feedback_id in keys:
+                feedback = self._feedbacks.get(user_id, {}).get(feedback_id)
+                if feedback is not None:
+                    found[(user_id, feedback_id)] = copy.deepcopy(feedback)
+            return found
+
+    def query_feedback_index(self, lop=None, start=None, end=None, limit=None, cursor=None):
+        with self._lock:
+            entries = [
+                entry for entry in self._feedback_index.values()
+                if (lop is None or entry.get('lop') == lop)
+                and (start is None or _index_sort_key(entry) >= start)
+                and (end is None or _index_sort_key(entry) < end)
+            ]
+            entries.sort(key=lambda entry: (_index_sort_key(entry), entry['feedback_id']), reverse=True)
+            page, next_cursor = _page(entries, limit, cursor)
+            return copy.deepcopy(page), next_cursor
+
+    def get_docs(self, collection, doc_ids):
+        with self._lock:
+            docs = self._docs.get(collection, {})
+            return {doc_id: copy.deepcopy(docs[doc_id]) for doc_id in doc_ids if doc_id in docs}
+
+    def query_docs(self, collection, order_by, descending=True, limit=None):
+        with self._lock:
+            docs = [
+                dict(copy.deepcopy(data), id=data.get('id', doc_id))
+                for doc_id, data in self._docs.get(collection, {}).items()
+                if order_by in data
+            ]
+        docs.sort(key=lambda doc: doc[order_by], reverse=descending)
+        return docs[:limit] if limit else docs
+
+    def stream_users(self):
+        with self._lock:
+            user_ids = sorted(self._users)
+        for user_id in user_ids:
+            user = self.get_user(user_id)
+            if user is not None:
+                yield user_id, user
+
+    def count_users(self, role=None):
+        with self._lock:
+            return sum(1 for user in self._users.values() if role is None or user.get('role') == role)
+
+    def count_feedbacks(self):
+        with self._lock:
+            return sum(len(feedbacks) for feedbacks in self._feedbacks.values())
+
+class _JSONEncoder(json.JSONEncoder):
+    def default(self, value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return super().default(value)
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, cls=_JSONEncoder)
+
+class SQLiteStorage(StorageBackend):
+    """
+    Backend SQLite: mỗi user/document là một dòng JSON, feedback là bảng riêng
+    có index (user_id, sort_ts) để query theo trang bằng keyset cursor
+    """
+
+    name = 'sqlite'
+    # Giới hạn số tham số của SQLite cho câu IN (...)
+    MAX_PARAMS = 500
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        with self._lock, self._conn:
+            if path != ':memory:':
+                self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id TEXT PRIMARY KEY,
+                    role TEXT,
+                    data TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS feedbacks (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id TEXT NOT NULL,
+                    fid TEXT,
+                    sort_ts TEXT NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS feedback_index (
+                    id TEXT PRIMARY KEY,
+                    lop TEXT,
+                    sort_ts TEXT NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_feedback_index_lop_ts
+                    ON feedback_index (lop, sort_ts DESC, id DESC);
+                CREATE INDEX IF NOT EXISTS idx_feedback_index_ts
+                    ON feedback_index (sort_ts DESC, id DESC);
+                CREATE TABLE IF NOT EXISTS docs (
+                    collection TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (collection, id)
+                );
+            ''')
+            # File tạo trước khi feedback có id ổn định chưa có cột fid
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(feedbacks)')]
+            if 'fid' not in columns:
+                self._conn.execute('ALTER TABLE feedbacks ADD COLUMN fid TEXT')
+            self._conn.executescript('''
+                CREATE INDEX IF NOT EXISTS idx_feedbacks_user_ts
+                    ON feedbacks (user_id, sort_ts DESC, seq DESC);
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_feedbacks_user_fid
+                    ON feedbacks (user_id, fid);
+            ''')
+
+    def get_users(self, user_ids):
+        users = {}
+        user_ids = list(user_ids)
+        with self._lock:
+            for start in range(0, len(user_ids), self.MAX_PARAMS):
+                chunk = user_ids[start:start + self.MAX_PARAMS]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    f'SELECT id, data FROM users WHERE id IN ({placeholders})', chunk
+                )
+                users.update((user_id, json.loads(data)) for user_id, data in rows)
+        return users
+
+    def batch(self):
+        return _PendingBatch(self)
+
+    def _apply(self, ops):
+        # Một transaction cho cả batch
+        with self._lock, self._conn:
+            for op in ops:
+                kind = op[0]
+                if kind == 'update_user':
+                    _, user_id, fields = op
+                    user = self._load_user(user_id)
+                    if user is None:
+                        raise KeyError(f"User {user_id} không tồn tại")
+                    for path, value in fields.items():
+                        _set_path(user, path, value)
+                    self._save_user(user_id, user)
+                elif kind == 'set_user':
+                    _, user_id, data, merge = op
+                    user = self._load_user(user_id) if merge else None
+                    if user is None:
+                        user = copy.deepcopy(data)
+                    else:
+                        _deep_merge(user, data)
+                    self._save_user(user_id, user)
+                elif kind == 'upsert_feedback':
+                    _, user_id, feedback = op
+                    sort_ts = feedback_sort_key(feedback).isoformat()
+                    self._conn.execute(
+                        '''INSERT INTO feedbacks (user_id, fid, sort_ts, data) VALUES (?, ?, ?, ?)
+                           ON CONFLICT (user_id, fid) DO UPDATE SET sort_ts = excluded.sort_ts, data = excluded.data''',
+                        (user_id, feedback.get('id'), sort_ts, _dumps(feedback))
+                    )
+                elif kind == 'delete_feedback':
+                    _, user_id, feedback_id = op
+                    # Feedback cũ không có fid được trả về với id là seq
+                    self._conn.execute(
+                        '''DELETE FROM feedbacks WHERE user_id = ?
+                           AND (fid = ? OR (fid IS NULL AND CAST(seq AS TEXT) = ?))''',
+                        (user_id, feedback_id, feedback_id)
+                    )
+                elif kind == 'index_feedback':
+                    _, entry = op
+                    self._conn.execute(
+                        'INSERT OR REPLACE INTO feedback_index (id, lop, sort_ts, data) VALUES (?, ?, ?, ?)',
+                        (entry['feedback_id'], entry.get('lop'), _index_sort_key(entry).isoformat(), _dumps(entry))
+                    )
+                elif kind == 'set_doc':
+                    _, collection, doc_id, data, merge = op
+                    doc = self._load_doc(collection, doc_id) if merge else None
+                    if doc is None:
+                        doc = copy.deepcopy(data)
+                    else:
+                        _deep_merge(doc, data)
+                    self._save_doc(collection, doc_id, doc)
+                elif kind == 'delete_doc':
+                    _, collection, doc_id = op
+                    self._conn.execute('DELETE FROM docs WHERE collection = ? AND id = ?', (collection, doc_id))
+                elif kind == 'increment':
+                    _, collection, doc_id, counters = op
+                    doc = self._load_doc(collection, doc_id) or {}
+                    for path, amount in counters.items():
+                        _set_path(doc, path, (_get_path(doc, path) or 0) + amount)
+                    self._save_doc(collection, doc_id, doc)
+
+    def _load_user(self, user_id):
+        row = self._conn.execute('SELECT data FROM users WHERE id = ?', (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _save_user(self, user_id, user):
+        self._conn.execute(
+            'INSERT OR REPLACE INTO users (id, role, data) VALUES (?, ?, ?)',
+            (user_id, user.get('role'), _dumps(user))
+        )
+
+    def _load_doc(self, collection, doc_id):
+        row = self._conn.execute(
+            'SELECT data FROM docs WHERE collection = ? AND id = ?', (collection, doc_id)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _save_doc(self, collection, doc_id, doc):
+        self._conn.execute(
+            'INSERT OR REPLACE INTO docs (collection, id, data) VALUES (?, ?, ?)',
+            (collection, doc_id, _dumps(doc))
+        )
+
+    def query_feedbacks(self, user_id, limit=None, cursor=None, fields=None):
+        if fields is None:
+            sql = 'SELECT seq, sort_ts, data FROM feedbacks WHERE user_id = ?'
+        else:
+            # Projection trong SQLite, nội dung đầy đủ không được đọc ra và parse
+            columns = ', '.join(f"'{field}', json_extract(data, '$.{field}')" for field in fields if field.isidentifier())
+            sql = f'SELECT seq, sort_ts, json_object({columns}) FROM feedbacks WHERE user_id = ?'
+        params = [user_id]
+        if cursor:
+            # Keyset cursor "sort_ts|seq" của feedback cuối trang trước
+            sort_ts, seq = cursor.rsplit('|', 1)
+            sql += ' AND (sort_ts < ? OR (sort_ts = ? AND seq < ?))'
+            params += [sort_ts, sort_ts, int(seq)]
+        sql += ' ORDER BY sort_ts DESC, seq DESC'
+        if limit is not None:
+            # Lấy dư 1 dòng để biết còn trang sau hay không
+            sql += ' LIMIT ?'
+            params.append(limit + 1)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit] if limit is not None else rows
+        feedbacks = []
+        for seq, _, data in rows:
+            feedback = json.loads(data)
+            if fields is not None:
+                feedback = {field: value for field, value in feedback.items() if value is not None}
+            feedback.setdefault('id', str(seq))
+            feedbacks.append(feedback)
+
+        next_cursor = f"{rows[-1][1]}|{rows[-1][0]}" if has_more else None
+        return feedbacks, next_cursor
+
+    def get_feedbacks(self, keys):
+        found = {}
+        with self._lock:
+            for user_id, feedback_id in keys:
+                row = self._conn.execute(
+                    'SELECT data FROM feedbacks WHERE user_id = ? AND fid = ?', (user_id, feedback_id)
+                ).fetchone()
+                if row:
+                    found[(user_id, feedback_id)] = json.loads(row[0])
+        return found
+
+    def query_feedback_index(self, lop=None, start=None, end=None, limit=None, cursor=None):
+        sql = 'SELECT id, sort_ts, data FROM feedback_index WHERE 1 = 1'
+        params = []
+        if lop is not None:
+            sql += ' AND lop = ?'
+            params.append(lop)
+        if start is not None:
+            sql += ' AND sort_ts >= ?'
+            params.append(start.isoformat())
+        if end is not None:
+            sql += ' AND sort_ts < ?'
+            params.append(end.isoformat())
+        if cursor:
+            # Keyset cursor "sort_ts|id" của entry cuối trang trước
+            sort_ts, entry_id = cursor.rsplit('|', 1)
+            sql += ' AND (sort_ts < ? OR (sort_ts = ? AND id < ?))'
+            params += [sort_ts, sort_ts, entry_id]
+        sql += ' ORDER BY sort_ts DESC, id DESC'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit + 1)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit] if limit is not None else rows
+        entries = [json.loads(data) for _, _, data in rows]
+        next_cursor = f"{rows[-1][1]}|{rows[-1][0]}" if has_more else None
+        return entries, next_cursor
+
+    def get_docs(self, collection, doc_ids):
+        with self._lock:
+            docs = {}
+            for doc_id in doc_ids:
+                doc = self._load_doc(collection, doc_id)
+                if doc is not None:
+                    docs[doc_id] = doc
+            return docs
+
+    def query_docs(self, collection, order_by, descending=True, limit=None):
+        with self._lock:
+            rows = self._conn.execute('SELECT id, data FROM docs WHERE collection = ?', (collection,)).fetchall()
+        docs = [dict(json.loads(data), id=doc_id) for doc_id, data in rows]
+        docs = [doc for doc in docs if order_by in doc]
+        docs.sort(key=lambda doc: doc[order_by], reverse=descending)
+        return docs[:limit] if limit else docs
+
+    def stream_users(self, page_size=500):
+        last_id = ''
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    'SELECT id, data FROM users WHERE id > ? ORDER BY id LIMIT ?', (last_id, page_size)
+                ).fetchall()
+            if not rows:
+                return
+            for user_id, data in rows:
+                yield user_id, json.loads(data)
+            last_id = rows[-1][0]
+
+    def count_users(self, role=None):
+        with self._lock:
+            if role is None:
+                return self._conn.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+            return self._conn.execute('SELECT COUNT(*) FROM users WHERE role = ?', (role,)).fetchone()[0]
+
+    def count_feedbacks(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM feedbacks').fetchone()[0]
+
+class _FirestoreBatch:
+    """
+    Batch ghi Firestore. Các thay đổi của cùng một user (field + feedback ở chế độ array)
+    được gộp thành một thao tác update khi commit. Ở chế độ array, feedback bị thay thế/xóa
+    được gỡ bằng ArrayRemove trong một thao tác riêng ngay trước đó.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._batch = storage.db.batch()
+        self._ops = 0
+        self._user_updates = {}  # user_id -> {field_path: value}
+        self._user_feedbacks = {}  # user_id -> [feedback] (chế độ array)
+        self._user_removals = {}  # user_id -> [feedback đang lưu cần gỡ] (chế độ array)
+
+    def update_user(self, user_id, fields):
+        self._user_updates.setdefault(user_id, {}).update(fields)
+
+    def set_user(self, user_id, data, merge=False):
+        self._batch.set(self.storage._user_ref(user_id), data, merge=merge)
+        self._ops += 1
+
+    def upsert_feedback(self, user_id, feedback, previous=None):
+        if self.storage.embeds_feedbacks:
+            if previous is not None:
+                self._user_removals.setdefault(user_id, []).append(previous)
+            self._user_feedbacks.setdefault(user_id, []).append(feedback)
+            return
+        self._batch.set(self.storage._feedbacks_ref(user_id).document(feedback['id']), feedback)
+        self._ops += 1
+
+    def delete_feedback(self, user_id, feedback):
+        if self.storage.embeds_feedbacks:
+            self._user_removals.setdefault(user_id, []).append(feedback)
+            return
+        self._batch.delete(self.storage._feedbacks_ref(user_id).document(feedback['id']))
+        self._ops += 1
+
+    def index_feedback(self, entry):
+        self.set_doc(FEEDBACK_INDEX_COLLECTION, entry['feedback_id'], entry)
+
+    def set_doc(self, collection, doc_id, data, merge=False):
+        self._batch.set(self.storage.db.collection(collection).document(doc_id), data, merge=merge)
+        self._ops += 1
+
+    def delete_doc(self, collection, doc_id):
+        self._batch.delete(self.storage.db.collection(collection).document(doc_id))
+        self._ops += 1
+
+    def increment(self, collection, doc_id, counters):
+        data = {}
+        for path, amount in counters.items():
+            _set_path(data, path, _firestore().Increment(amount))
+        self.set_doc(collection, doc_id, data, merge=True)
+
+    def __len__(self):
+        return self._ops + len(self._user_removals) + len(set(self._user_updates) | set(self._user_feedbacks))
+
+    def commit(self):
+        # Các thao tác trong batch được áp dụng theo thứ tự: gỡ bản cũ trước, thêm bản mới sau
+        for user_id, removed in self._user_removals.items():
+            self._batch.update(self.storage._user_ref(user_id), {'feedbacks': _firestore().ArrayRemove(removed)})
+
+        for user_id in set(self._user_updates) | set(self._user_feedbacks):
+            updates = dict(self._user_updates.get(user_id, {}))
+            feedbacks = self._user_feedbacks.get(user_id)
+            if feedbacks:
+                updates['feedbacks'] = _firestore().ArrayUnion(feedbacks)
+            self._batch.update(self.storage._user_ref(user_id), updates)
+
+        if len(self):
+            # Chỉ retry lỗi chắc chắn chưa ghi (contention/quota), batch có Increment không idempotent
+            call_with_retry(self._batch.commit, is_retryable=is_retryable_write_error, description="Firestore commit")
+
+class FirestoreStorage(StorageBackend):
+    """Backend Firestore, feedbacks lưu trong mảng (array) hoặc subcollection tùy FEEDBACK_STORAGE"""
+
+    name = 'firestore'
+
+    def __init__(self, db, subcollection=False):
+        self.db = db
+        self.subcollection = subcollection
+        self.embeds_feedbacks = not subcollection
+
+    def _user_ref(self, user_id):
+        return self.db.collection('users').document(user_id)
+
+    def _feedbacks_ref(self, user_id):
+        return self._user_ref(user_id).collection('feedbacks')
+
+    def _read(self, fn, description):
+        """Đọc có retry khi gặp lỗi tạm thời (đọc luôn idempotent)"""
+        return call_with_retry(fn, description=f"Firestore {description}")
+
+    def get_user(self, user_id):
+        user_doc = self._read(self._user_ref(user_id).get, 'get')
+        return user_doc.to_dict() if user_doc.exists else None
+
+    def get_users(self, user_ids):
+        refs = [self._user_ref(user_id) for user_id in user_ids]
+        if not refs:
+            return {}
+        snapshots = self._read(lambda: list(self.db.get_all(refs)), 'get_all')
+        return {snap.id: snap.to_dict() for snap in snapshots if snap.exists}
+
+    def batch(self):
+        return _FirestoreBatch(self)
+
+    def query_feedbacks(self, user_id, limit=None, cursor=None, fields=None):
+        if self.embeds_feedbacks:
+            # Mảng feedbacks nằm trong user document, cursor là offset
+            user_data = self.get_user(user_id) or {}
+            page, next_cursor = _page(sort_feedbacks(user_data.get('feedbacks', [])), limit, cursor)
+            return [project_feedback(feedback, fields) for feedback in page], next_cursor
+
+        feedbacks_ref = self._feedbacks_ref(user_id)
+        query = feedbacks_ref.order_by('timestamp', direction=_firestore().Query.DESCENDING)
+        if fields is not None:
+            # Server chỉ trả về các field được chọn (id lấy từ document id)
+            query = query.select([field for field in fields if field != 'id'])
+        if limit is None:
+            docs = self._read(lambda: list(query.stream()), 'query')
+            return [self._feedback_from_doc(doc) for doc in docs], None
+
+        if cursor:
+            # cursor là id của feedback cuối cùng ở trang trước
+            last_doc = self._read(feedbacks_ref.document(cursor).get, 'get')
+            if last_doc.exists:
+                query = query.start_after(last_doc)
+
+        # Lấy dư 1 document để biết còn trang sau hay không
+        page_query = query.limit(limit + 1)
+        docs = self._read(lambda: list(page_query.stream()), 'query')
+        page = [self._feedback_from_doc(doc) for doc in docs[:limit]]
+        next_cursor = docs[limit - 1].id if len(docs) > limit else None
+        return page, next_cursor
+
+    def get_feedbacks(self, keys):
+        if self.embeds_feedbacks:
+            # Feedback nằm trong user document, tìm theo id trong mảng
+            users = self.get_users(sorted({user_id for user_id, _ in keys}))
+            by_id = {
+                (user_id, feedback.get('id')): feedback
+                for user_id, user_data in users.items()
+                for feedback in user_data.get('feedbacks', [])
+            }
+            return {key: by_id[key] for key in keys if key in by_id}
+
+        refs = [self._feedbacks_ref(user_id).document(feedback_id) for user_id, feedback_id in keys]
+        if not refs:
+            return {}
+        snapshots = self._read(lambda: list(self.db.get_all(refs)), 'get_all')
+        return {
+            (snap.reference.parent.parent.id, snap.id): self._feedback_from_doc(snap)
+            for snap in snapshots if snap.exists
+        }
+
+    def query_feedback_index(self, lop=None, start=None, end=None, limit=None, cursor=None):
+        # Lọc lớp + khoảng thời gian cần composite index (lop ASC, timestamp DESC)
+        index_ref = self.db.collection(FEEDBACK_INDEX_COLLECTION)
+        query = index_ref
+        if lop is not None:
+            query = query.where(filter=_firestore().FieldFilter('lop', '==', lop))
+        if start is not None:
+            query = query.where(filter=_firestore().FieldFilter('timestamp', '>=', start))
+        if end is not None:
+            query = query.where(filter=_firestore().FieldFilter('timestamp', '<', end))
+        query = query.order_by('timestamp', direction=_firestore().Query.DESCENDING)
+        if limit is None:
+            docs = self._read(lambda: list(query.stream()), 'query')
+            return [doc.to_dict() for doc in docs], None
+
+        if cursor:
+            # cursor là id của entry cuối cùng ở trang trước
+            last_doc = self._read(index_ref.document(cursor).get, 'get')
+            if last_doc.exists:
+                query = query.start_after(last_doc)
+
+        page_query = query.limit(limit + 1)
+        docs = self._read(lambda: list(page_query.stream()), 'query')
+        page = [doc.to_dict() for doc in docs[:limit]]
+        next_cursor = docs[limit - 1].id if len(docs) > limit else None
+        return page, next_cursor
+
+    def _feedback_from_doc(self, doc):
+        feedback = doc.to_dict()
+        feedback['id'] = doc.id
+        return feedback
+
+    def get_docs(self, collection, doc_ids):
+        refs = [self.db.collection(collection).document(doc_id) for doc_id in doc_ids]
+        if not refs:
+            return {}
+        snapshots = self._read(lambda: list(self.db.get_all(refs)), 'get_all')
+        return {snap.id: snap.to_dict() for snap in snapshots if snap.exists}
+
+    def query_docs(self, collection, order_by, descending=True, limit=None):
+        direction = _firestore().Query.DESCENDING if descending else _firestore().Query.ASCENDING
+        query = self.db.collection(collection).order_by(order_by, direction=direction)
+        if limit:
+            query = query.limit(limit)
+        docs = self._read(lambda: list(query.stream()), 'query')
+        return [dict(doc.to_dict(), id=doc.id) for doc in docs]
+
+    def stream_users(self):
+        for doc in self.db.collection('users').stream():
+            yield doc.id, doc.to_dict()
+
+    def _is_removed(self, change):
+        return change.type.name == 'REMOVED'
+
+    def watch_users(self, on_changes):
+        def callback(snapshots, changes, read_time):
+            on_changes([
+                (change.document.id, None if self._is_removed(change) else change.document.to_dict())
+                for change in changes
+            ])
+        return self.db.collection('users').on_snapshot(callback).unsubscribe
+
+    def watch_feedbacks(self, on_changes):
+        if self.embeds_feedbacks:
+            raise NotImplementedError("Feedback nằm trong user document, dùng watch_users")
+
+        def callback(snapshots, changes, read_time):
+            on_changes([
+                (
+                    (change.document.reference.parent.parent.id, change.document.id),
+                    None if self._is_removed(change) else self._feedback_from_doc(change.document)
+                )
+                for change in changes
+            ])
+        return self.db.collection_group('feedbacks').on_snapshot(callback).unsubscribe
+
+    def count_users(self, role=None):
+        query = self.db.collection('users')
+        if role is not None:
+            query = query.where(filter=_firestore().FieldFilter('role', '==', role))
+        return self._read(lambda: query.count().get()[0][0].value, 'count')
+
+    def count_feedbacks(self):
+        if self.embeds_feedbacks:
+            return None
+        return self._read(lambda: self.db.collection_group('feedbacks').count().get()[0][0].value, 'count')
+
+    def test_connection(self):
+        # Thử đọc một collection để test
+        list(self.db.collection('test').limit(1).stream())
+        return True
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Kiểm tra import từ Google Sheets trên MemoryStorage với Sheets API giả (không cần mạng/credentials).
+
+    python -m pytest -q test_import.py
+"""
+import re
+import pytest
+from init_firebase import FirebaseManager
+from storage import MemoryStorage
+from stats_service import StatsService
+from ggsheet_extract import GoogleSheetsExtractor
+from migrate_feedbacks import FeedbackMigrator
+from feedback_index import FeedbackIndex
+from search_index import SearchIndex
+
+HEADER = ['Dấu thời gian', 'Họ tên', 'Lớp', 'SĐT', 'Email', 'Link bài làm', 'Trạng thái', 'Feedback']
+SOURCES = [{'sheet_id': 'sheet', 'tabs': None}]
+
+class FakeRequest:
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self, **kwargs):
+        return self.result
+
+class FakeSheets:
+    """Giả lập spreadsheets().get / values().batchGet trên các tab {title: values}"""
+
+    def __init__(self, tabs):
+        self.tabs = tabs
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def get(self, spreadsheetId, **kwargs):
+        return FakeRequest({
+            'properties': {'title': 'Sheet'},
+            'sheets': [{'properties': {'title': title, 'sheetId': i, 'index': i}} for i, title in enumerate(self.tabs)]
+        })
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs):
+        value_ranges = []
+        for value_range in ranges:
+            title, start, end = re.match(r"'(.*)'!A(\d*):H(\d*)", value_range).groups()
+            start = int(start or 1)
+            values = self.tabs[title][start - 1:int(end) if end else None]
+            value_ranges.append({'range': value_range, 'values': values})
+        return FakeRequest({'valueRanges': value_ranges})
+
+def make_row(day, email='a@x.com', status='Đã chấm', feedback=None, lop='10A1'):
+    return [
+        f"{day:02d}/10/2025 10:00:00", 'A', lop, '0900000000', email,
+        f"https://example.com/{day}", status, feedback if feedback is not None else f"Feedback bài {day}"
+    ]
+
+def add_user(storage, user_id, email, feedbacks=None):
+    write_batch = storage.batch()
+    user_data = {'email': email, 'role': 'user', 'profile': {'ho_ten': 'A', 'lop': '10A1'}}
+    if feedbacks is not None:
+        user_data['feedbacks'] = feedbacks
+    write_batch.set_user(user_id, user_data)
+    write_batch.commit()
+
+@pytest.fixture
+def storage():
+    storage = MemoryStorage()
+    add_user(storage, 'a_x_com', 'a@x.com')
+    return storage
+
+def make_extractor(storage, rows, search_index=None):
+    firebase = FirebaseManager(storage=storage)
+    extractor = GoogleSheetsExtractor(firebase=firebase, search_index=search_index)
+    extractor.service = FakeSheets({'Tab': rows})
+    # Không có http_pool/quota thật, chạy request giả trực tiếp
+    extractor._execute = lambda request: request.execute()
+    return extractor
+
+def feedback_ids(storage, user_id='a_x_com'):
+    feedbacks, _ = storage.query_feedbacks(user_id)
+    return sorted(feedback['id'] for feedback in feedbacks)
+
+@pytest.mark.parametrize('batch', [True, False])
+def test_reimport_is_idempotent(storage, batch):
+    rows = [HEADER, make_row(1), make_row(2)]
+    extractor = make_extractor(storage, rows)
+
+    first = extractor.run_import(SOURCES, batch=batch, incremental=False)
+    second = extractor.run_import(SOURCES, batch=batch, incremental=False)
+
+    assert first['written']['feedbacks'] == 2
+    assert second['written']['feedbacks'] == 0
+    assert len(feedback_ids(storage)) == 2
+    assert StatsService(extractor.firebase).get_stats()['graded_submissions'] == 2
+
+def test_migrated_feedbacks_are_not_duplicated_by_reimport(storage):
+    # Feedback cũ trong mảng users/{id}.feedbacks chưa có id
+    legacy = [
+        {'thoi_gian': row[0], 'noi_dung': row[7], 'link_bai_lam': row[5], 'trang_thai': row[6], 'preview': row[7]}
+        for row in (make_row(1), make_row(2))
+    ]
+    write_batch = storage.batch()
+    for feedback in legacy:
+        doc_id, doc = FeedbackMigrator.feedback_doc('a@x.com', feedback)
+        assert doc['id'] == doc_id
+        write_batch.upsert_feedback('a_x_com', doc)
+    write_batch.commit()
+    migrated = feedback_ids(storage)
+
+    extractor = make_extractor(storage, [HEADER, make_row(1), make_row(2)])
+    result = extractor.run_import(SOURCES, incremental=False)
+
+    assert result['written']['feedbacks'] == 0
+    assert feedback_ids(storage) == migrated
+    assert StatsService(extractor.firebase).get_stats()['graded_submissions'] == 0
+
+@pytest.mark.parametrize('batch', [True, False])
+def test_incremental_rereads_row_once_graded(storage, batch):
+    rows = [HEADER, make_row(1), make_row(2, status='', feedback=''), make_row(3)]
+    extractor = make_extractor(storage, rows)
+
+    first = extractor.run_import(SOURCES, batch=batch)
+    assert first['rows_read'] == 3
+    assert len(feedback_ids(storage)) == 2
+
+    # Giáo viên chấm dòng 2 sau lần import đầu: watermark dừng trước dòng này nên đọc lại được
+    rows[2] = make_row(2)
+    second = extractor.run_import(SOURCES, batch=batch)
+    assert second['rows_read'] == 2
+    assert second['written']['feedbacks'] == 1
+    assert len(feedback_ids(storage)) == 3
+
+    third = extractor.run_import(SOURCES, batch=batch)
+    assert third['rows_read'] == 0
+
+@pytest.mark.parametrize('batch', [True, False])
+def test_unknown_user_does_not_hold_watermark(storage, batch):
+    rows = [HEADER, make_row(1, email='b@x.com'), make_row(2)]
+    extractor = make_extractor(storage, rows)
+
+    first = extractor.run_import(SOURCES, batch=batch)
+    assert first['failed'] == 1
+    assert [(item['email'], item['row']) for item in first['unresolved_users']] == [('b@x.com', 2)]
+
+    rows.append(make_row(3))
+    second = extractor.run_import(SOURCES, batch=batch)
+    assert second['rows_read'] == 1
+    assert second['unresolved_users'] == []
+
+    # Sau khi tạo tài khoản, import --full lấy lại các dòng đã bỏ qua
+    add_user(storage, 'b_x_com', 'b@x.com')
+    full = extractor.run_import(SOURCES, batch=batch, incremental=False)
+    assert full['written']['feedbacks'] == 1
+    assert len(feedback_ids(storage, 'b_x_com')) == 1
+
+@pytest.mark.parametrize('batch', [True, False])
+def test_class_change_updates_feedback_index(storage, batch):
+    rows = [HEADER, make_row(1), make_row(2)]
+    extractor = make_extractor(storage, rows)
+    extractor.run_import(SOURCES, batch=batch)
+
+    # Học sinh chuyển lớp: các feedback cũ cũng phải duyệt được theo lớp mới
+    rows.append(make_row(3, lop='11A1'))
+    result = extractor.run_import(SOURCES, batch=batch)
+    assert result['written'] == {'feedbacks': 1, 'profiles': 1}
+
+    index = FeedbackIndex(extractor.firebase)
+    entries, _ = index.browse(lop='11A1')
+    assert sorted(entry['feedback_id'] for entry in entries) == feedback_ids(storage)
+    assert index.browse(lop='10A1') == ([], None)
+
+def test_imported_feedbacks_are_searchable(storage):
+    firebase = FirebaseManager(storage=storage)
+    rows = [HEADER, make_row(1, feedback="Luận điểm chưa rõ"), make_row(2, feedback="Bài làm tốt")]
+    extractor = make_extractor(storage, rows, search_index=SearchIndex(firebase))
+
+    assert extractor.run_import(SOURCES)['search_index_error'] is None
+    rows[1] = make_row(1, feedback="Luận điểm đã rõ hơn")
+    extractor.run_import(SOURCES, incremental=False)
+
+    results = SearchIndex(firebase).search('luan diem')
+    assert [entry['snippet'] for entry in results] == ["Luận điểm đã rõ hơn"]
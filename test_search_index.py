@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Kiểm tra chỉ mục tìm kiếm feedback trên MemoryStorage: ghi segment, nạp lại từ storage, sửa feedback.
+
+    python -m pytest -q test_search_index.py
+"""
+import pytest
+from init_firebase import FirebaseManager
+from storage import MemoryStorage
+from search_index import SEGMENTS_COLLECTION, SearchIndex
+
+def make_feedback(day, noi_dung):
+    return {'id': f"f{day}", 'thoi_gian': f"{day:02d}/10/2025 10:00:00", 'noi_dung': noi_dung}
+
+@pytest.fixture
+def firebase():
+    return FirebaseManager(storage=MemoryStorage())
+
+def test_search_after_reload(firebase):
+    index = SearchIndex(firebase)
+    index.add_feedback('u1', 'a@x.com', make_feedback(1, "Luận điểm chưa rõ ràng"))
+    index.add_feedback('u2', 'b@x.com', make_feedback(2, "Cần thêm dẫn chứng cho luận điểm"))
+    index.add_feedback('u2', 'b@x.com', make_feedback(3, "Bài làm tốt"))
+    index.flush()
+
+    # Instance mới chỉ có dữ liệu đã lưu trong các segment
+    reloaded = SearchIndex(firebase)
+    results = reloaded.search('luan diem')
+    assert [(entry['user_id'], entry['feedback_id']) for entry in results] == [('u2', 'f2'), ('u1', 'f1')]
+    assert reloaded.search('LUẬN ĐIỂM rõ') == [dict(results[1])]
+    assert reloaded.search('không có') == []
+
+def test_edited_feedback_replaces_old_terms(firebase):
+    index = SearchIndex(firebase)
+    index.add_feedback('u1', 'a@x.com', make_feedback(1, "Thiếu mở bài"))
+    index.flush()
+    index.add_feedback('u1', 'a@x.com', make_feedback(1, "Thiếu kết bài"))
+    index.flush()
+
+    reloaded = SearchIndex(firebase)
+    assert reloaded.search('mo bai') == []
+    assert [entry['snippet'] for entry in reloaded.search('ket bai')] == ["Thiếu kết bài"]
+    assert reloaded.stats()['feedbacks'] == 1
+
+def test_pending_feedback_is_searchable_before_flush(firebase):
+    index = SearchIndex(firebase)
+    index.search('bai')
+    index.add_feedback('u1', 'a@x.com', make_feedback(1, "Bài văn hay"))
+    assert len(index.search('van hay')) == 1
+    assert SearchIndex(firebase).search('van hay') == []
+
+def test_large_flush_is_split_into_segments(firebase):
+    index = SearchIndex(firebase)
+    index.MAX_SEGMENT_POSTINGS = 50
+    for day in range(1, 29):
+        index.add_feedback('u1', 'a@x.com', make_feedback(day, f"chung tu{day} " + ' '.join(f"w{n}" for n in range(10))))
+    index.flush()
+
+    segments = firebase.storage.query_docs(SEGMENTS_COLLECTION, 'seq')
+    assert len(segments) > 1
+    assert all(sum(len(positions) for positions in segment['postings'].values()) <= 50 for segment in segments)
+
+    reloaded = SearchIndex(firebase)
+    assert len(reloaded.search('chung w3')) == 28
+    assert [entry['feedback_id'] for entry in reloaded.search('tu7')] == ['f7']
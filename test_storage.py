@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Kiểm tra MemoryStorage và SQLiteStorage cho cùng kết quả với các thao tác đọc/ghi feedback.
+
+    python -m pytest -q test_storage.py
+"""
+from datetime import datetime
+import pytest
+from storage import FEEDBACK_SUMMARY_FIELDS, MemoryStorage, SQLiteStorage, make_preview
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def storage(request):
+    storage = MemoryStorage() if request.param == 'memory' else SQLiteStorage()
+    write_batch = storage.batch()
+    write_batch.set_user('u1', {'email': 'a@x.com', 'role': 'user', 'profile': {'ho_ten': 'A', 'lop': '10A1'}})
+    for day in range(1, 6):
+        write_batch.upsert_feedback('u1', make_feedback(day))
+    write_batch.upsert_feedback('u2', make_feedback(9))
+    write_batch.commit()
+    return storage
+
+def make_feedback(day, noi_dung=None):
+    noi_dung = noi_dung or f"Nội dung bài {day} " * 20
+    return {
+        'id': f"f{day}",
+        'thoi_gian': f"{day:02d}/10/2025 10:00:00",
+        'timestamp': datetime(2025, 10, day, 10),
+        'noi_dung': noi_dung,
+        'link_bai_lam': f"https://example.com/{day}",
+        'trang_thai': 'Đã chấm',
+        'preview': make_preview(noi_dung)
+    }
+
+def collect_pages(storage, limit, fields=None):
+    pages = []
+    cursor = None
+    while True:
+        page, cursor = storage.query_feedbacks('u1', limit=limit, cursor=cursor, fields=fields)
+        pages.append(page)
+        if cursor is None:
+            return pages
+
+def test_query_feedbacks_newest_first(storage):
+    feedbacks, cursor = storage.query_feedbacks('u1')
+    assert [feedback['id'] for feedback in feedbacks] == ['f5', 'f4', 'f3', 'f2', 'f1']
+    assert cursor is None
+
+def test_query_feedbacks_paging(storage):
+    pages = collect_pages(storage, limit=2)
+    assert [[feedback['id'] for feedback in page] for page in pages] == [['f5', 'f4'], ['f3', 'f2'], ['f1']]
+
+def test_query_feedbacks_exact_page_has_no_next_cursor(storage):
+    page, cursor = storage.query_feedbacks('u1', limit=5)
+    assert len(page) == 5
+    assert cursor is None
+
+def test_query_feedbacks_projection(storage):
+    pages = collect_pages(storage, limit=3, fields=FEEDBACK_SUMMARY_FIELDS)
+    feedbacks = [feedback for page in pages for feedback in page]
+    assert [feedback['id'] for feedback in feedbacks] == ['f5', 'f4', 'f3', 'f2', 'f1']
+    for feedback in feedbacks:
+        assert set(feedback) == set(FEEDBACK_SUMMARY_FIELDS)
+        assert feedback['preview'].endswith('…')
+
+def test_query_feedbacks_unknown_user(storage):
+    assert storage.query_feedbacks('nobody', limit=2) == ([], None)
+
+def test_get_feedbacks(storage):
+    found = storage.get_feedbacks([('u1', 'f2'), ('u2', 'f9'), ('u1', 'missing'), ('u2', 'f2')])
+    assert set(found) == {('u1', 'f2'), ('u2', 'f9')}
+    assert found[('u1', 'f2')]['link_bai_lam'] == 'https://example.com/2'
+
+def test_batch_replaces_and_deletes_feedback(storage):
+    write_batch = storage.batch()
+    write_batch.upsert_feedback('u1', make_feedback(3, noi_dung='Đã sửa'), previous=make_feedback(3))
+    write_batch.delete_feedback('u1', make_feedback(4))
+    write_batch.update_user('u1', {'profile.lop': '11A1'})
+    write_batch.commit()
+
+    feedbacks, _ = storage.query_feedbacks('u1')
+    assert [feedback['id'] for feedback in feedbacks] == ['f5', 'f3', 'f2', 'f1']
+    assert feedbacks[1]['noi_dung'] == 'Đã sửa'
+    assert storage.get_feedbacks([('u1', 'f4')]) == {}
+    assert storage.get_user('u1')['profile'] == {'ho_ten': 'A', 'lop': '11A1'}
+
+def test_batch_is_all_or_nothing(storage):
+    write_batch = storage.batch()
+    write_batch.delete_feedback('u1', make_feedback(5))
+    write_batch.update_user('missing', {'profile.lop': '11A1'})
+    with pytest.raises(Exception):
+        write_batch.commit()
+
+    feedbacks, _ = storage.query_feedbacks('u1')
+    assert len(feedbacks) == 5
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Bản sao trong RAM của collection users (và feedback lưu riêng ở chế độ subcollection),
+cập nhật liên tục qua snapshot listener của storage. Login và dashboard học sinh đọc từ
+bản sao này mà không tốn round trip nào. Bật bằng USER_MIRROR=1.
+
+Trong lúc listener chưa nhận xong snapshot đầu tiên (đang warm up), khi backend không hỗ trợ
+listener, hoặc khi dữ liệu vượt USER_MIRROR_MAX_MB, service đọc trực tiếp storage như bình thường.
+"""
+import os
+import time
+import threading
+from metrics import operation, payload_size
+from storage import project_feedback, sort_feedbacks
+
+class UserMirror:
+    def __init__(self, firebase, max_bytes=None):
+        self.firebase = firebase
+        self.max_bytes = max_bytes if max_bytes is not None else int(
+            float(os.getenv('USER_MIRROR_MAX_MB', '512')) * 1024 * 1024
+        )
+        self._lock = threading.Lock()
+        self._users = {}  # user_id -> dict
+        self._feedbacks = {}  # user_id -> {feedback_id: dict} (chế độ subcollection)
+        # Kích thước ước lượng (JSON) của từng document để tính tổng bộ nhớ
+        self._sizes = {}  # user_id hoặc (user_id, feedback_id) -> bytes
+        self.bytes = 0
+        self.updates = 0
+        self.last_update = None
+        self.disabled_reason = None
+        self._mirrors_feedbacks = not firebase.storage.embeds_feedbacks
+        self._users_ready = False
+        self._feedbacks_ready = not self._mirrors_feedbacks
+        self._stops = []
+
+    @property
+    def ready(self):
+        """True khi đã nhận đủ snapshot đầu tiên, có thể phục vụ đọc từ bản sao"""
+        return self._users_ready and self._feedbacks_ready and self.disabled_reason is None
+
+    def start(self):
+        """Đăng ký listener. Returns: False nếu backend không hỗ trợ (service đọc trực tiếp)"""
+        storage = self.firebase.storage
+        try:
+            self._stops.append(storage.watch_users(self._on_user_changes))
+            if self._mirrors_feedbacks:
+                self._stops.append(storage.watch_feedbacks(self._on_feedback_changes))
+        except NotImplementedError:
+            self.stop(f"Backend {storage.name} không hỗ trợ snapshot listener")
+            return False
+        print(f"User mirror: đã đăng ký listener ({storage.name})")
+        return True
+
+    def stop(self, reason="Đã dừng"):
+        """Hủy listener và giải phóng bản sao, các lần đọc sau đi thẳng tới storage"""
+        self._disable(reason)
+        self._unsubscribe()
+
+    def _disable(self, reason):
+        with self._lock:
+            self.disabled_reason = reason
+            self._users = {}
+            self._feedbacks = {}
+            self._sizes = {}
+            self.bytes = 0
+
+    def _unsubscribe(self):
+        stops, self._stops = self._stops, []
+        for stop in stops:
+            try:
+                stop()
+            except Exception as e:
+                print(f"User mirror: lỗi hủy listener: {e}")
+
+    def _account(self, key, value):
+        """Cập nhật tổng bộ nhớ khi document key đổi thành value (None nếu bị xóa)"""
+        size = payload_size(value) if value is not None else 0
+        self.bytes += size - self._sizes.pop(key, 0)
+        if value is not None:
+            self._sizes[key] = size
+
+    @operation('user_mirror')
+    def _on_user_changes(self, changes):
+        with self._lock:
+            if self.disabled_reason is not None:
+                return
+            for user_id, user_data in changes:
+                if user_data is None:
+                    self._users.pop(user_id, None)
+                else:
+                    self._users[user_id] = user_data
+                self._account(user_id, user_data)
+            self._users_ready = True
+            self._record_update()
+        self._check_memory()
+
+    @operation('user_mirror')
+    def _on_feedback_changes(self, changes):
+        with self._lock:
+            if self.disabled_reason is not None:
+                return
+            for (user_id, feedback_id), feedback in changes:
+                feedbacks = self._feedbacks.setdefault(user_id, {})
+                if feedback is None:
+                    feedbacks.pop(feedback_id, None)
+                else:
+                    feedbacks[feedback_id] = feedback
+                self._account((user_id, feedback_id), feedback)
+            self._feedbacks_ready = True
+            self._record_update()
+        self._check_memory()
+
+    def _record_update(self):
+        self.updates += 1
+        self.last_update = time.time()
+
+    def _check_memory(self):
+        if self.bytes > self.max_bytes:
+            megabytes = self.bytes / 1024 / 1024
+            print(f"User mirror: {megabytes:.1f} MB vượt giới hạn USER_MIRROR_MAX_MB, chuyển về đọc trực tiếp")
+            self._disable(f"Vượt giới hạn bộ nhớ ({megabytes:.1f} MB)")
+            # Đang ở trong callback của listener, hủy listener trên thread khác
+            threading.Thread(target=self._unsubscribe, daemon=True).start()
+
+    def get_user(self, user_id):
+        """users/{user_id} từ bản sao, None nếu không tồn tại (chỉ gọi khi ready)"""
+        with self._lock:
+            return self._users.get(user_id)
+
+    def get_feedback(self, user_id, feedback_id):
+        """Feedback đầy đủ từ bản sao (chế độ subcollection), None nếu không tồn tại"""
+        with self._lock:
+            return self._feedbacks.get(user_id, {}).get(feedback_id)
+
+    def query_feedbacks(self, user_id, limit=None, cursor=None, fields=None):
+        """
+        Như StorageBackend.query_feedbacks ở chế độ subcollection (cursor là id feedback
+        cuối trang trước), để chuyển qua lại giữa bản sao và storage giữa chừng vẫn đúng trang
+        """
+        with self._lock:
+            feedbacks = sort_feedbacks(self._feedbacks.get(user_id, {}).values())
+
+        if isinstance(cursor, int):
+            # Cursor offset của trang đọc trực tiếp lúc bản sao còn đang warm up (backend memory)
+            feedbacks = feedbacks[cursor:]
+        elif cursor:
+            ids = [feedback['id'] for feedback in feedbacks]
+            feedbacks = feedbacks[ids.index(cursor) + 1:] if cursor in ids else feedbacks
+        if limit is None:
+            return [project_feedback(feedback, fields) for feedback in feedbacks], None
+        page = feedbacks[:limit]
+        next_cursor = page[-1]['id'] if len(feedbacks) > limit else None
+        return [project_feedback(feedback, fields) for feedback in page], next_cursor
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ready': self.ready,
+                'users': len(self._users),
+                'feedbacks': sum(len(feedbacks) for feedbacks in self._feedbacks.values()),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'updates': self.updates,
+                'last_update': self.last_update,
+                'disabled_reason': self.disabled_reason
+            }